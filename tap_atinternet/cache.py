@@ -0,0 +1,141 @@
+"""Local on-disk cache of AT Internet API responses."""
+import gzip
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import requests
+from urllib3 import HTTPResponse
+
+
+class ResponseCache:
+    """
+    On-disk cache of getData response bodies, keyed by a hash of the request URL and payload.
+
+    The URL identifies the API (and its version, see the `api_url` setting), and the payload everything else
+    identifying a response (site, columns, period, filter, page), so the same request on a closed period always
+    gets the same response: reruns can be served from the local disk instead
+    of the API. Bodies are stored gzip-compressed, one file per response. Entries expire after `ttl_days`, and
+    the oldest entries are evicted when the cache grows over `max_size_mb`.
+
+    Only responses of closed periods should be cached, since the data of the current month still changes.
+    """
+
+    def __init__(self, directory: str, ttl_days: float = 30, max_size_mb: float = 500):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl_days * 24 * 3600
+        self.max_size = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = sum(path.stat().st_size for path in self._entries())
+
+    @staticmethod
+    def get_key(prepared_request: requests.PreparedRequest) -> str:
+        body = prepared_request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        url = (prepared_request.url or "").encode()
+        return hashlib.sha256(url + b"\n" + body).hexdigest()
+
+    def get(self, prepared_request: requests.PreparedRequest) -> Optional[bytes]:
+        """
+        Return the cached body of the response to `prepared_request`, or None if there is no valid entry.
+        """
+        path = self._get_path(prepared_request)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                self._remove(path)
+                content = None
+            else:
+                content = gzip.decompress(path.read_bytes())
+        except (OSError, EOFError):
+            content = None
+        with self._lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return content
+
+    def put(self, prepared_request: requests.PreparedRequest, content: bytes) -> None:
+        """
+        Store the body of the response to `prepared_request`, then evict the oldest entries if the cache is too
+        big.
+        """
+        path = self._get_path(prepared_request)
+        compressed = gzip.compress(content)
+        # write to a temporary file first, so that concurrent readers never see a partial entry
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(compressed)
+        with self._lock:
+            # an overwritten entry (e.g. a rerun after its expiry) no longer counts in the cache size
+            self._size += len(compressed) - self._get_size(path)
+            os.replace(tmp_path, path)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _get_path(self, prepared_request: requests.PreparedRequest) -> Path:
+        return self.directory / f"{self.get_key(prepared_request)}.json.gz"
+
+    def _entries(self):
+        return self.directory.glob("*.json.gz")
+
+    @staticmethod
+    def _get_size(path: Path) -> int:
+        try:
+            return path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _remove(self, path: Path) -> None:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def _evict(self) -> None:
+        """Remove the oldest entries until the cache fits in max_size (must be called with the lock held)."""
+        entries = []
+        for path in self._entries():
+            # entries can be removed concurrently (e.g. by an expired `get`) while listing them
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(key=lambda entry: entry[0])
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self._size -= size
+        logging.debug(f"Response cache evicted down to {self._size} bytes")
+
+
+def make_cached_response(
+    prepared_request: requests.PreparedRequest, content: bytes
+) -> requests.Response:
+    """
+    Build a response serving a cached body, readable both at once (`.content`) and as a stream (`.raw`).
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = "OK (cached)"
+    response.request = prepared_request
+    response.url = prepared_request.url or ""
+    response.raw = HTTPResponse(body=io.BytesIO(content), preload_content=False)
+    return response
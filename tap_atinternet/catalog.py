@@ -0,0 +1,102 @@
+"""
+Catalog of the tap streams, precomputed and shipped with the package (`catalog.json`),
+so that `--discover` doesn't have to build every stream and its schema.
+
+The file is versioned: it is only used if it was generated from the same stream
+definitions as the running tap, otherwise the catalog is built from the streams.
+Regenerate it after changing the streams (or upgrading singer-sdk) with:
+    python -m tap_atinternet.catalog
+"""
+import functools
+import hashlib
+import json
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from singer_sdk import typing as th  # JSON schema typing helpers
+
+CATALOG_PATH = Path(__file__).with_name("catalog.json")
+# stream class attributes defining a catalog entry (its schema and primary keys are
+# derived from the properties lists, with the metadata)
+CATALOG_ATTRIBUTES = ("name", "replication_key")
+PROPERTIES_LISTS = ("metrics", "properties", "extra_properties")
+
+
+def property_definitions(properties: th.PropertiesList) -> List[list]:
+    """
+    Return the definitions of the properties of a list (name, type, required, default and description), without
+    building their JSON schema.
+    """
+    return [
+        [
+            name,
+            getattr(prop.wrapped, "__name__", type(prop.wrapped).__name__),
+            not prop.optional,
+            prop.default,
+            prop.description,
+        ]
+        for name, prop in properties.items()
+    ]
+
+
+def catalog_version(stream_types: Sequence[type]) -> str:
+    """
+    Return the version of the catalog of stream classes: a digest of their definitions.
+
+    The lazy schemas of the stream classes (see `stream_schema`) are not built: the version is computed from the
+    properties lists they are built from.
+    """
+    definitions = [
+        {
+            **{name: getattr(stream_type, name) for name in CATALOG_ATTRIBUTES},
+            **{
+                name: property_definitions(getattr(stream_type, name))
+                for name in PROPERTIES_LISTS
+            },
+        }
+        for stream_type in stream_types
+    ]
+    encoded = json.dumps(definitions, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+@functools.lru_cache(maxsize=None)
+def load_cached_catalog(
+    stream_types: Tuple[type, ...], path: Path = CATALOG_PATH
+) -> Optional[dict]:
+    """
+    Return the precomputed catalog of `stream_types`, or None if missing or out of date.
+
+    The file is only read once per process: don't modify the returned catalog.
+    """
+    try:
+        cached = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+    if cached.get("version") != catalog_version(stream_types):
+        return None
+    return cached["catalog"]
+
+
+def write_cached_catalog(
+    catalog: dict, stream_types: Sequence[type], path: Path = CATALOG_PATH
+) -> None:
+    """Save a catalog (as returned by `--discover`) as the catalog of `stream_types`."""
+    version = catalog_version(stream_types)
+    path.write_text(
+        json.dumps({"version": version, "catalog": catalog}, indent=2) + "\n"
+    )
+    load_cached_catalog.cache_clear()
+
+
+if __name__ == "__main__":
+    from tap_atinternet.tap import STREAM_TYPES, TapATInternet
+
+    # the catalog of the default settings (see TapATInternet._singer_catalog)
+    tap = TapATInternet(
+        config={"api_key": "", "secret_key": "", "start_date": "2000-01-01"},
+        parse_env_config=False,
+        validate_config=False,
+    )
+    write_cached_catalog(tap.build_catalog().to_dict(), STREAM_TYPES)
+    print(f"Catalog written to {CATALOG_PATH}")
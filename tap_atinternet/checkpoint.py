@@ -0,0 +1,64 @@
+"""Resumable pagination cursors, saved in the stream state."""
+from typing import List, NamedTuple, Optional, Tuple
+
+from tap_atinternet.utils import get_page_size
+
+# the API rows are sorted by decreasing visits first
+SORT_METRIC = "-m_visits"
+
+
+class ResumePosition(NamedTuple):
+    """Where to resume an interrupted sync: window, first page to request, and rows to skip in that page."""
+
+    window: Tuple[str, str]
+    page_num: int
+    skip: int
+
+
+def make_sort(properties: List[str]) -> List[str]:
+    """
+    Return the sort order of the API rows: by decreasing visits, then by all the requested `properties`.
+
+    The rows of a request are unique per properties, so their order is the same from one request to the next:
+    a cursor offset (see `make_cursor`) is only valid for a unique sort order, rows with the same visits could be
+    skipped or emitted twice otherwise.
+    """
+    return [SORT_METRIC] + properties
+
+
+def make_cursor(
+    window: Tuple[str, str], page_num: int, max_results: int, sort: List[str]
+) -> dict:
+    """
+    Return the cursor of a page, before any of its rows is emitted.
+
+    The cursor is stored in the stream state, and updated while the rows of the page are emitted: `offset` is
+    the number of rows of the page already emitted, so that an interrupted sync can resume from the next row.
+    """
+    return {
+        "window": list(window),
+        "page_num": page_num,
+        "offset": 0,
+        "max_results": max_results,
+        "sort": sort,
+    }
+
+
+def get_resume_position(
+    cursor: Optional[dict], max_results: int, sort: List[str]
+) -> Optional[ResumePosition]:
+    """
+    Return where to resume from a cursor saved by an interrupted sync, or None if there is nothing to resume.
+
+    Rows keep the same position as long as the (unique) sort order is the same, even if `max_results` changed
+    since the interrupted sync: the position is then recomputed with the new page size.
+    Pages hold `max_results` rows, capped to the API limit.
+    """
+    if not cursor or cursor.get("sort") != sort:
+        return None
+    previous_page_size = get_page_size(cursor["max_results"])
+    rows_before = (cursor["page_num"] - 1) * previous_page_size + cursor["offset"]
+    page_index, skip = divmod(rows_before, get_page_size(max_results))
+    return ResumePosition(
+        window=tuple(cursor["window"]), page_num=page_index + 1, skip=skip
+    )
@@ -2,18 +2,76 @@
 import datetime
 import json
 import logging
-from typing import Any, Dict, Optional
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import requests
+import singer
 from singer_sdk import typing as th  # JSON schema typing helpers
 from singer_sdk.exceptions import FatalAPIError, RetriableAPIError
+from singer_sdk.helpers._state import finalize_state_progress_markers
 from singer_sdk.streams import RESTStream
+from singer_sdk.streams.core import REPLICATION_INCREMENTAL
 
+from tap_atinternet.cache import ResponseCache, make_cached_response
+from tap_atinternet.checkpoint import (
+    SORT_METRIC,
+    ResumePosition,
+    get_resume_position,
+    make_cursor,
+    make_sort,
+)
+from tap_atinternet.columnar import concat_rows
+from tap_atinternet.filters import StreamFilter, get_stream_filter
+from tap_atinternet.metrics import ROWS_BUCKETS, SyncMetrics
+from tap_atinternet.planner import API_MAX_ROWS, Window, WindowPlanner
+from tap_atinternet.refresh import ChangeDetector
+from tap_atinternet.response import (
+    DataFeedPage,
+    read_data_feed,
+    stream_data_feed_rows,
+)
+from tap_atinternet.throttle import RateLimiter, parse_retry_after, wait_all
+from tap_atinternet.transform import (
+    PageTransformer,
+    RowTransformer,
+    build_page_transformer,
+    build_row_transformer,
+)
 from tap_atinternet.utils import (
+    add_properties,
+    get_page_size,
+    is_closed_month,
+    is_last_page,
+    make_nullable,
     property_list_to_str,
-    get_start_end_days,
-    get_next_month,
-    month_str_to_int,
+)
+from tap_atinternet.validation import RecordValidator, build_record_validator
+
+if TYPE_CHECKING:
+    from tap_atinternet.output import BatchOutput, BufferedOutput
+
+API_URL = "https://api.atinternet.io/v3/data/getData"
+# added to the records of all the streams when several sites are extracted, to tell the
+# sites apart (see ATInternetStream.site_column): not requested to the API, except when
+# several sites are batched in the same request
+SITE_PROPERTIES = th.PropertiesList(
+    th.Property("site_id", th.IntegerType, required=True),
 )
 
 
@@ -28,10 +86,180 @@ class ATInternetStream(RESTStream):
 
     # --- AT Internet specific attributes and methods
     # To be replaced by the child Stream class
+    # (a class attribute: the tap reads it from the stream classes, see TapATInternet.discover_streams)
+    name: str
     metrics: th.PropertiesList
     properties: th.PropertiesList
+    # class attributes of the child Stream classes (see `stream_schema` and `stream_primary_keys`), instead of
+    # the Optional properties of the SDK: the 'site_id' property is added per stream instance (see `site_column`)
+    schema: dict
+    primary_keys: List[str]
+    # properties of the records that are not requested to the API (e.g. the 'date' of the monthly streams)
+    extra_properties = th.PropertiesList()
+
+    # see `stream_filter` and `record_validator`
+    _stream_filter: Optional[StreamFilter] = None
+    _record_validation: Optional[str] = None
+    _record_validator: Optional[RecordValidator] = None
+    # set to False in a child Stream class if its columns can't be combined with the 'site_id' column
+    # (see `batch_sites` in the tap settings)
+    supports_site_batching = True
+    # max number of rows of a request (all pages included): a window reaching it is split (see `_end_window`)
+    api_max_rows = API_MAX_ROWS
+    # compiled once per stream class (see `row_transformer`), and once per stream instance since its schema depends
+    # on the 'site_id' column (see `page_transformer`)
+    _row_transformer: RowTransformer
+    _page_transformer: Optional[PageTransformer] = None
+    # performance metrics of the sync, set by the tap if instrumentation is enabled (see `collect_metrics`)
+    sync_metrics: Optional[SyncMetrics] = None
+    # output of the RECORD messages, set by the tap once per sync, None with the default 'records' output mode
+    # (see TapATInternet.record_output)
+    record_output: Optional[Union["BufferedOutput", "BatchOutput"]] = None
+
+    def __init__(self, tap, schema=None, name=None) -> None:
+        super().__init__(tap=tap, schema=schema, name=name)
+        # keep a reference to the tap, which holds the resources shared by all the streams
+        # (rate limiter, HTTP connection pool, output lock)
+        self.parent_tap = tap
+        # number of requests avoided by stopping the pagination of a period early (see `is_last_page`)
+        self.requests_saved = 0
+        # size of the API responses (or cached responses) decoded, logged at the end of the sync
+        self.payload_bytes = 0
+        self._requests_saved_lock = threading.Lock()
+        # state of the current sync (start date, window planner), local to the thread running it: different
+        # partitions (sites) of a same stream can be synced at the same time (see TapATInternet.sync_all)
+        self._sync_local = threading.local()
+        # with several sites (`site_ids`), the records have a 'site_id' column, part of
+        # their primary key
+        self.site_column = bool(self.config.get("site_ids"))
+        if self.site_column:
+            self.schema = add_properties(self.schema, SITE_PROPERTIES)
+            self.primary_keys = self.primary_keys + property_list_to_str(
+                SITE_PROPERTIES
+            )
+        # with `record_validation`, the "N/A" metrics are emitted as null: the metrics are
+        # nullable, and not required anymore
+        self.nullable_metrics = self.config.get("record_validation", "off") != "off"
+        if self.nullable_metrics:
+            self.schema = make_nullable(self.schema, property_list_to_str(self.metrics))
+
+    @property
+    def min_start_date(self) -> datetime.date:
+        return self._sync_local.min_start_date
+
+    @min_start_date.setter
+    def min_start_date(self, value: datetime.date) -> None:
+        self._sync_local.min_start_date = value
+
+    @property
+    def window_planner(self) -> WindowPlanner:
+        return self._sync_local.window_planner
+
+    @window_planner.setter
+    def window_planner(self, value: WindowPlanner) -> None:
+        self._sync_local.window_planner = value
+
+    @property
+    def change_detector(self) -> Optional[ChangeDetector]:
+        return getattr(self._sync_local, "change_detector", None)
+
+    @change_detector.setter
+    def change_detector(self, value: Optional[ChangeDetector]) -> None:
+        self._sync_local.change_detector = value
+
+    @property
+    def dedup_run(self) -> Optional[Tuple[str, str]]:
+        """Return the (scope, run id) of the records in the dedup index, if any (see `DedupIndex`)."""
+        return getattr(self._sync_local, "dedup_run", None)
+
+    @dedup_run.setter
+    def dedup_run(self, value: Optional[Tuple[str, str]]) -> None:
+        self._sync_local.dedup_run = value
+
+    @property
+    def partitions(self) -> Optional[List[dict]]:
+        """
+        Return one partition (with its own state bookmark) per site, if several sites are configured in `site_ids`.
+
+        Without `site_ids` (single `site_id`), or when all the sites are batched in the same requests
+        (`batch_sites`), the stream is not partitioned.
+        """
+        if not self.config.get("site_ids") or self.batch_sites:
+            return None
+        return [{"site_id": site_id} for site_id in self.config["site_ids"]]
+
+    @property
+    def stream_filter(self) -> StreamFilter:
+        """
+        Return the filters of the stream, from the `filter_str` and `stream_filters` settings (see `get_stream_filter`).
+        """
+        if self._stream_filter is None:
+            self._stream_filter = get_stream_filter(self.config, self.name)
+        return self._stream_filter
+
+    @property
+    def selected_metrics(self) -> List[str]:
+        """
+        Return the metrics to request: the metrics selected in the catalog, and the metrics of the sort order and of
+        the metric filters (removed from the records by the Singer SDK if they are not selected).
+
+        All the properties of the streams are part of their primary key, so they are always selected.
+        """
+        required = {SORT_METRIC.lstrip("-")}
+        required.update(self.stream_filter.metrics)
+        return [
+            name
+            for name in property_list_to_str(self.metrics)
+            if name in required or self.mask.get(("properties", name), True)
+        ]
+
+    @property
+    def request_sort(self) -> List[str]:
+        """
+        Return the sort order of the requests of the stream (see `make_sort`), stored in the pagination cursors.
+        """
+        # the sites of a partition are requested one at a time (see `get_request_columns`)
+        site_ids = [] if self.partitions else self.parent_tap.site_ids
+        return self.get_request_sort(self.get_request_columns(site_ids))
+
+    def get_request_sort(self, columns: List[str]) -> List[str]:
+        """
+        Return the sort order of a request of these `columns`: by decreasing visits, then by all its properties.
+        """
+        metrics = set(property_list_to_str(self.metrics))
+        return make_sort([column for column in columns if column not in metrics])
+
+    def get_min_start_date(self, context: Optional[dict]) -> datetime.date:
+        """
+        Return the first day to request: the day of the stream bookmark, or the 'start_date' setting if there is no
+        bookmark yet, and at the earliest the `start_date` of the stream filters.
+        """
+        start_date = self.str_to_date(self.get_starting_replication_key_value(context))
+        if self.stream_filter.start_date is not None:
+            return max(start_date, self.stream_filter.start_date)
+        return start_date
+
+    @property
+    def last_date(self) -> datetime.date:
+        """
+        Return the last day to request: today, or the `end_date` of the stream filters if it is earlier.
+        """
+        today = datetime.date.today()
+        end_date = self.stream_filter.end_date
+        return today if end_date is None or end_date > today else end_date
+
+    @property
+    def batch_sites(self) -> bool:
+        return bool(self.config.get("batch_sites")) and self.supports_site_batching
+
+    def get_site_ids(self, context: Optional[dict]) -> List[int]:
+        """
+        Return the sites to request: the site of the partition, or all the configured sites.
+        """
+        if context and "site_id" in context:
+            return [context["site_id"]]
+        return self.parent_tap.site_ids
 
-    min_start_date = None
     # AT Internet date format utilities
     date_format = "%Y-%m-%d"
 
@@ -42,10 +270,15 @@ class ATInternetStream(RESTStream):
         return datetime.datetime.strptime(date, self.date_format).date()
 
     # --- Singer SDK attributes and methods
-    url_base = "https://api.atinternet.io/v3/data/getData"
-    records_jsonpath = "$.DataFeed.Rows[*]"
     rest_method = "POST"
 
+    @property
+    def url_base(self) -> str:
+        """
+        Return the URL of the `getData` endpoint (see the `api_url` setting, e.g. to use a local mock server).
+        """
+        return self.config.get("api_url") or API_URL
+
     @property
     def http_headers(self) -> dict:
         """
@@ -56,45 +289,764 @@ class ATInternetStream(RESTStream):
             "Content-type": "application/json",
         }
 
+    @property
+    def daily_grain(self) -> bool:
+        """
+        Return True if the stream requests daily data (a 'date' column), False for monthly data.
+        """
+        return "date" in property_list_to_str(self.properties)
+
+    def window_token(self, window: Window, page_num: int = 1) -> dict:
+        start_date, end_date = window
+        return {
+            "window": (self.date_to_str(start_date), self.date_to_str(end_date)),
+            "page_num": page_num,
+        }
+
+    def token_window(self, token: dict) -> Window:
+        start, end = token["window"]
+        return self.str_to_date(start), self.str_to_date(end)
+
     def get_next_page_token(
         self, response: requests.Response, previous_token: Optional[dict]
     ) -> Optional[dict]:
         """
-        Return a token for identifying next (year,month) tuple and next page.
+        Return a token for identifying next window (start and end days) and next page.
 
-        If the previous (year,month) and page is still returning data, try using the same (year,month) and the next page.
-        If there is no more data (-> no more pages) for the previous (year,month), try using the next (year,month).
-        If the next (year,month) is greater or equal than today, it means there is no more data to sync
+        If the previous window and page is still returning data, try using the same window and the next page.
+        If there is no more data (-> no more pages) for the previous window, try using the next window.
+        The previous page is also known to be the last one if it is not full (see `is_last_page`): in this case we
+        move to the next window without requesting an empty page.
+        If the previous window hit the API row limit, its rows were truncated: it is requested again, in shorter
+        windows (see `_end_window`).
+        If the previous window ends today, it means there is no more data to sync
             -> return None to stop the loop
+
+        The pagination cursor is read from `previous_token` (None meaning the first page of the first window),
+        rather than decoded back from the request body.
+        Windows are planned one at a time by the `window_planner`, which learns from the number of rows
+        of each window.
         """
-        # Get the date of the previous request
-        request_body_json = json.loads(response.request.body)
-        previous_start_date = self.str_to_date(
-            request_body_json["period"]["p1"][0]["start"]
-        )
-
-        # Find out if the previous month is still returning data (which means it may have pages left)
-        data_feed = response.json()["DataFeed"]
-        rows = data_feed["Rows"]
-        if len(rows) > 0:
-            # get the page-num of the previous request
-            previous_page = request_body_json["page-num"]
-            return {
-                "year_month": (previous_start_date.year, previous_start_date.month),
-                "page_num": previous_page + 1,
-            }
-
-        # Find out if we should use the next month
-        next_year, next_month = get_next_month(
-            previous_start_date.year, previous_start_date.month
-        )
-        if datetime.date(next_year, next_month, 1) <= datetime.date.today():
-            return {
-                "year_month": (next_year, next_month),
-                "page_num": 1,
-            }
+        if previous_token is None:
+            previous_token = self.window_token(
+                self.window_planner.next_window(self.min_start_date, self.last_date)
+            )
+        start_date, end_date = self.token_window(previous_token)
+        previous_page = previous_token["page_num"]
+
+        # Find out if the previous window is still returning data (which means it may have pages left)
+        page = self._read_data_feed(response)
+        if self.sync_metrics is not None:
+            self._observe_page(self.sync_metrics, start_date, page)
+        if page.row_count > 0 and not self._is_last_page(page):
+            return self.window_token((start_date, end_date), previous_page + 1)
+
+        # all the pages before the last one were full
+        window_rows = (previous_page - 1) * self.page_size + page.row_count
+        shorter_windows = self._end_window((start_date, end_date), window_rows)
+        if shorter_windows:
+            # its rows already emitted are emitted again, by the shorter windows
+            return self.window_token(shorter_windows[0])
+
+        # Find out if we should use the next window
+        if end_date < self.last_date:
+            next_start_date = end_date + datetime.timedelta(days=1)
+            return self.window_token(
+                self.window_planner.next_window(next_start_date, self.last_date)
+            )
         return None
 
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        """
+        Return the limiter shared by all the requests of the tap (and thus, of the configured site).
+        """
+        return self.parent_tap.rate_limiter
+
+    def get_rate_limiters(self, context: Optional[dict]) -> List[RateLimiter]:
+        """
+        Return the limiters a request of the context must wait for: the API key limiter, and the limiter of each
+        site of the request (if 'max_requests_per_second_per_site' is set).
+        """
+        site_rate_limiters = self.parent_tap.site_rate_limiters
+        if not site_rate_limiters:
+            return [self.rate_limiter]
+        return [self.rate_limiter] + [
+            site_rate_limiters[site_id] for site_id in self.get_site_ids(context)
+        ]
+
+    @property
+    def requests_session(self) -> requests.Session:
+        """
+        Return the HTTP session (and connection pool) shared by all the streams of the tap.
+        """
+        return self.parent_tap.requests_session
+
+    # When streams are synced in parallel (see TapATInternet.sync_all), each Singer message is written
+    # while holding the tap output lock, so that lines from different streams never interleave on stdout.
+    # With a faster `output_mode` (see TapATInternet.record_output), RECORD messages are buffered: the buffer is
+    # flushed before any other message, to keep the messages in order.
+    def _write_schema_message(self) -> None:
+        with self.parent_tap.output_lock:
+            self._flush_record_output()
+            super()._write_schema_message()
+
+    def _write_record_message(self, record: dict) -> None:
+        record_output = self.record_output
+        if self.sync_metrics is None and record_output is None:
+            with self.parent_tap.output_lock:
+                super()._write_record_message(record)
+            return
+        # same as the parent method, timing the type conformance and the output (lock waits included) separately
+        # batch files are split per month (the record may be modified by the stream maps)
+        month = str(record.get("date", ""))[:7]
+        start = time.perf_counter()
+        record_messages = list(self._generate_record_messages(record))
+        conformed = time.perf_counter()
+        with self.parent_tap.output_lock:
+            for record_message in record_messages:
+                if record_output is None:
+                    singer.write_message(record_message)
+                else:
+                    record_output.write_record(record_message, month)
+        if self.sync_metrics is not None:
+            self.sync_metrics.increment(
+                "validation_seconds", conformed - start, stream=self.name
+            )
+            self.sync_metrics.increment(
+                "output_seconds", time.perf_counter() - conformed, stream=self.name
+            )
+
+    def _write_state_message(self) -> None:
+        with self.parent_tap.output_lock:
+            self._flush_record_output()
+            super()._write_state_message()
+            # the target has received all the records emitted until now
+            if self.parent_tap.dedup_index is not None:
+                self.parent_tap.dedup_index.commit()
+            if self.parent_tap.refresh_index is not None:
+                self.parent_tap.refresh_index.commit()
+
+    def _flush_record_output(self) -> None:
+        if self.record_output is not None:
+            self.record_output.flush()
+
+    # The STATE messages are written while holding the output lock, and so are all the
+    # changes of the state: a stream never modifies the state while another one is
+    # writing it (see `parallel_streams`).
+    def _write_replication_key_signpost(self, context: Optional[dict], value) -> None:
+        with self.parent_tap.output_lock:
+            super()._write_replication_key_signpost(context, value)
+
+    def _write_starting_replication_value(self, context: Optional[dict]) -> None:
+        with self.parent_tap.output_lock:
+            super()._write_starting_replication_value(context)
+
+    def _increment_stream_state(
+        self, latest_record: Dict[str, Any], *, context: Optional[dict] = None
+    ) -> None:
+        with self.parent_tap.output_lock:
+            super()._increment_stream_state(latest_record, context=context)
+
+    def request_records(self, context: Optional[dict]) -> Iterable[dict]:
+        """
+        Request records from the API, either page by page (default) or concurrently (if max_workers > 1).
+
+        In both cases, each response body is decoded only once (see `read_data_feed`), and rows are yielded
+        directly from its `DataFeed.Rows`.
+        With `stream_rows` (sequential mode only), rows are even parsed one at a time from the HTTP stream
+        (see `stream_data_feed_rows`), so that memory is bounded by the size of a row instead of a page.
+
+        In concurrent mode, the full timespan is split ahead of time into (year,month) windows, and each window
+        is fetched (with all its pages) by a pool of `max_workers` threads. Windows are yielded back in
+        chronological order, so that the 'date' replication key keeps increasing and the stream state stays correct.
+        At most `max_workers` windows are buffered in memory at the same time.
+
+        With the async HTTP engine (`http_engine: async`), windows are fetched the same way, but on the event loop
+        of the tap `async_transport` instead of a pool of threads (see `_fetch_window_async`).
+
+        In both modes, the position of the last emitted row (window, page, and row in the page) is saved in the
+        stream state as a `cursor` (see `make_cursor`), and a STATE message is written every `checkpoint_interval`
+        pages. If a sync is interrupted, the next one resumes right after the last row emitted before the last
+        STATE message: the pages before it are not requested again, and its rows are not emitted again.
+
+        With `incremental_refresh`, the records of the open month that did not change
+        since they were last emitted are not emitted again (see `ChangeDetector`).
+
+        Only the metrics selected in the catalog are requested, and the `stream_filters` are sent with the requests
+        (see `stream_filter`), so that the rows and columns that are not needed are not transferred.
+        """
+        # use last state or 'start_date' as the first day (see `prepare_request_payload`)
+        self.min_start_date = self.get_min_start_date(context)
+        # the density of the stream (rows per day) is remembered between runs in the stream state
+        state = self.get_context_state(context)
+        self.window_planner = WindowPlanner(
+            daily_grain=self.daily_grain,
+            rows_per_day=state.get("rows_per_day"),
+            max_rows=self.api_max_rows,
+        )
+        resume = self._get_resume_position(state)
+        scope = json.dumps([self.name, context], sort_keys=True)
+        self.change_detector = None
+        if (
+            self.parent_tap.refresh_index is not None
+            and self.replication_method == REPLICATION_INCREMENTAL
+        ):
+            self.change_detector = ChangeDetector(
+                self.parent_tap.refresh_index,
+                scope=scope,
+                primary_keys=self.primary_keys,
+                run=state.get("refresh_run"),
+            )
+            with self.parent_tap.output_lock:
+                # the digests are in the refresh index (older versions kept them in
+                # the state)
+                state.pop("row_digests", None)
+                state["refresh_run"] = self.change_detector.run
+        self.dedup_run = None
+        if self.parent_tap.dedup_index is not None:
+            run = self.parent_tap.dedup_index.start_run(scope, state.get("dedup_run"))
+            self.dedup_run = (scope, run)
+            with self.parent_tap.output_lock:
+                state["dedup_run"] = run
+        self._log_request_payload()
+        max_workers = self.config.get("max_workers", 1)
+        if self.min_start_date > self.last_date:
+            self.logger.info(
+                f"Stream '{self.name}': nothing to sync after the end_date of its filters ({self.last_date})"
+            )
+        elif self.config.get("http_engine") == "async":
+            yield from self._request_asynchronously(context, state, resume, max_workers)
+        elif max_workers <= 1:
+            yield from self._request_sequentially(context, state, resume)
+        else:
+            yield from self._request_concurrently(context, state, resume, max_workers)
+        with self.parent_tap.output_lock:
+            state["rows_per_day"] = self.window_planner.rows_per_day
+            # the SDK promotes the progress markers once the records are exhausted,
+            # without the lock: promote them first, its own finalization is then a no-op
+            finalize_state_progress_markers(state)
+        self._set_cursor(state, None)
+        self._log_requests_saved()
+        self.logger.info(
+            f"Stream '{self.name}': {self.payload_bytes / 1024 / 1024:.2f} MB of API responses received"
+        )
+        if self.change_detector is not None:
+            self.change_detector.finish()
+            self.logger.info(
+                f"Stream '{self.name}': {self.change_detector.unchanged} unchanged records of the open month "
+                f"skipped"
+            )
+
+    def _get_resume_position(self, state: dict) -> Optional[ResumePosition]:
+        resume = get_resume_position(
+            state.get("cursor"), self.config["max_results"], self.request_sort
+        )
+        if resume is None:
+            return None
+        if self.str_to_date(resume.window[0]) < self.min_start_date:
+            # the start date moved after the interrupted sync
+            return None
+        end_date = self.str_to_date(resume.window[1])
+        if not is_closed_month(end_date.year, end_date.month):
+            # the rows of the open month change between requests, so do their positions: the window is
+            # requested again from its first page (its rows already emitted are emitted again)
+            self.logger.info(
+                f"Stream '{self.name}': resuming an interrupted sync at window {'/'.join(resume.window)}, "
+                f"from its first page (open month)"
+            )
+            return ResumePosition(window=resume.window, page_num=1, skip=0)
+        self.logger.info(
+            f"Stream '{self.name}': resuming an interrupted sync at window {'/'.join(resume.window)}, "
+            f"page {resume.page_num} (skipping {resume.skip} rows already emitted)"
+        )
+        return resume
+
+    def _set_cursor(self, state: dict, cursor: Optional[dict]) -> None:
+        # adding or removing a key of the state while another stream is writing it (see `parallel_streams`)
+        # is not safe: the state is written while holding the output lock
+        with self.parent_tap.output_lock:
+            if cursor is None:
+                state.pop("cursor", None)
+            else:
+                state["cursor"] = cursor
+
+    def _emit_rows(self, rows: Iterable[dict], cursor: dict) -> Iterable[dict]:
+        """
+        Yield the rows of a page after the `cursor` offset, counting them in the cursor once they are emitted.
+        """
+        if cursor["offset"]:
+            rows = islice(rows, cursor["offset"], None)
+        for row in rows:
+            yield row
+            # the row has been emitted when the next one is requested
+            cursor["offset"] += 1
+
+    def _checkpoint(self) -> None:
+        """
+        Write a STATE message every `checkpoint_interval` pages.
+        """
+        interval = self.config.get("checkpoint_interval", 10)
+        if not interval:
+            return
+        self._sync_local.pages = getattr(self._sync_local, "pages", 0) + 1
+        if self._sync_local.pages % interval == 0:
+            self._write_state_message()
+
+    def _first_page_token(self, resume: Optional[ResumePosition]) -> dict:
+        if resume is None:
+            return self.window_token(
+                self.window_planner.next_window(self.min_start_date, self.last_date)
+            )
+        return {"window": resume.window, "page_num": resume.page_num}
+
+    def _request_sequentially(
+        self, context: Optional[dict], state: dict, resume: Optional[ResumePosition]
+    ) -> Iterable[dict]:
+        decorated_request = self.request_decorator(self._send_request)
+        stream_rows = bool(self.config.get("stream_rows"))
+        next_page_token: Optional[dict] = self._first_page_token(resume)
+        skip = resume.skip if resume else 0
+        while next_page_token:
+            prepared_request = self.prepare_request(
+                context, next_page_token=next_page_token
+            )
+            _, end_date = self.token_window(next_page_token)
+            response = decorated_request(
+                prepared_request,
+                context,
+                stream=stream_rows,
+                cacheable=is_closed_month(end_date.year, end_date.month),
+            )
+            cursor = make_cursor(
+                next_page_token["window"],
+                next_page_token["page_num"],
+                self.config["max_results"],
+                self.request_sort,
+            )
+            cursor["offset"], skip = skip, 0
+            self._set_cursor(state, cursor)
+            yield from self._emit_rows(self.parse_response(response), cursor)
+            next_page_token = self.get_next_page_token(response, next_page_token)
+            self._checkpoint()
+
+    def _request_concurrently(
+        self,
+        context: Optional[dict],
+        state: dict,
+        resume: Optional[ResumePosition],
+        max_workers: int,
+    ) -> Iterable[dict]:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            yield from self._request_windows(
+                state,
+                resume,
+                max_workers,
+                lambda window, first_page: executor.submit(
+                    self._fetch_window, context, window, first_page
+                ),
+            )
+
+    def _request_asynchronously(
+        self,
+        context: Optional[dict],
+        state: dict,
+        resume: Optional[ResumePosition],
+        max_windows: int,
+    ) -> Iterable[dict]:
+        transport = self.parent_tap.async_transport
+        yield from self._request_windows(
+            state,
+            resume,
+            max_windows,
+            lambda window, first_page: transport.submit(
+                self._fetch_window_async(context, window, first_page)
+            ),
+        )
+
+    def _request_windows(
+        self,
+        state: dict,
+        resume: Optional[ResumePosition],
+        max_windows: int,
+        fetch_window: Callable[[Window, int], Future],
+    ) -> Iterable[dict]:
+        """
+        Fetch the planned windows with `fetch_window` (at most `max_windows` at the same time), and yield their rows
+        in chronological order.
+        """
+        if resume is None:
+            windows = [
+                (window, 1)
+                for window in self.window_planner.plan(
+                    self.min_start_date, self.last_date
+                )
+            ]
+        else:
+            window = self.token_window({"window": resume.window})
+            next_start_date = window[1] + datetime.timedelta(days=1)
+            windows = [(window, resume.page_num)] + [
+                (next_window, 1)
+                for next_window in self.window_planner.plan(
+                    next_start_date, self.last_date
+                )
+            ]
+        skip = resume.skip if resume else 0
+        pending: deque = deque()
+        for window, first_page in windows:
+            pending.append((window, first_page, fetch_window(window, first_page)))
+            if len(pending) >= max_windows:
+                yield from self._pop_window(pending, state, skip, fetch_window)
+                skip = 0
+        while pending:
+            yield from self._pop_window(pending, state, skip, fetch_window)
+            skip = 0
+
+    def _pop_window(
+        self,
+        pending: deque,
+        state: dict,
+        skip: int,
+        fetch_window: Callable[[Window, int], Future],
+    ) -> Iterable[dict]:
+        """
+        Yield the rows of the first pending window, or replace it with shorter windows if it hit the API row limit.
+        """
+        window, first_page, future = pending.popleft()
+        rows = future.result()
+        shorter_windows = self._end_window(
+            window, (first_page - 1) * self.page_size + len(rows)
+        )
+        if shorter_windows:
+            # its rows are not emitted: the shorter windows are fetched (and emitted) before the next ones
+            pending.extendleft(
+                (shorter_window, 1, fetch_window(shorter_window, 1))
+                for shorter_window in reversed(shorter_windows)
+            )
+            return
+        cursor = make_cursor(
+            self.window_token(window)["window"],
+            first_page,
+            self.config["max_results"],
+            self.request_sort,
+        )
+        # rows are counted from the first page requested, over all the pages of the window
+        cursor["offset"] = skip
+        self._set_cursor(state, cursor)
+        yield from self._emit_rows(rows, cursor)
+        self._checkpoint()
+
+    def _fetch_window(
+        self, context: Optional[dict], window: Window, first_page: int = 1
+    ) -> Sequence[dict]:
+        """
+        Fetch all the pages of a single window (from `first_page`), and return their rows.
+
+        With `columnar_pages`, the pages are concatenated column by column (see `concat_rows`).
+        """
+        decorated_request = self.request_decorator(self._send_request)
+        _, end_date = window
+        rows: Sequence[dict] = []
+        page_num = first_page
+        while True:
+            prepared_request = self.prepare_request(
+                context, next_page_token=self.window_token(window, page_num)
+            )
+            response = decorated_request(
+                prepared_request,
+                context,
+                cacheable=is_closed_month(end_date.year, end_date.month),
+            )
+            page = self._read_page(response)
+            if self.sync_metrics is not None:
+                self._observe_page(self.sync_metrics, window[0], page)
+            rows = concat_rows(rows, page.rows)
+            if page.row_count == 0 or self._is_last_page(page):
+                return rows
+            page_num += 1
+
+    async def _fetch_window_async(
+        self, context: Optional[dict], window: Window, first_page: int = 1
+    ) -> Sequence[dict]:
+        """
+        Same as `_fetch_window`, on the event loop of the tap `async_transport`.
+
+        The pages of a window are requested one after another, and decoded in the executor of the event loop, not
+        on the loop itself.
+        """
+        run_blocking = self.parent_tap.async_transport.run_blocking
+        rows: Sequence[dict] = []
+        page_num = first_page
+        while True:
+            response = await self._send_async(context, window, page_num)
+            page = await run_blocking(self._read_page, response)
+            if self.sync_metrics is not None:
+                self._observe_page(self.sync_metrics, window[0], page)
+            rows = concat_rows(rows, page.rows)
+            if page.row_count == 0 or self._is_last_page(page):
+                return rows
+            page_num += 1
+
+    async def _send_async(
+        self, context: Optional[dict], window: Window, page_num: int
+    ) -> requests.Response:
+        """
+        Send the request of a page with the tap `async_transport`, using the response cache like `_send_request`
+        (read and written in the executor of the event loop).
+        """
+        transport = self.parent_tap.async_transport
+        prepared_request = self.prepare_request(
+            context, next_page_token=self.window_token(window, page_num)
+        )
+        _, end_date = window
+        cache = (
+            self.parent_tap.response_cache
+            if is_closed_month(end_date.year, end_date.month)
+            else None
+        )
+        if cache is not None:
+            content = await transport.run_blocking(cache.get, prepared_request)
+            if content is not None:
+                return make_cached_response(prepared_request, content)
+
+        response = await transport.send(
+            prepared_request,
+            validate=self.validate_response,
+            limiters=self.get_rate_limiters(context),
+            on_wait=self._observe_rate_limit_wait,
+            on_retry=self._observe_retry,
+        )
+        self.rate_limiter.recover()
+        self._log_request_duration(prepared_request, response, context)
+        if self.sync_metrics is not None:
+            self.sync_metrics.observe(
+                "http_request_duration",
+                response.elapsed.total_seconds(),
+                stream=self.name,
+            )
+            self.sync_metrics.increment(
+                "bytes_received", len(response.content), stream=self.name
+            )
+        if cache is not None:
+            await transport.run_blocking(cache.put, prepared_request, response.content)
+        return response
+
+    def _read_page(self, response: requests.Response) -> DataFeedPage:
+        """
+        Decode the page of a response (see `read_data_feed`), timing the decoding if instrumentation is enabled.
+        """
+        if not hasattr(response, "_data_feed_page"):
+            self._count_payload(len(response.content))
+        if self.sync_metrics is None:
+            return self._read_data_feed(response)
+        start = time.perf_counter()
+        page = self._read_data_feed(response)
+        self.sync_metrics.observe(
+            "decode_duration", time.perf_counter() - start, stream=self.name
+        )
+        return page
+
+    def _read_data_feed(self, response: requests.Response) -> DataFeedPage:
+        """
+        Decode the page of a response (see `read_data_feed`), transforming and validating its rows in bulk with
+        `columnar_pages`.
+        """
+        page_transformer = self.page_transformer
+        if page_transformer is None:
+            return read_data_feed(response)
+        validator = self.record_validator
+        if validator is None:
+            return read_data_feed(response, page_transformer)
+        return read_data_feed(
+            response, lambda rows: validator.validate_page(page_transformer(rows))
+        )
+
+    def _count_payload(self, size: int) -> None:
+        with self._requests_saved_lock:
+            self.payload_bytes += size
+
+    def _observe_page(
+        self, sync_metrics: SyncMetrics, start_date: datetime.date, page: DataFeedPage
+    ) -> None:
+        sync_metrics.observe(
+            "rows_per_page", page.row_count, buckets=ROWS_BUCKETS, stream=self.name
+        )
+        sync_metrics.increment(
+            "pages", stream=self.name, month=start_date.strftime("%Y-%m")
+        )
+
+    def _end_window(self, window: Window, row_count: int) -> List[Window]:
+        """
+        Update the density estimate of the planner, and return the shorter windows to request instead of the window
+        if it hit the API row limit (an empty list otherwise).
+
+        Windows merging several months are split back into calendar months, and the windows of the daily grain
+        streams down to single days (see `WindowPlanner.split`). The windows of a single day, and of a single month
+        for the monthly streams, can't be split: the API may have truncated their rows.
+        """
+        self.window_planner.observe(*window, row_count)
+        if row_count < self.api_max_rows:
+            return []
+        start_date, end_date = window
+        shorter_windows = self.window_planner.split(start_date, end_date)
+        if shorter_windows:
+            self.logger.warning(
+                f"Stream '{self.name}': window {start_date}/{end_date} returned {row_count} rows, "
+                f"the API row limit: requesting it again in shorter windows"
+            )
+        else:
+            self.logger.warning(
+                f"Stream '{self.name}': window {start_date}/{end_date} returned {row_count} rows, "
+                f"some rows may have been truncated by the API"
+            )
+        return shorter_windows
+
+    @property
+    def page_size(self) -> int:
+        """
+        Return the number of rows of a full page (`max_results`, capped by the API).
+        """
+        return get_page_size(self.config["max_results"])
+
+    def _is_last_page(self, page: DataFeedPage) -> bool:
+        """
+        Return True (and count one saved request) if `page` is known to be the last page of its period.
+        """
+        if not is_last_page(page.row_count, self.config["max_results"]):
+            return False
+        with self._requests_saved_lock:
+            self.requests_saved += 1
+        return True
+
+    def _log_requests_saved(self) -> None:
+        self.logger.info(
+            f"Stream '{self.name}': {self.requests_saved} empty page requests saved"
+        )
+
+    def _send_request(
+        self,
+        prepared_request: requests.PreparedRequest,
+        context: Optional[dict] = None,
+        stream: bool = False,
+        cacheable: bool = False,
+    ) -> requests.Response:
+        """
+        Send a single request, after waiting for the rate limiters of the context (see `get_rate_limiters`).
+
+        With `stream=True`, the body is not downloaded yet: it must be consumed with `stream_data_feed_rows`.
+        With `cacheable=True` (closed periods only) and if the response cache is enabled, the response is served
+        from the local cache when possible, and stored in it otherwise.
+        """
+        cache = self.parent_tap.response_cache if cacheable else None
+        if cache is not None:
+            content = cache.get(prepared_request)
+            if content is not None:
+                return make_cached_response(prepared_request, content)
+
+        return self._send(prepared_request, context, stream=stream, cache=cache)
+
+    def _send(
+        self,
+        prepared_request: requests.PreparedRequest,
+        context: Optional[dict] = None,
+        stream: bool = False,
+        cache: Optional[ResponseCache] = None,
+    ) -> requests.Response:
+        """
+        Send a request to the API, counting it in the daily request budget (if any) and waiting for the rate
+        limiters first.
+        """
+        budget = self.parent_tap.request_budget
+        if budget is not None:
+            budget.take()
+        delay = wait_all(self.get_rate_limiters(context))
+        if delay > 0:
+            self._observe_rate_limit_wait(delay)
+        if self.sync_metrics is not None:
+            response = self._send_instrumented(
+                self.sync_metrics, prepared_request, context, stream, cache
+            )
+        else:
+            response = self.requests_session.send(
+                prepared_request, timeout=self.timeout, stream=stream and cache is None
+            )
+            self._log_request_duration(prepared_request, response, context)
+            self.validate_response(response)
+        if cache is not None:
+            cache.put(prepared_request, response.content)
+            if stream:
+                # the body was downloaded to be cached: stream the rows from memory
+                response = make_cached_response(prepared_request, response.content)
+        self.rate_limiter.recover()
+        return response
+
+    def _log_request_duration(
+        self,
+        prepared_request: requests.PreparedRequest,
+        response: requests.Response,
+        context: Optional[dict],
+    ) -> None:
+        """
+        Write the `http_request_duration` metric log of a response (like the SDK).
+        """
+        if not self._LOG_REQUEST_METRICS:
+            return
+        extra_tags = {}
+        if self._LOG_REQUEST_METRIC_URLS:
+            extra_tags["url"] = prepared_request.path_url
+        self._write_request_duration_log(
+            endpoint=self.path,
+            response=response,
+            context=context,
+            extra_tags=extra_tags,
+        )
+
+    def _observe_rate_limit_wait(self, delay: float) -> None:
+        # time spent waiting for the rate limiters, not counted in the request durations
+        if self.sync_metrics is not None:
+            self.sync_metrics.increment(
+                "rate_limit_wait_seconds", delay, stream=self.name
+            )
+
+    def _observe_retry(self) -> None:
+        # failed requests retried by the async transport (see `_send_instrumented` for the requests engine)
+        if self.sync_metrics is not None:
+            self.sync_metrics.increment("retries", stream=self.name)
+
+    def _send_instrumented(
+        self,
+        sync_metrics: SyncMetrics,
+        prepared_request: requests.PreparedRequest,
+        context: Optional[dict],
+        stream: bool,
+        cache: Optional[ResponseCache],
+    ) -> requests.Response:
+        """
+        Same as `_send`, recording the request duration, the bytes received and the failed (retried) requests.
+        """
+        start = time.perf_counter()
+        try:
+            response = self.requests_session.send(
+                prepared_request, timeout=self.timeout, stream=stream and cache is None
+            )
+        except requests.exceptions.ReadTimeout:
+            sync_metrics.increment("retries", stream=self.name)
+            raise
+        duration = time.perf_counter() - start
+        sync_metrics.observe("http_request_duration", duration, stream=self.name)
+        if not stream:
+            # otherwise, the body is counted while it is read: see `parse_response`
+            sync_metrics.increment(
+                "bytes_received", len(response.content), stream=self.name
+            )
+        self._log_request_duration(prepared_request, response, context)
+        try:
+            self.validate_response(response)
+        except RetriableAPIError:
+            sync_metrics.increment("retries", stream=self.name)
+            raise
+        return response
+
     def get_url_params(
         self, context: Optional[dict], next_page_token: Optional[dict]
     ) -> Dict[str, Any]:
@@ -111,47 +1063,28 @@ class ATInternetStream(RESTStream):
         Note: Due to AT Internet API limitations (max 200000 total rows per API call,
         regardless of pagination [1]), we choose to split the full timespan (from start_date to today)
         into separate requests.
-        Each request is querying data for a single day (same 'start' and 'end' period parameter),
+        Each request is querying data for a single window (from 'start' to 'end' period parameter),
         and we iterate over both:
-            - the day (from the starting timestamp to today)
-            - the page (even for a single day, API responses typically return multiple pages)
+            - the window (from the starting timestamp to today), planned by the `WindowPlanner`
+            - the page (even for a single window, API responses typically return multiple pages)
 
         The iteration is done in the `get_next_page_token` method.
 
         [1]: https://developers.atinternet-solutions.com/data-api-en/reporting-api-v3/getting-started/how-does-it-work
         """
-        # on first request: use last state or 'start_date' as the day, and fetch page 1
-        # Note: this leads to duplicates in incremental mode (https://gitlab.com/meltano/meltano/-/issues/2504)
         if next_page_token is None:
-            # `get_starting_replication_key_value()` returns the stream replication key
-            # (useful for incremental sync) or, if no state was passed, returns the 'start_date' in config
-            self.min_start_date = self.str_to_date(
-                self.get_starting_replication_key_value(context)
-            )
-            start_date = self.min_start_date
-            _, end_date = get_start_end_days(
-                start_date.year, start_date.month, min_start_date=start_date
-            )
-            page_num = 1
-        else:
-            year, month = next_page_token["year_month"]
-            start_date, end_date = get_start_end_days(
-                year, month, min_start_date=self.min_start_date
-            )
-            page_num = next_page_token["page_num"]
+            # the requests of `request_records` always have a token: default to its first window
+            next_page_token = self._first_page_token(resume=None)
+        start_date, end_date = self.token_window(next_page_token)
+        page_num = next_page_token["page_num"]
 
-        filter_dict = {}
-        if self.config.get("filter_str"):
-            # $lk stands for 'contains'
-            filter_dict = {
-                "property": {"page_full_name": {"$lk": self.config.get("filter_str")}}
-            }
+        site_ids = self.get_site_ids(context)
+        columns = self.get_request_columns(site_ids)
 
         logging.info(f"INFO DATE: {start_date}/{end_date}")
         return {
-            "space": {"s": [self.config.get("site_id")]},
-            "columns": property_list_to_str(self.metrics)
-            + property_list_to_str(self.properties),
+            "space": {"s": site_ids},
+            "columns": columns,
             "period": {
                 "p1": [
                     {
@@ -161,30 +1094,162 @@ class ATInternetStream(RESTStream):
                     }
                 ]
             },
-            "filter": filter_dict,
-            # ATInternet requires you to sort by something...
-            "sort": ["-m_visits"],
-            "max-results": self.config.get("max_results"),
+            "filter": self.stream_filter.api_filter,
+            # ATInternet requires you to sort by something... (a unique order, see `make_sort`)
+            "sort": self.get_request_sort(columns),
+            "max-results": self.config["max_results"],
             "page-num": page_num,
         }
 
+    def get_request_columns(self, site_ids: List[int]) -> List[str]:
+        """
+        Return the columns requested to the API: the selected metrics of the stream (see `selected_metrics`)
+        and its properties.
+        """
+        columns = self.selected_metrics + property_list_to_str(self.properties)
+        if len(site_ids) > 1:
+            # several sites in the same request: split the rows per site
+            columns.append("site_id")
+        return columns
+
+    def _log_request_payload(self) -> None:
+        all_metrics = property_list_to_str(self.metrics)
+        columns = self.get_request_columns([])
+        message = f"Stream '{self.name}': requesting {len(columns)} columns {columns}"
+        not_requested = [name for name in all_metrics if name not in columns]
+        if not_requested:
+            message += f", instead of {len(columns) + len(not_requested)} (metrics not selected: {not_requested})"
+        if self.stream_filter.api_filter:
+            message += f", with the filter {self.stream_filter.api_filter}"
+        self.logger.info(message)
+
+    def parse_response(self, response: requests.Response) -> Iterable[dict]:
+        """
+        Yield the rows of the response `DataFeed.Rows`, without any JSONPath evaluation.
+        """
+        if not self.config.get("stream_rows"):
+            yield from self._read_page(response).rows
+        elif self.sync_metrics is None:
+            yield from stream_data_feed_rows(response)
+        else:
+            # rows are decoded while they are consumed
+            yield from self.sync_metrics.timed(
+                stream_data_feed_rows(response), "decode_seconds", stream=self.name
+            )
+            self.sync_metrics.increment(
+                "bytes_received", response.raw.tell(), stream=self.name
+            )
+        if self.config.get("stream_rows"):
+            self._count_payload(response.raw.tell())
+
+    @property
+    def row_transformer(self) -> RowTransformer:
+        """
+        Return the row transformer of the stream class, compiled once from its schema (see `build_row_transformer`).
+        """
+        cls = type(self)
+        if "_row_transformer" not in cls.__dict__:
+            cls._row_transformer = build_row_transformer(
+                self.schema,
+                property_list_to_str(self.metrics)
+                + property_list_to_str(self.properties),
+            )
+        return cls._row_transformer
+
+    @property
+    def page_transformer(self) -> Optional[PageTransformer]:
+        """
+        With `columnar_pages` (ignored with `stream_rows`), return the page transformer of the stream
+        (see `build_page_transformer`): the rows of each page are decoded into a `ColumnarPage`, already
+        transformed, and the `row_transformer` is not applied to them anymore.
+
+        It is compiled from the schema of the stream instance, which only has the 'site_id' column of the API
+        with the `site_ids` setting (see `site_column`).
+        """
+        if not self.config.get("columnar_pages") or self.config.get("stream_rows"):
+            return None
+        if self._page_transformer is None:
+            self._page_transformer = build_page_transformer(
+                self.schema,
+                property_list_to_str(self.metrics)
+                + property_list_to_str(self.properties),
+            )
+        return self._page_transformer
+
+    @property
+    def record_validator(self) -> Optional[RecordValidator]:
+        """
+        Return the validator of the records of the stream (see `RecordValidator`), compiled once from its schema and
+        the fields selected in the catalog, or None if the `record_validation` setting is 'off'.
+        """
+        if self._record_validator is None and self._record_validation is None:
+            self._record_validation = self.config.get("record_validation", "off")
+            self._record_validator = build_record_validator(
+                self._record_validation,
+                self.name,
+                self.schema,
+                [
+                    name
+                    for name in self.schema["properties"]
+                    if self.mask.get(("properties", name), True)
+                ],
+                # added by `post_process`, after the pages are validated
+                computed=["site_id"],
+                metrics=property_list_to_str(self.metrics),
+            )
+        return self._record_validator
+
     def post_process(self, row: dict, context: Optional[dict] = None) -> Optional[dict]:
-        if "visit_hour" in row and row["visit_hour"] == "N/A":
-            # "N/A" does not work when casting to integers, and we don't want null values either since it will
-            # be used in the composite primary key -> use -1 instead
-            row["visit_hour"] = -1
-        if "date" not in row:
-            # for some streams, we request monthly data from the API, but we still want a 'date' column in our data
-            # -> use the first day of the month
-            year = row["date_year"]
-            month = month_str_to_int[row["date_month"]]
-            row["date"] = self.date_to_str(datetime.date(year, month, 1))
+        if self.sync_metrics is None:
+            return self._post_process(row, context)
+        start = time.perf_counter()
+        processed = self._post_process(row, context)
+        self.sync_metrics.increment(
+            "post_process_seconds", time.perf_counter() - start, stream=self.name
+        )
+        return processed
+
+    def _post_process(self, row: dict, context: Optional[dict]) -> Optional[dict]:
+        if self.page_transformer is None:
+            row = self.row_transformer(row)
+        if self.site_column:
+            # the site of the partition, unless several sites are batched in the request
+            row["site_id"] = (
+                int(row["site_id"])
+                if "site_id" in row
+                else self.get_site_ids(context)[0]
+            )
+        record_validator = self.record_validator
+        if record_validator is not None and self.page_transformer is None:
+            # otherwise, the whole page has already been validated
+            record_validator.validate(row)
+        change_detector = self.change_detector
+        if change_detector is not None and not change_detector.is_changed(row):
+            # already emitted by the last run, with the same values
+            return None
+        dedup_index = self.parent_tap.dedup_index
+        dedup_run = self.dedup_run
+        if (
+            dedup_index is not None
+            and dedup_run is not None
+            and not dedup_index.is_changed(
+                self.name, *dedup_run, row, self.primary_keys
+            )
+        ):
+            return None
         return row
 
     def validate_response(self, response: requests.Response) -> None:
         """
         Override the parent method to give more details on 400 errors, by logging the request body.
         """
+        if response.status_code == 429:
+            # too many requests: slow down all the requests of the API key, and retry later
+            self.rate_limiter.penalize(parse_retry_after(response))
+            raise RetriableAPIError(
+                f"429 Client Error: {response.reason} for path: {self.path}"
+            )
+
         if 400 <= response.status_code < 500:
             msg = (
                 f"{response.status_code} Client Error: "
@@ -0,0 +1,158 @@
+"""Columnar in-memory representation of the rows of a page (or window) of a getData response."""
+import sys
+from array import array
+from typing import Any, Dict, Iterator, List, Sequence, Union, overload
+
+# a typed array (integers, floats), a dictionary-encoded column (distinct values and codes), or a plain list
+Column = Union[array, "DictionaryColumn", List[Any]]
+
+
+class DictionaryColumn:
+    """
+    Column of (mostly) repeated values, e.g. page names or referrers: each distinct value is stored once, and each
+    row only holds its code, the index of its value.
+    """
+
+    def __init__(self, values: Sequence[Any] = ()):
+        self.values: List[Any] = []
+        self.codes = array("I")
+        self._index: Dict[Any, int] = {}
+        self.extend(values)
+
+    def extend(self, values: Sequence[Any]) -> None:
+        index = self._index
+        distinct = self.values
+        codes = []
+        for value in values:
+            code = index.get(value)
+            if code is None:
+                code = index[value] = len(distinct)
+                distinct.append(sys.intern(value) if value.__class__ is str else value)
+            codes.append(code)
+        self.codes.extend(codes)
+
+    def extend_column(self, other: "DictionaryColumn") -> None:
+        """Append the values of another dictionary-encoded column, remapping its codes to the codes of this one."""
+        index = self._index
+        distinct = self.values
+        remap = []
+        for value in other.values:
+            code = index.get(value)
+            if code is None:
+                code = index[value] = len(distinct)
+                distinct.append(value)
+            remap.append(code)
+        self.codes.extend(map(remap.__getitem__, other.codes))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __iter__(self) -> Iterator[Any]:
+        return map(self.values.__getitem__, self.codes)
+
+    def __getitem__(self, i: int) -> Any:
+        return self.values[self.codes[i]]
+
+
+def make_column(values: List[Any], kind: str) -> Column:
+    """
+    Return a column holding `values`: a typed array for the 'integer' and 'number' kinds (if there are no null
+    values), a dictionary-encoded column for the 'string' kind, and `values` itself otherwise.
+    """
+    try:
+        if kind == "integer":
+            return array("q", values)
+        if kind == "number":
+            return array("d", values)
+    except TypeError:
+        # null values
+        return values
+    if kind == "string":
+        return DictionaryColumn(values)
+    return values
+
+
+def extend_column(column: Column, values: Column) -> Column:
+    """Append `values` (a column of the same kind) to `column`, and return the resulting column."""
+    if isinstance(column, array) and isinstance(values, array):
+        if column.typecode == values.typecode:
+            column.extend(values)
+            return column
+    elif isinstance(column, DictionaryColumn):
+        if isinstance(values, DictionaryColumn):
+            column.extend_column(values)
+        else:
+            column.extend(values)
+        return column
+    # mixed kinds (e.g. null values in one of the pages)
+    return list(column) + list(values)
+
+
+class ColumnarPage(Sequence[dict]):
+    """
+    Rows of a page stored column by column (see `make_column`), instead of one dict per row: the keys are stored
+    once per page instead of once per row, and repeated strings only once.
+
+    The rows (dicts) are created lazily, when they are iterated over.
+    """
+
+    def __init__(self, columns: Dict[str, Column], length: int):
+        self.columns = columns
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[dict]:
+        names = list(self.columns)
+        for values in zip(*self.columns.values()):
+            yield dict(zip(names, values))
+
+    @overload
+    def __getitem__(self, i: int) -> dict:
+        ...
+
+    @overload
+    def __getitem__(self, i: slice) -> List[dict]:
+        ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.length))]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return {name: column[i] for name, column in self.columns.items()}
+
+    def extend(self, other: "ColumnarPage") -> None:
+        """Append the rows of another page with the same columns (e.g. the next page of the same window)."""
+        if not self.length:
+            self.columns, self.length = other.columns, other.length
+            return
+        if not other.length:
+            return
+        if list(self.columns) != list(other.columns):
+            raise ValueError("Cannot concatenate pages with different columns")
+        for name, column in self.columns.items():
+            self.columns[name] = extend_column(column, other.columns[name])
+        self.length += other.length
+
+
+def concat_rows(rows: Sequence[dict], more: Sequence[dict]) -> Sequence[dict]:
+    """
+    Append the rows of a page to the rows of the previous pages (of the same window), without creating their dicts
+    if both are columnar pages. Return the resulting rows.
+    """
+    if not more:
+        return rows
+    if not rows and isinstance(more, ColumnarPage):
+        return more
+    if isinstance(rows, ColumnarPage) and isinstance(more, ColumnarPage):
+        if list(rows.columns) == list(more.columns):
+            rows.extend(more)
+            return rows
+    if not isinstance(rows, list):
+        rows = list(rows)
+    rows.extend(more)
+    return rows
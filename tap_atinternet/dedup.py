@@ -0,0 +1,195 @@
+"""On-disk indexes of the records already emitted, to drop the unchanged records."""
+import sqlite3
+import threading
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from tap_atinternet.refresh import row_digest
+
+
+class _SQLiteIndex:
+    """
+    SQLite database shared by the threads of the parallel syncs, behind a lock.
+
+    Changes are only committed with `commit`, called when a STATE message is written: if
+    a sync fails, the records emitted after the last STATE message are not considered
+    loaded by the next run.
+    """
+
+    # created if missing when the index is opened
+    table_definition: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(self.table_definition)
+        self._connection.commit()
+
+    def commit(self) -> None:
+        with self._lock:
+            self._connection.commit()
+
+    def close(self) -> None:
+        """Close the index, dropping the uncommitted changes."""
+        with self._lock:
+            self._connection.close()
+
+
+class DedupIndex(_SQLiteIndex):
+    """
+    SQLite table mapping the primary key of every record emitted (a digest of the stream
+    name and primary key values) to a digest of its other values.
+
+    A record with the same values as the last time its primary key was emitted is
+    suppressed: it is already loaded in the target, so that reruns and overlapping
+    windows do not lead to pointless upserts. The index is kept on disk, so that memory
+    stays bounded (by the SQLite page cache) for millions of keys: each key takes about
+    16 bytes.
+
+    Like the digests of a `RefreshIndex`, the records of a stream (or partition) belong
+    to a "run", whose id is saved in the stream state (`dedup_run`): when the state is
+    reset, a new run id is created and the records of the stream are all emitted again.
+    """
+
+    table_definition = (
+        "CREATE TABLE IF NOT EXISTS dedup_records "
+        "(run TEXT NOT NULL, key BLOB NOT NULL, scope TEXT NOT NULL, "
+        "hash BLOB NOT NULL, PRIMARY KEY (run, key)) WITHOUT ROWID"
+    )
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.emitted: Counter = Counter()
+        self.suppressed: Counter = Counter()
+
+    def start_run(self, scope: str, run: Optional[str]) -> str:
+        """
+        Return the id of the run of a stream (or partition): `run`, saved in its state,
+        or a new id if there is none (first run, or the state was reset), dropping the
+        records of its other runs.
+        """
+        if run is not None:
+            return run
+        run = uuid.uuid4().hex
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM dedup_records WHERE scope = ? AND run != ?", (scope, run)
+            )
+        return run
+
+    def is_changed(
+        self,
+        stream: str,
+        scope: str,
+        run: str,
+        record: dict,
+        primary_keys: List[str],
+    ) -> bool:
+        """
+        Return False if the record was already emitted by the run with the same values,
+        and index it otherwise.
+        """
+        key = row_digest([stream] + [record.get(name) for name in primary_keys])
+        content_hash = row_digest(
+            {name: value for name, value in record.items() if name not in primary_keys}
+        )
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT hash FROM dedup_records WHERE run = ? AND key = ?", (run, key)
+            ).fetchone()
+            if row is not None and row[0] == content_hash:
+                self.suppressed[stream] += 1
+                return False
+            self._connection.execute(
+                "INSERT OR REPLACE INTO dedup_records (run, key, scope, hash) "
+                "VALUES (?, ?, ?, ?)",
+                (run, key, scope, content_hash),
+            )
+            self.emitted[stream] += 1
+        return True
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        """Return the number of records emitted and suppressed, per stream."""
+        with self._lock:
+            return {
+                stream: {
+                    "emitted": self.emitted[stream],
+                    "suppressed": self.suppressed[stream],
+                }
+                for stream in sorted(set(self.emitted) | set(self.suppressed))
+            }
+
+
+class RefreshIndex(_SQLiteIndex):
+    """
+    SQLite table of the digests of the records of the open month emitted by the
+    incremental runs (see `ChangeDetector`): for each primary key, a digest of the other
+    values.
+
+    The digests of a stream (or partition) belong to a "run", whose id is saved in the
+    stream state (`refresh_run`): they are only trusted while the state refers to them,
+    and a new run id is created (and the digests of the stream dropped) when the state
+    is reset.
+    """
+
+    table_definition = (
+        "CREATE TABLE IF NOT EXISTS refresh_digests "
+        "(run TEXT NOT NULL, key BLOB NOT NULL, scope TEXT NOT NULL, "
+        "month TEXT NOT NULL, hash BLOB NOT NULL, PRIMARY KEY (run, key)) "
+        "WITHOUT ROWID"
+    )
+
+    def reset(self, scope: str, run: str) -> None:
+        """Drop the digests of the other runs of a stream (or partition) than `run`."""
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM refresh_digests WHERE scope = ? AND run != ?", (scope, run)
+            )
+
+    def months(self, run: str) -> Set[str]:
+        """Return the months ("YYYY-MM") with digests in a run."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT month FROM refresh_digests WHERE run = ?", (run,)
+            ).fetchall()
+        return {month for (month,) in rows}
+
+    def is_changed(
+        self,
+        scope: str,
+        run: str,
+        month: str,
+        record: dict,
+        primary_keys: List[str],
+        store: bool = True,
+    ) -> bool:
+        """
+        Return False if the record was emitted with the same values by the run, and (if
+        `store`) index it otherwise.
+        """
+        key = row_digest([record.get(name) for name in primary_keys])
+        content_hash = row_digest(
+            {name: value for name, value in record.items() if name not in primary_keys}
+        )
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT hash FROM refresh_digests WHERE run = ? AND key = ?", (run, key)
+            ).fetchone()
+            if row is not None and row[0] == content_hash:
+                return False
+            if store:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO refresh_digests "
+                    "(run, key, scope, month, hash) VALUES (?, ?, ?, ?, ?)",
+                    (run, key, scope, month, content_hash),
+                )
+        return True
+
+    def drop_months(self, run: str, before: str) -> None:
+        """Drop the digests of a run for the months before `before` ("YYYY-MM")."""
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM refresh_digests WHERE run = ? AND month < ?", (run, before)
+            )
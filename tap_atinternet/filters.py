@@ -0,0 +1,120 @@
+"""Server-side filters of the API requests, built from the `filter_str` and `stream_filters` settings."""
+import datetime
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional
+
+from singer_sdk.exceptions import ConfigValidationError
+
+# key of the `stream_filters` setting applying to all the streams
+ALL_STREAMS = "*"
+# sections of the API 'filter' parameter
+PREDICATE_SECTIONS = ("property", "metric")
+DATE_BOUNDS = ("start_date", "end_date")
+
+
+class StreamFilter(NamedTuple):
+    """
+    Filters of the requests of a stream: the API 'filter' parameter, and the period to request.
+    """
+
+    # 'filter' parameter of the requests, with a 'property' and/or a 'metric' section
+    api_filter: Dict[str, dict]
+    # metrics used by the 'metric' predicates, requested even if they are not selected in the catalog
+    metrics: List[str]
+    # no data is requested before `start_date` (on top of the `start_date` setting) nor after `end_date`
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+
+
+def combine_predicates(predicates: List[dict]) -> dict:
+    """Return a predicate matching the rows matching all the `predicates`."""
+    if len(predicates) == 1:
+        return predicates[0]
+    return {"$AND": predicates}
+
+
+def predicate_columns(predicate: Mapping[str, Any]) -> List[str]:
+    """Return the columns used by a predicate (e.g. `{"$OR": [{"m_visits": {"$gt": 5}}, ...]}`)."""
+    columns: List[str] = []
+    for key, value in predicate.items():
+        if not key.startswith("$"):
+            columns.append(key)
+        elif isinstance(value, list):
+            for operand in value:
+                columns += predicate_columns(operand)
+    return columns
+
+
+def validate_stream_filters(
+    stream_filters: Mapping[str, Any], stream_names: List[str]
+) -> None:
+    """
+    Check the `stream_filters` setting, raising a ConfigValidationError if it is not valid.
+    """
+    for name, stream_filter in stream_filters.items():
+        if name != ALL_STREAMS and name not in stream_names:
+            raise ConfigValidationError(
+                f"stream_filters: unknown stream '{name}' (expected one of {stream_names} or '{ALL_STREAMS}')"
+            )
+        if not isinstance(stream_filter, dict):
+            raise ConfigValidationError(
+                f"stream_filters: the filter of '{name}' must be an object"
+            )
+        for key, value in stream_filter.items():
+            if key in PREDICATE_SECTIONS:
+                if not isinstance(value, dict) or not value:
+                    raise ConfigValidationError(
+                        f"stream_filters: '{name}.{key}' must be a non-empty object"
+                    )
+            elif key in DATE_BOUNDS:
+                try:
+                    datetime.date.fromisoformat(value)
+                except (TypeError, ValueError):
+                    raise ConfigValidationError(
+                        f"stream_filters: '{name}.{key}' must be a date (YYYY-MM-DD), got {value!r}"
+                    )
+            else:
+                raise ConfigValidationError(
+                    f"stream_filters: unknown key '{key}' in the filter of '{name}' "
+                    f"(expected {', '.join(PREDICATE_SECTIONS + DATE_BOUNDS)})"
+                )
+
+
+def get_stream_filter(config: Mapping[str, Any], stream_name: str) -> StreamFilter:
+    """
+    Return the filters of a stream: the `filter_str` setting (pages containing this string), the filters of all the
+    streams (`stream_filters` under "*") and the filters of the stream (`stream_filters` under its name), combined.
+
+    Dates bounds are combined the same way: the latest `start_date` and the earliest `end_date` are kept.
+    """
+    predicates: Dict[str, List[dict]] = {section: [] for section in PREDICATE_SECTIONS}
+    if config.get("filter_str"):
+        # $lk stands for 'contains'
+        predicates["property"].append(
+            {"page_full_name": {"$lk": config.get("filter_str")}}
+        )
+    start_dates: List[datetime.date] = []
+    end_dates: List[datetime.date] = []
+    stream_filters = config.get("stream_filters") or {}
+    for key in (ALL_STREAMS, stream_name):
+        stream_filter = stream_filters.get(key) or {}
+        for section in PREDICATE_SECTIONS:
+            if section in stream_filter:
+                predicates[section].append(stream_filter[section])
+        if "start_date" in stream_filter:
+            start_dates.append(datetime.date.fromisoformat(stream_filter["start_date"]))
+        if "end_date" in stream_filter:
+            end_dates.append(datetime.date.fromisoformat(stream_filter["end_date"]))
+    return StreamFilter(
+        api_filter={
+            section: combine_predicates(section_predicates)
+            for section, section_predicates in predicates.items()
+            if section_predicates
+        },
+        metrics=[
+            column
+            for predicate in predicates["metric"]
+            for column in predicate_columns(predicate)
+        ],
+        start_date=max(start_dates) if start_dates else None,
+        end_date=min(end_dates) if end_dates else None,
+    )
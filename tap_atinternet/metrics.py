@@ -0,0 +1,197 @@
+"""Performance instrumentation of the tap: timings and counters per stream, for each phase of a sync."""
+import bisect
+import json
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROWS_BUCKETS = (0, 10, 100, 500, 1000, 2500, 5000, 10000)
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Histogram:
+    """
+    Distribution of the observed values, in cumulative buckets (as in Prometheus histograms).
+    """
+
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> List[Tuple[str, int]]:
+        """Return the (upper bound, number of values under it) of each bucket, '+Inf' included."""
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        cumulative, total = [], 0
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(self.cumulative_counts()),
+        }
+
+
+class SyncMetrics:
+    """
+    Thread-safe store of the metrics of a sync, identified by a name and tags (at least the stream name).
+
+    The phases of a sync are:
+        - http: sending a request and receiving its response (histogram per request, `http_request_duration`)
+        - decode: JSON decoding of a page (histogram per page, `decode_duration`)
+        - post_process, validation (type conformance of the SDK), output (writing the Singer messages):
+        total time over all the rows (`<phase>_seconds` counters)
+    Other metrics: `bytes_received`, `retries`, `rows_per_page` (histogram), `pages` (per month of the window),
+    `rate_limit_wait_seconds` (time spent waiting for the rate limiters, not counted in the request durations).
+
+    Streams only call it when instrumentation is enabled (see the `collect_metrics` setting), so that it costs
+    nothing otherwise.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[MetricKey, Histogram] = {}
+        self.counters: Dict[MetricKey, float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, tags: Dict[str, str]) -> MetricKey:
+        return name, tuple(sorted(tags.items()))
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Iterable[float] = DURATION_BUCKETS,
+        **tags: str,
+    ) -> None:
+        key = self._key(name, tags)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, **tags: str) -> None:
+        key = self._key(name, tags)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def timed(self, iterable: Iterable[T], name: str, **tags: str) -> Iterator[T]:
+        """
+        Yield the items of `iterable`, and add the time spent producing them to the `name` counter.
+
+        The time spent by the consumer between two items is not counted.
+        """
+        elapsed = 0.0
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            self.increment(name, elapsed, **tags)
+
+    def stream_metrics(self, stream: str) -> List[dict]:
+        """
+        Return the metrics of a stream, in the format of the Singer SDK metric logs.
+        """
+        metrics = []
+        with self._lock:
+            for (name, tags), value in sorted(self.counters.items()):
+                if dict(tags).get("stream") == stream:
+                    metric_type = "timer" if name.endswith("_seconds") else "counter"
+                    metrics.append(
+                        {
+                            "type": metric_type,
+                            "metric": name,
+                            "value": value,
+                            "tags": dict(tags),
+                        }
+                    )
+            for (name, tags), histogram in sorted(self.histograms.items()):
+                if dict(tags).get("stream") == stream:
+                    metrics.append(
+                        {
+                            "type": "histogram",
+                            "metric": name,
+                            "value": histogram.to_dict(),
+                            "tags": dict(tags),
+                        }
+                    )
+        return metrics
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [
+                    {"metric": name, "tags": dict(tags), "value": value}
+                    for (name, tags), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    dict(metric=name, tags=dict(tags), **histogram.to_dict())
+                    for (name, tags), histogram in sorted(self.histograms.items())
+                ],
+            }
+
+    def to_prometheus(self, prefix: str = "tap_atinternet_") -> str:
+        """
+        Return the metrics in the Prometheus text exposition format (e.g. for the node exporter textfile collector).
+        """
+
+        def labels(tags, **extra) -> str:
+            items = list(tags) + list(extra.items())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {prefix}{name} counter")
+                for (other, tags), value in sorted(self.counters.items()):
+                    if other == name:
+                        lines.append(f"{prefix}{name}{labels(tags)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                for (other, tags), histogram in sorted(self.histograms.items()):
+                    if other != name:
+                        continue
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append(
+                            f"{prefix}{name}_bucket{labels(tags, le=bound)} {count}"
+                        )
+                    lines.append(f"{prefix}{name}_sum{labels(tags)} {histogram.sum}")
+                    lines.append(
+                        f"{prefix}{name}_count{labels(tags)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Write all the metrics to `path`: in the Prometheus text format if it ends with '.prom', in JSON otherwise.
+        """
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+        with open(path, "w") as f:
+            f.write(content)
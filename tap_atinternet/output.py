@@ -0,0 +1,125 @@
+"""Fast output modes of the Singer messages: buffered RECORD messages, or batch files with BATCH messages."""
+import gzip
+import json
+import sys
+import uuid
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, List, Tuple
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+from singer.messages import RecordMessage
+
+try:
+    # optional dependency (`pip install tap-atinternet[speedups]`)
+    import orjson
+
+    def dumps(message: Any) -> str:
+        return orjson.dumps(message, default=str).decode()
+
+except ImportError:  # pragma: no cover
+    dumps: Callable[[Any], str] = json.JSONEncoder(  # type: ignore
+        separators=(",", ":"), default=str
+    ).encode
+
+# size of the output buffer, in characters
+BUFFER_SIZE = 1024 * 1024
+
+
+def record_message_dict(message: RecordMessage) -> dict:
+    """
+    Return the same dict as `RecordMessage.asdict`, with a faster (ISO 8601) formatting of `time_extracted`.
+    """
+    result = {"type": "RECORD", "stream": message.stream, "record": message.record}
+    if message.version is not None:
+        result["version"] = message.version
+    if message.time_extracted:
+        result["time_extracted"] = message.time_extracted.isoformat()
+    return result
+
+
+class BufferedOutput:
+    """
+    Write the Singer messages to stdout in large chunks, instead of one write (and flush) per message.
+
+    Messages are serialized with orjson if available, in compact JSON. The buffer must be flushed before
+    writing any message by other means (SCHEMA and STATE messages), to keep the messages in order.
+    """
+
+    def __init__(self, buffer_size: int = BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._buffer: List[str] = []
+        self._size = 0
+
+    def write_message(self, message: dict) -> None:
+        line = dumps(message)
+        self._buffer.append(line)
+        self._size += len(line) + 1
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def write_record(self, message: RecordMessage, month: str) -> None:
+        self.write_message(record_message_dict(message))
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._buffer.append("")
+            sys.stdout.write("\n".join(self._buffer))
+            sys.stdout.flush()
+            self._buffer = []
+            self._size = 0
+
+
+class BatchOutput:
+    """
+    Write the records to gzip-compressed JSONL files in `directory`, one file per stream and month, and point
+    the target to them with BATCH messages (in the format of the Singer SDK batch messages), instead of
+    writing one RECORD message per record.
+
+    The files are closed and their BATCH messages written by `flush`, before each STATE message, so that a
+    STATE message always comes after the records it covers.
+    """
+
+    def __init__(self, directory: str, messages: BufferedOutput):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.messages = messages
+        self.files: Dict[Tuple[str, str], Tuple[Path, IO[str]]] = {}
+
+    def write_record(self, message: RecordMessage, month: str) -> None:
+        key = (message.stream, month)
+        if key not in self.files:
+            path = (
+                self.directory / f"{message.stream}-{month}-{uuid.uuid4().hex}.jsonl.gz"
+            )
+            # fast compression: the files are read once by the target
+            self.files[key] = path, gzip.open(path, "wt", compresslevel=1)
+        self.files[key][1].write(dumps(message.record) + "\n")
+
+    def flush(self) -> None:
+        manifests: Dict[str, List[str]] = {}
+        for (stream, _), (path, file) in self.files.items():
+            file.close()
+            manifests.setdefault(stream, []).append(path.resolve().as_uri())
+        self.files = {}
+        for stream, manifest in manifests.items():
+            self.messages.write_message(
+                {
+                    "type": "BATCH",
+                    "stream": stream,
+                    "encoding": {"format": "jsonl", "compression": "gzip"},
+                    "manifest": manifest,
+                }
+            )
+        self.messages.flush()
+
+
+def batch_file_path(uri: str) -> str:
+    """Return the local path of a batch file, from its URI in a BATCH message manifest."""
+    return url2pathname(urlparse(uri).path)
+
+
+def read_batch_file(uri: str) -> List[dict]:
+    """Return the records of a batch file, from its URI in a BATCH message manifest."""
+    with gzip.open(batch_file_path(uri), "rt") as file:
+        return [json.loads(line) for line in file]
@@ -0,0 +1,130 @@
+"""Planning of the periods (windows) requested to the AT Internet API."""
+import datetime
+from typing import List, Optional, Tuple
+
+from tap_atinternet.utils import get_start_end_days, is_closed_month
+
+# AT Internet API limit: max number of rows returned by a single API call, regardless of pagination
+API_MAX_ROWS = 200000
+
+Window = Tuple[datetime.date, datetime.date]
+
+
+class WindowPlanner:
+    """
+    Plan the windows (start and end days) of the API requests, to make as few requests as possible while staying
+    under the API_MAX_ROWS limit.
+
+    The planner estimates the number of rows of a window from the density of the stream (rows per day), as
+    observed in previous windows or previous runs:
+        - without any density estimate, use calendar months (the historical behavior)
+        - if the estimate for a month is far from the limit, merge it with the next months (up to `max_months`)
+        - if the estimate for a month gets close to the limit, split it into shorter windows (weeks, days).
+        This is only possible for streams with a daily grain (with a 'date' column): for monthly streams, rows
+        are aggregated over the whole month, so a month can never be split.
+    A window that hit the API row limit anyway is split again (see `split`).
+    A window never mixes closed months and the current (still open) month, so that closed windows can be cached.
+    """
+
+    def __init__(
+        self,
+        daily_grain: bool,
+        rows_per_day: Optional[float] = None,
+        max_rows: int = API_MAX_ROWS,
+        fill_ratio: float = 0.5,
+        max_months: int = 12,
+    ):
+        self.daily_grain = daily_grain
+        self.rows_per_day = rows_per_day
+        # keep a safety margin, since the density of a stream varies from one window to the next
+        self.target_rows = max_rows * fill_ratio
+        self.max_months = max_months
+
+    def estimate_rows(
+        self, start_date: datetime.date, end_date: datetime.date
+    ) -> float:
+        days = (end_date - start_date).days + 1
+        return (self.rows_per_day or 0) * days
+
+    def next_window(
+        self, start_date: datetime.date, today: Optional[datetime.date] = None
+    ) -> Window:
+        """
+        Return the next window to request, starting on `start_date` and ending at the latest on `today`.
+        """
+        today = today or datetime.date.today()
+        _, end_date = get_start_end_days(
+            start_date.year, start_date.month, min_start_date=start_date
+        )
+        end_date = min(end_date, today)
+        if self.rows_per_day is None:
+            return start_date, end_date
+
+        if self.estimate_rows(start_date, end_date) > self.target_rows:
+            if not self.daily_grain:
+                return start_date, end_date
+            n_days = max(1, int(self.target_rows // self.rows_per_day))
+            return start_date, min(
+                start_date + datetime.timedelta(days=n_days - 1), end_date
+            )
+
+        n_months = 1
+        start_is_closed = is_closed_month(start_date.year, start_date.month, today)
+        while n_months < self.max_months and end_date < today:
+            next_day = end_date + datetime.timedelta(days=1)
+            if start_is_closed != is_closed_month(next_day.year, next_day.month, today):
+                break
+            _, next_end_date = get_start_end_days(next_day.year, next_day.month)
+            next_end_date = min(next_end_date, today)
+            if self.estimate_rows(start_date, next_end_date) > self.target_rows:
+                break
+            end_date = next_end_date
+            n_months += 1
+        return start_date, end_date
+
+    def plan(
+        self, start_date: datetime.date, today: Optional[datetime.date] = None
+    ) -> List[Window]:
+        """
+        Plan all the windows from `start_date` to `today`, with the current density estimate.
+        """
+        today = today or datetime.date.today()
+        windows = []
+        while start_date <= today:
+            window = self.next_window(start_date, today)
+            windows.append(window)
+            start_date = window[1] + datetime.timedelta(days=1)
+        return windows
+
+    def split(self, start_date: datetime.date, end_date: datetime.date) -> List[Window]:
+        """
+        Return the shorter windows to request instead of a window that hit the API row limit, or an empty list if
+        it can't be split (a single day, or a single month for the monthly streams).
+
+        The months merged from an under-estimated density are requested again one at a time (and the next months are
+        not merged anymore); the windows of the daily grain streams are also split with the new density estimate.
+        """
+        months_merged = (start_date.year, start_date.month) != (
+            end_date.year,
+            end_date.month,
+        )
+        if months_merged:
+            self.max_months = 1
+        elif not self.daily_grain or start_date == end_date:
+            return []
+        return self.plan(start_date, end_date)
+
+    def observe(
+        self, start_date: datetime.date, end_date: datetime.date, row_count: int
+    ) -> None:
+        """
+        Update the density estimate with the number of rows returned for a window.
+
+        Increases are taken into account right away, decreases only progressively.
+        """
+        days = (end_date - start_date).days + 1
+        observed = row_count / days
+        if self.rows_per_day is None:
+            self.rows_per_day = observed
+        else:
+            self.rows_per_day = max(observed, (self.rows_per_day + observed) / 2)
@@ -0,0 +1,85 @@
+"""Change detection of the rows of the open month, between two incremental runs."""
+import datetime
+import hashlib
+import json
+import uuid
+from typing import TYPE_CHECKING, Any, List, Optional
+
+if TYPE_CHECKING:
+    from tap_atinternet.dedup import RefreshIndex
+
+# size of a row digest, in bytes: the collision probability stays negligible for
+# millions of rows per month
+DIGEST_SIZE = 8
+# created once: `json.dumps` with non-default options creates a new encoder on each call
+_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"), default=str)
+
+
+def row_digest(record: Any) -> bytes:
+    """
+    Return the digest of a record (primary key and values), or of any other JSON value.
+    """
+    content = _encoder.encode(record)
+    return hashlib.blake2b(content.encode(), digest_size=DIGEST_SIZE).digest()
+
+
+class ChangeDetector:
+    """
+    Tell apart the records that changed since they were last emitted by the incremental
+    runs, from the digests of the records of the open month kept in a `RefreshIndex`
+    (see `row_digest`).
+
+    Every incremental run requests the open month again from its first day (monthly
+    streams) or from the last day synced (daily streams): the records with the same
+    values as the last time their primary key was emitted are already loaded in the
+    target, and only the new or updated ones need to be emitted. The digests are stored
+    in the index as the records are emitted, and committed with the STATE messages:
+    the records emitted by an interrupted run are compared too. The stream state only
+    keeps the id of the run of the digests (`run`).
+    """
+
+    def __init__(
+        self,
+        index: "RefreshIndex",
+        scope: str,
+        primary_keys: List[str],
+        run: Optional[str] = None,
+        today: Optional[datetime.date] = None,
+    ):
+        self.index = index
+        self.scope = scope
+        self.primary_keys = primary_keys
+        if run is None:
+            # first run, or the state was reset: the older digests are not trusted
+            run = uuid.uuid4().hex
+            index.reset(scope, run)
+        self.run = run
+        # the months compared with the digests of the last runs (the last month is
+        # compared once more by the first run of the next month)
+        self.months = index.months(run)
+        self.open_month = (today or datetime.date.today()).strftime("%Y-%m")
+        self.unchanged = 0
+
+    def is_changed(self, record: dict) -> bool:
+        """
+        Return False if the record was already emitted with the same values by the last
+        runs.
+        """
+        month = record["date"][:7]
+        if month != self.open_month and month not in self.months:
+            return True
+        if self.index.is_changed(
+            self.scope,
+            self.run,
+            month,
+            record,
+            self.primary_keys,
+            store=month == self.open_month,
+        ):
+            return True
+        self.unchanged += 1
+        return False
+
+    def finish(self) -> None:
+        """Drop the digests of the closed months, once the run has compared them."""
+        self.index.drop_months(self.run, before=self.open_month)
@@ -0,0 +1,78 @@
+"""Decoding of AT Internet API responses."""
+import json
+from typing import Any, Callable, Iterator, NamedTuple, Optional, Sequence
+
+import requests
+
+try:
+    # optional dependency (`pip install tap-atinternet[speedups]`), much faster on multi-megabyte pages
+    import orjson
+
+    json_loads: Callable[[bytes], Any] = orjson.loads
+except ImportError:  # pragma: no cover
+    json_loads = json.loads
+
+
+class DataFeedPage(NamedTuple):
+    """
+    A single decoded page of a getData response
+    """
+
+    rows: Sequence[dict]
+    # number of rows in the page (rows may already have been consumed, see `stream_data_feed_rows`)
+    row_count: int
+
+
+def parse_data_feed(
+    content: bytes, transform_rows: Optional[Callable[[list], Sequence[dict]]] = None
+) -> DataFeedPage:
+    """
+    Decode the body of a getData response, and return its rows.
+
+    If given, `transform_rows` is applied to the decoded rows of the page (e.g. to store them as a `ColumnarPage`).
+    """
+    data_feed = json_loads(content)["DataFeed"]
+    rows = data_feed["Rows"]
+    return DataFeedPage(
+        rows=rows if transform_rows is None else transform_rows(rows),
+        row_count=len(rows),
+    )
+
+
+def read_data_feed(
+    response: requests.Response,
+    transform_rows: Optional[Callable[[list], Sequence[dict]]] = None,
+) -> DataFeedPage:
+    """
+    Decode the response body only once, no matter how many times this is called with the same response.
+    """
+    page = getattr(response, "_data_feed_page", None)
+    if page is None:
+        page = parse_data_feed(response.content, transform_rows)
+        setattr(response, "_data_feed_page", page)
+    return page
+
+
+def stream_data_feed_rows(response: requests.Response) -> Iterator[dict]:
+    """
+    Parse the rows of a getData response incrementally, while they are read from the HTTP stream.
+
+    Only one row at a time is kept in memory, instead of the whole body and all the decoded rows.
+    The response must have been sent with `stream=True`. Once all the rows are consumed, the page (with
+    its row count, but without its rows) can be read with `read_data_feed`.
+    """
+    try:
+        # optional dependency (`pip install tap-atinternet[streaming]`), only imported when `stream_rows` is used
+        import ijson
+    except ImportError:  # pragma: no cover
+        raise ImportError(
+            "The 'stream_rows' setting requires the ijson package "
+            "(`pip install tap-atinternet[streaming]`)"
+        )
+    # let urllib3 decompress gzip-encoded bodies
+    response.raw.decode_content = True
+    row_count = 0
+    for row in ijson.items(response.raw, "DataFeed.Rows.item", use_float=True):
+        row_count += 1
+        yield row
+    setattr(response, "_data_feed_page", DataFeedPage(rows=(), row_count=row_count))
@@ -1,15 +1,41 @@
 """Stream type classes for tap-atinternet."""
 
 from singer_sdk import typing as th  # JSON schema typing helpers
+
 from tap_atinternet.client import ATInternetStream
-from tap_atinternet.utils import merge_properties_lists, property_list_to_str
+from tap_atinternet.utils import (
+    lazy_class_attribute,
+    merge_properties_lists,
+    property_list_to_str,
+)
 
+# the API returns "N/A" (or "-") for undefined metrics: with `record_validation`, they are emitted as null, and the
+# metrics are nullable (see ATInternetStream.nullable_metrics)
 SHARED_METRICS = th.PropertiesList(
     th.Property("m_visits", th.IntegerType, required=True),
     th.Property("m_unique_visitors", th.IntegerType, required=True),
     th.Property("m_bounces", th.IntegerType, required=True),
     th.Property("m_time_spent_per_visits", th.NumberType, required=True),
 )
+# we don't want to use the date in AT Internet API requests of the monthly streams, but we still want to (manually)
+# save it in the records, to allow for a "date" replication key
+MONTHLY_DATE_PROPERTIES = th.PropertiesList(
+    th.Property("date", th.DateType, required=True)
+)
+
+
+# schema of a stream class: its metrics, properties and extra properties, built when it
+# is first used rather than when the module is imported
+stream_schema = lazy_class_attribute(
+    lambda cls: merge_properties_lists(
+        cls.metrics, cls.properties, cls.extra_properties
+    ).to_dict()
+)
+# composite primary key of a stream class: all its properties (and the site, if there
+# are several sites: see ATInternetStream.site_column)
+stream_primary_keys = lazy_class_attribute(
+    lambda cls: property_list_to_str(cls.properties)
+)
 
 
 class HourlyVisitsStream(ATInternetStream):
@@ -33,9 +59,9 @@ class HourlyVisitsStream(ATInternetStream):
     # See https://www.stitchdata.com/docs/replication/replication-methods/key-based-incremental to learn more about
     # Key-based incremental replication
     replication_key = "date"
-    schema = merge_properties_lists(metrics, properties).to_dict()
+    schema = stream_schema
     # composite primary key
-    primary_keys = property_list_to_str(properties)
+    primary_keys = stream_primary_keys
 
 
 class GeoVisitsStream(ATInternetStream):
@@ -55,14 +81,9 @@ class GeoVisitsStream(ATInternetStream):
     name = "geo_visits"
     path = ""
     replication_key = "date"
-    schema = merge_properties_lists(
-        metrics,
-        properties,
-        # we don't want to use the date in AT Internet API requests, but we still want to (manually) save it in
-        # the records, to allow for a "date" replication key
-        th.PropertiesList(th.Property("date", th.DateType, required=True)),
-    ).to_dict()
-    primary_keys = property_list_to_str(properties)
+    extra_properties = MONTHLY_DATE_PROPERTIES
+    schema = stream_schema
+    primary_keys = stream_primary_keys
 
 
 class PagesVisitsStream(ATInternetStream):
@@ -82,12 +103,9 @@ class PagesVisitsStream(ATInternetStream):
     name = "pages_visits"
     path = ""
     replication_key = "date"
-    schema = merge_properties_lists(
-        metrics,
-        properties,
-        th.PropertiesList(th.Property("date", th.DateType, required=True)),
-    ).to_dict()
-    primary_keys = property_list_to_str(properties)
+    extra_properties = MONTHLY_DATE_PROPERTIES
+    schema = stream_schema
+    primary_keys = stream_primary_keys
 
 
 class SourcesVisitsStream(ATInternetStream):
@@ -107,12 +125,9 @@ class SourcesVisitsStream(ATInternetStream):
     name = "sources_visits"
     path = ""
     replication_key = "date"
-    schema = merge_properties_lists(
-        metrics,
-        properties,
-        th.PropertiesList(th.Property("date", th.DateType, required=True)),
-    ).to_dict()
-    primary_keys = property_list_to_str(properties)
+    extra_properties = MONTHLY_DATE_PROPERTIES
+    schema = stream_schema
+    primary_keys = stream_primary_keys
 
 
 class DevicesVisitsStream(ATInternetStream):
@@ -133,9 +148,6 @@ class DevicesVisitsStream(ATInternetStream):
     name = "devices_visits"
     path = ""
     replication_key = "date"
-    schema = merge_properties_lists(
-        metrics,
-        properties,
-        th.PropertiesList(th.Property("date", th.DateType, required=True)),
-    ).to_dict()
-    primary_keys = property_list_to_str(properties)
+    extra_properties = MONTHLY_DATE_PROPERTIES
+    schema = stream_schema
+    primary_keys = stream_primary_keys
@@ -1,18 +1,45 @@
 """ATInternet tap class."""
 
-from typing import List
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Type, Union, cast
 
+import requests
+from requests.adapters import HTTPAdapter
 from singer_sdk import Tap
 from singer_sdk import typing as th  # JSON schema typing helpers
+from singer_sdk.exceptions import ConfigValidationError
+from singer_sdk.helpers._singer import Catalog
 
-from tap_atinternet.client import ATInternetStream
+from tap_atinternet.cache import ResponseCache
+from tap_atinternet.catalog import load_cached_catalog
+from tap_atinternet.client import API_URL, ATInternetStream
+from tap_atinternet.filters import validate_stream_filters
+from tap_atinternet.metrics import SyncMetrics
 from tap_atinternet.streams import (
+    DevicesVisitsStream,
+    GeoVisitsStream,
+    HourlyVisitsStream,
+    PagesVisitsStream,
+    SourcesVisitsStream,
+)
+from tap_atinternet.throttle import RateLimiter, RequestBudget, RequestBudgetExhausted
+from tap_atinternet.validation import VALIDATION_MODES
+
+if TYPE_CHECKING:
+    # imported when they are used (see the properties below): a discovery or a default sync doesn't need them
+    from tap_atinternet.dedup import DedupIndex, RefreshIndex
+    from tap_atinternet.output import BatchOutput, BufferedOutput
+    from tap_atinternet.transport import AsyncTransport
+
+STREAM_TYPES: List[Type[ATInternetStream]] = [
     HourlyVisitsStream,
     GeoVisitsStream,
     PagesVisitsStream,
     SourcesVisitsStream,
     DevicesVisitsStream,
-)
+]
 
 
 class TapATInternet(Tap):
@@ -33,8 +60,20 @@ class TapATInternet(Tap):
         th.Property(
             "site_id",
             th.IntegerType,
-            required=True,
-            description="Site ID (can be queried at https://dataquery.atinternet-solutions.com/)",
+            description="Site ID (can be queried at https://dataquery.atinternet-solutions.com/). "
+            "Required if 'site_ids' is not set",
+        ),
+        th.Property(
+            "site_ids",
+            th.ArrayType(th.IntegerType),
+            description="Optional. List of site IDs to extract in the same run, instead of a single 'site_id'",
+        ),
+        th.Property(
+            "batch_sites",
+            th.BooleanType,
+            default=False,
+            description="Request all the 'site_ids' at once in each API request, instead of one site at a time "
+            "(the sites then share the same state bookmarks)",
         ),
         th.Property(
             "start_date",
@@ -55,14 +94,592 @@ class TapATInternet(Tap):
             description="Optional. If not empty, filter and extract only the pages with "
             "this string in the 'page_full_name'",
         ),
+        th.Property(
+            "stream_filters",
+            th.ObjectType(),
+            description="Optional. Filters sent with the API requests, per stream name ('*' for all the streams): "
+            "'property' and 'metric' predicates (in the syntax of the API 'filter' parameter), and 'start_date' "
+            "and 'end_date' bounds of the period to request",
+        ),
+        th.Property(
+            "api_url",
+            th.StringType,
+            default=API_URL,
+            description="URL of the AT Internet getData endpoint (e.g. to run the tap against a local mock server)",
+        ),
+        th.Property(
+            "http_engine",
+            th.StringType,
+            default="requests",
+            description="HTTP engine: 'requests' (blocking requests, one thread per request in flight) or 'async' "
+            "(all the requests on a single event loop, requires the 'async' extra)",
+        ),
+        th.Property(
+            "max_concurrent_requests",
+            th.IntegerType,
+            default=10,
+            description="Max number of requests in flight at the same time for all the streams, "
+            "with the 'async' HTTP engine",
+        ),
+        th.Property(
+            "max_workers",
+            th.IntegerType,
+            default=1,
+            description="Number of (year, month) windows fetched concurrently for each stream "
+            "(1 disables concurrent fetching)",
+        ),
+        th.Property(
+            "max_requests_per_second",
+            th.NumberType,
+            default=0,
+            description="Optional. Max number of API requests per second (0 means no limit), "
+            "shared by all the streams and sites",
+        ),
+        th.Property(
+            "max_requests_per_second_per_site",
+            th.NumberType,
+            default=0,
+            description="Optional. Max number of API requests per second for each site (0 means no limit), "
+            "on top of 'max_requests_per_second'",
+        ),
+        th.Property(
+            "rate_limit_burst",
+            th.IntegerType,
+            default=1,
+            description="Number of requests that can be sent at once without waiting for the rate limits "
+            "(the average rate stays under the limits)",
+        ),
+        th.Property(
+            "daily_request_budget",
+            th.IntegerType,
+            default=0,
+            description="Optional. Max number of API requests per day (UTC), over all the runs of the day "
+            "(0 means no limit). Once spent, the sync stops and saves its state, to resume on the next run",
+        ),
+        th.Property(
+            "parallel_streams",
+            th.BooleanType,
+            default=False,
+            description="Sync all the selected streams (and sites) at the same time instead of one after another",
+        ),
+        th.Property(
+            "max_parallel_syncs",
+            th.IntegerType,
+            default=5,
+            description="Max number of (stream, site) pairs synced at the same time with 'parallel_streams'",
+        ),
+        th.Property(
+            "stream_rows",
+            th.BooleanType,
+            default=False,
+            description="Parse the rows incrementally from the HTTP responses instead of loading whole pages "
+            "in memory (requires the 'streaming' extra, ignored if max_workers > 1)",
+        ),
+        th.Property(
+            "columnar_pages",
+            th.BooleanType,
+            default=False,
+            description="Store the decoded rows of each page column by column (typed arrays for the metrics, "
+            "dictionary-encoded strings for the dimensions) and create the records lazily, to reduce memory "
+            "(ignored with 'stream_rows')",
+        ),
+        th.Property(
+            "record_validation",
+            th.StringType,
+            default="off",
+            description="Validate the records against the schema of their stream (with "
+            "a validator compiled once per stream): 'off', 'fast' (required fields, "
+            "integers and numbers) or 'strict' (all the types, and date formats). "
+            "'N/A' metrics are emitted as null (the metrics are nullable in the "
+            "schemas). Invalid records that can't be coerced fail the sync",
+        ),
+        th.Property(
+            "output_mode",
+            th.StringType,
+            default="records",
+            description="'records' (one RECORD message per record, written by the Singer SDK), 'buffered' (same "
+            "messages, serialized faster and written in large chunks) or 'batch' (records written to compressed "
+            "JSONL files, one per stream and month, and BATCH messages pointing to them)",
+        ),
+        th.Property(
+            "batch_dir",
+            th.StringType,
+            default="",
+            description="Directory of the batch files with the 'batch' output mode (a new temporary directory "
+            "if empty)",
+        ),
+        th.Property(
+            "checkpoint_interval",
+            th.IntegerType,
+            default=10,
+            description="Number of pages (or windows, if max_workers > 1) between two STATE messages saving "
+            "the pagination cursor, to resume an interrupted sync where it stopped (0 to disable)",
+        ),
+        th.Property(
+            "incremental_refresh",
+            th.BooleanType,
+            default=False,
+            description="In incremental mode, only emit the records of the open month "
+            "that changed since they were last emitted (compared with digests of the "
+            "records, see 'refresh_index_path'), instead of all of them",
+        ),
+        th.Property(
+            "refresh_index_path",
+            th.StringType,
+            default="",
+            description="Path of the local (SQLite) index of the digests of the "
+            "records of the open month, required by 'incremental_refresh' (the state "
+            "only keeps a reference to them)",
+        ),
+        th.Property(
+            "dedup_index_path",
+            th.StringType,
+            default="",
+            description="Optional. If not empty, path of a local (SQLite) index of the records already emitted: "
+            "records with the same values as the last time their primary key was emitted are dropped (the state "
+            "only keeps a reference to them)",
+        ),
+        th.Property(
+            "collect_metrics",
+            th.BooleanType,
+            default=False,
+            description="Time each phase of the sync (HTTP, decoding, post-processing, validation, output) "
+            "per request and per stream, and log the results as Singer SDK metrics",
+        ),
+        th.Property(
+            "metrics_file",
+            th.StringType,
+            default="",
+            description="Optional. If not empty, write the metrics of the sync to this file at the end of the run, "
+            "in the Prometheus text format if it ends with '.prom', in JSON otherwise (implies 'collect_metrics')",
+        ),
+        th.Property(
+            "cache_dir",
+            th.StringType,
+            default="",
+            description="Optional. If not empty, directory of a local cache of the API responses for closed "
+            "months (the current month always bypasses the cache)",
+        ),
+        th.Property(
+            "cache_ttl_days",
+            th.NumberType,
+            default=30,
+            description="Number of days after which a cached response expires",
+        ),
+        th.Property(
+            "cache_max_size_mb",
+            th.NumberType,
+            default=500,
+            description="Max size of the response cache, the oldest responses are evicted first",
+        ),
     ).to_dict()
 
-    def discover_streams(self) -> List[ATInternetStream]:
-        """Return a list of discovered streams."""
-        return [
-            HourlyVisitsStream(tap=self),
-            GeoVisitsStream(tap=self),
-            PagesVisitsStream(tap=self),
-            SourcesVisitsStream(tap=self),
-            DevicesVisitsStream(tap=self),
+    _rate_limiter: Optional[RateLimiter] = None
+    _site_rate_limiters: Optional[Dict[int, RateLimiter]] = None
+    _request_budget: Optional[RequestBudget] = None
+    _requests_session: Optional[requests.Session] = None
+    _response_cache: Optional[ResponseCache] = None
+    _sync_metrics: Optional[SyncMetrics] = None
+    _async_transport: Optional["AsyncTransport"] = None
+    _dedup_index: Optional["DedupIndex"] = None
+    _refresh_index: Optional["RefreshIndex"] = None
+    _record_output: Optional[Union["BufferedOutput", "BatchOutput"]] = None
+    _catalog: Optional[Catalog] = None
+    # stdout is shared by the whole process, so is the lock serializing the writes of Singer messages
+    output_lock = threading.Lock()
+
+    @property
+    def site_ids(self) -> List[int]:
+        """
+        Return the list of all the sites to extract.
+        """
+        site_ids = self.config.get("site_ids") or [self.config.get("site_id")]
+        if None in site_ids:
+            raise ConfigValidationError("Either 'site_id' or 'site_ids' must be set")
+        return site_ids
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        """
+        Return the rate limiter shared by all the streams, i.e. the global request budget for all the sites.
+        """
+        if self._rate_limiter is None:
+            self._rate_limiter = RateLimiter(
+                self.config.get("max_requests_per_second", 0),
+                burst=self.config.get("rate_limit_burst", 1),
+            )
+        return self._rate_limiter
+
+    @property
+    def site_rate_limiters(self) -> Dict[int, RateLimiter]:
+        """
+        Return the rate limiter of each site, or an empty dict if there is no limit per site.
+        """
+        if self._site_rate_limiters is None:
+            max_per_second = self.config.get("max_requests_per_second_per_site", 0)
+            self._site_rate_limiters = {
+                site_id: RateLimiter(
+                    max_per_second, burst=self.config.get("rate_limit_burst", 1)
+                )
+                for site_id in self.site_ids
+                if max_per_second > 0
+            }
+        return self._site_rate_limiters
+
+    @property
+    def request_budget(self) -> Optional[RequestBudget]:
+        """
+        Return the daily request budget shared by all the streams, or None if there is no budget.
+
+        The requests already sent today are counted in the tap state ("request_budget"), across runs.
+        """
+        if self._request_budget is None and self.config.get("daily_request_budget"):
+            self._request_budget = RequestBudget(
+                self.config["daily_request_budget"],
+                self.state.setdefault("request_budget", {}),
+                lock=self.output_lock,
+            )
+        return self._request_budget
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """
+        Load the stream bookmarks (see `Tap.load_state`), and the requests already sent today.
+        """
+        super().load_state(state)
+        if "request_budget" in state:
+            self.state["request_budget"] = dict(state["request_budget"])
+
+    @property
+    def requests_session(self) -> requests.Session:
+        """
+        Return the HTTP session shared by all the streams.
+
+        The connection pool is sized so that every stream worker can keep its own connection alive.
+        """
+        if self._requests_session is None:
+            pool_size = max(
+                10,
+                self.config.get("max_parallel_syncs", 5)
+                * self.config.get("max_workers", 1),
+            )
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._requests_session = session
+        return self._requests_session
+
+    @property
+    def response_cache(self) -> Optional[ResponseCache]:
+        """
+        Return the local cache of API responses shared by all the streams, or None if it is disabled.
+        """
+        if self._response_cache is None and self.config.get("cache_dir"):
+            self._response_cache = ResponseCache(
+                self.config["cache_dir"],
+                ttl_days=self.config.get("cache_ttl_days", 30),
+                max_size_mb=self.config.get("cache_max_size_mb", 500),
+            )
+        return self._response_cache
+
+    @property
+    def async_transport(self) -> "AsyncTransport":
+        """
+        Return the event loop and HTTP client shared by all the streams with the 'async' HTTP engine.
+        """
+        if self._async_transport is None:
+            from tap_atinternet.transport import AsyncTransport
+
+            self._async_transport = AsyncTransport(
+                self.rate_limiter,
+                budget=self.request_budget,
+                max_connections=self.config.get("max_concurrent_requests", 10),
+                # same timeout as the requests of the 'requests' engine (see `RESTStream.timeout`)
+                timeout=self.atinternet_streams[0].timeout,
+            )
+        return self._async_transport
+
+    @property
+    def dedup_index(self) -> Optional["DedupIndex"]:
+        """
+        Return the index of the records already emitted, shared by all the streams, or None if it is disabled.
+        """
+        if self._dedup_index is None and self.config.get("dedup_index_path"):
+            from tap_atinternet.dedup import DedupIndex
+
+            self._dedup_index = DedupIndex(self.config["dedup_index_path"])
+        return self._dedup_index
+
+    @property
+    def refresh_index(self) -> Optional["RefreshIndex"]:
+        """
+        Return the index of the digests of the records of the open month, shared by all
+        the streams, or None if `incremental_refresh` is disabled.
+        """
+        if self._refresh_index is None and self.config.get("incremental_refresh"):
+            from tap_atinternet.dedup import RefreshIndex
+
+            self._refresh_index = RefreshIndex(self.config["refresh_index_path"])
+        return self._refresh_index
+
+    @property
+    def record_output(self) -> Optional[Union["BufferedOutput", "BatchOutput"]]:
+        """
+        Return the output of the RECORD messages shared by all the streams, or None with the default
+        'records' output mode (see the `output_mode` setting).
+        """
+        if self._record_output is None:
+            from tap_atinternet.output import BatchOutput, BufferedOutput
+
+            output_mode = self.config.get("output_mode", "records")
+            if output_mode == "buffered":
+                self._record_output = BufferedOutput()
+            elif output_mode == "batch":
+                batch_dir = self.config.get("batch_dir") or tempfile.mkdtemp(
+                    prefix="tap-atinternet-"
+                )
+                self.logger.info(f"Batch files written to {batch_dir}")
+                self._record_output = BatchOutput(batch_dir, BufferedOutput())
+            elif output_mode != "records":
+                raise ConfigValidationError(f"Unknown output_mode '{output_mode}'")
+        return self._record_output
+
+    @property
+    def atinternet_streams(self) -> List[ATInternetStream]:
+        """
+        Return the streams of the tap (see `streams`), typed: they are all ATInternet streams (see `discover_streams`).
+        """
+        return cast(List[ATInternetStream], list(self.streams.values()))
+
+    @property
+    def sync_metrics(self) -> Optional[SyncMetrics]:
+        """
+        Return the performance metrics of the sync, or None if instrumentation is disabled.
+        """
+        if self._sync_metrics is None and (
+            self.config.get("collect_metrics") or self.config.get("metrics_file")
+        ):
+            self._sync_metrics = SyncMetrics()
+        return self._sync_metrics
+
+    def sync_all(self) -> None:  # type: ignore[misc]  # final in the SDK, see below
+        """
+        Sync all the selected streams, either one after another (default) or in parallel.
+
+        `Tap.sync_all` is final in the SDK, but it is the entry point of the sync (the CLI calls it): it is
+        overridden to create the resources shared by the streams before it and to release them after it, and
+        reimplemented in parallel mode (see `_sync_all_in_parallel`).
+        """
+        self._validate_sync_config()
+        self._create_shared_resources()
+        try:
+            if not self.config.get("parallel_streams"):
+                super().sync_all()
+            else:
+                self._sync_all_in_parallel()
+        except RequestBudgetExhausted as e:
+            # the pagination cursors are in the state: the next run resumes where this one stopped
+            self.logger.warning(f"{e}, stopping the sync")
+            next(iter(self.streams.values()))._write_state_message()
+        finally:
+            self._release_shared_resources()
+        self._log_sync_report()
+
+    def _validate_sync_config(self) -> None:
+        """
+        Check the settings that the config JSON schema can't check on its own.
+        """
+        validate_stream_filters(
+            self.config.get("stream_filters") or {},
+            [stream_type.name for stream_type in STREAM_TYPES],
+        )
+        record_validation = self.config.get("record_validation", "off")
+        if record_validation not in VALIDATION_MODES:
+            raise ConfigValidationError(
+                f"Unknown record_validation mode '{record_validation}'"
+            )
+        if self.config.get("incremental_refresh"):
+            refresh_index_path = self.config.get("refresh_index_path")
+            if not refresh_index_path:
+                raise ConfigValidationError(
+                    "'incremental_refresh' requires a 'refresh_index_path'"
+                )
+            if refresh_index_path == self.config.get("dedup_index_path"):
+                raise ConfigValidationError(
+                    "'refresh_index_path' and 'dedup_index_path' must be different "
+                    "files"
+                )
+
+    def _create_shared_resources(self) -> None:
+        """
+        Create the resources shared by the streams before starting any thread, so that they are created only once.
+        """
+        _ = self.site_ids, self.rate_limiter, self.requests_session, self.response_cache
+        _ = self.site_rate_limiters, self.request_budget
+        _ = self.dedup_index, self.refresh_index, self.record_output
+        for stream in self.atinternet_streams:
+            stream.sync_metrics = self.sync_metrics
+            # resolved once per sync, instead of once per record
+            stream.record_output = self.record_output
+        if self.config.get("http_engine") == "async" and self.streams:
+            _ = self.async_transport
+
+    def _release_shared_resources(self) -> None:
+        """
+        Flush the buffered records, and close the async transport and the indexes, even if the sync failed.
+        """
+        if self.record_output is not None:
+            with self.output_lock:
+                self.record_output.flush()
+        if self._async_transport is not None:
+            self.logger.info(
+                f"Async HTTP engine: {self._async_transport.retries} requests retried"
+            )
+            self._async_transport.close()
+            self._async_transport = None
+        if self._dedup_index is not None:
+            # the records emitted after the last STATE message are not considered loaded
+            self._log_dedup_report(self._dedup_index)
+            self._dedup_index.close()
+            self._dedup_index = None
+        if self._refresh_index is not None:
+            # the digests stored after the last STATE message are dropped too
+            self._refresh_index.close()
+            self._refresh_index = None
+
+    def _log_sync_report(self) -> None:
+        """
+        Log the response cache hits, the rate limits and the metrics of the sync.
+        """
+        if self.response_cache is not None:
+            self.logger.info(
+                f"Response cache: {self.response_cache.hits} hits, "
+                f"{self.response_cache.misses} misses"
+            )
+        self._log_rate_limits()
+        if self.sync_metrics is not None:
+            self._report_metrics(self.sync_metrics)
+
+    def _log_dedup_report(self, dedup_index: "DedupIndex") -> None:
+        """
+        Log the number of records emitted and suppressed by the dedup index, per stream.
+        """
+        for stream_name, counts in dedup_index.report().items():
+            total = counts["emitted"] + counts["suppressed"]
+            self.logger.info(
+                f"Dedup index: stream '{stream_name}', {counts['emitted']} records emitted, "
+                f"{counts['suppressed']} unchanged records suppressed (out of {total})"
+            )
+
+    def _log_rate_limits(self) -> None:
+        """
+        Log the time spent waiting for the rate limiters, and the requests left in the daily budget.
+        """
+        if self.rate_limiter.waited:
+            self.logger.info(
+                f"Rate limiter: {self.rate_limiter.waited:.1f}s spent waiting"
+            )
+        for site_id, limiter in self.site_rate_limiters.items():
+            if limiter.waited:
+                self.logger.info(
+                    f"Rate limiter of site {site_id}: {limiter.waited:.1f}s spent waiting"
+                )
+        if self.request_budget is not None:
+            self.logger.info(
+                f"Daily request budget: {self.request_budget.remaining} requests left"
+            )
+
+    def _report_metrics(self, sync_metrics: SyncMetrics) -> None:
+        """
+        Log the metrics of each stream, and write them all to the `metrics_file`, if any.
+        """
+        for stream in self.streams.values():
+            for metric in sync_metrics.stream_metrics(stream.name):
+                stream._write_metric_log(metric, extra_tags=None)
+        if self.config.get("metrics_file"):
+            sync_metrics.write(self.config["metrics_file"])
+            self.logger.info(f"Metrics written to {self.config['metrics_file']}")
+
+    def _sync_all_in_parallel(self) -> None:
+        """
+        Sync the selected streams in parallel.
+
+        This reimplements `Tap.sync_all` of the SDK (0.4.4), which syncs the streams one after another: the same
+        preparation steps, then the streams (or their partitions) are synced in a thread pool, and the progress
+        markers of each stream are finalized once all of them are done. Child streams are not supported (the tap
+        has none).
+        """
+        self._reset_state_progress_markers()
+        self._set_compatible_replication_methods()
+        streams = [stream for stream in self.atinternet_streams if stream.selected]
+        # the streams without partitions are synced without context
+        no_partitions: List[Optional[dict]] = [None]
+        jobs = [
+            (stream, context)
+            for stream in streams
+            for context in stream.partitions or no_partitions
         ]
+        for stream, context in jobs:
+            # create the bookmarks of every stream/partition before starting the threads, so that the shared
+            # state dict does not change size while another stream is writing it to stdout
+            _ = stream.get_context_state(context)
+
+        max_parallel_syncs = self.config.get("max_parallel_syncs", 5)
+        with ThreadPoolExecutor(max_workers=max_parallel_syncs) as executor:
+            futures = [
+                executor.submit(stream.sync, context) for stream, context in jobs
+            ]
+            for future in futures:
+                # re-raise the first exception of each stream, if any
+                future.result()
+
+        for stream in streams:
+            stream.finalize_state_progress_markers()
+            stream._write_state_message()
+
+    def discover_streams(self) -> List[ATInternetStream]:
+        """
+        Return a list of discovered streams.
+
+        With an input catalog, only the streams selected in the catalog are instantiated (and the streams missing
+        from it, which are selected by default): a sync of one stream doesn't build the others.
+        """
+        selected_types = STREAM_TYPES
+        if self.input_catalog:
+            selected_types = [
+                stream_type
+                for stream_type in STREAM_TYPES
+                if stream_type.name not in self.input_catalog
+                or self.input_catalog[stream_type.name]
+                .metadata.resolve_selection()
+                .get((), True)
+            ]
+        return [stream_type(tap=self) for stream_type in selected_types]
+
+    def build_catalog(self) -> Catalog:
+        """Return the catalog of all the streams, built from their classes (see `_singer_catalog`)."""
+        return super()._singer_catalog
+
+    @property
+    def _singer_catalog(self) -> Catalog:
+        """
+        Return the catalog of the tap (the output of `--discover`).
+
+        The catalog shipped with the package (`catalog.json`) is returned when it is up to date, without
+        instantiating any stream; otherwise, it is built from the streams.
+        """
+        if self._catalog is None:
+            # no 'site_id' and no nullable metrics in the precomputed catalog (see
+            # ATInternetStream.site_column and ATInternetStream.nullable_metrics)
+            cached = (
+                load_cached_catalog(tuple(STREAM_TYPES))
+                if not self.config.get("site_ids")
+                and self.config.get("record_validation", "off") == "off"
+                else None
+            )
+            self._catalog = (
+                Catalog.from_dict(cached)
+                if cached is not None
+                else self.build_catalog()
+            )
+        return self._catalog
@@ -0,0 +1,288 @@
+"""Offline benchmark of full tap syncs, against a local mock of the AT Internet API (see `mock_api.py`).
+
+Each stream is synced on its own, once per `max_results` value, in a fresh interpreter (so that peak memory
+measures are independent), and the harness reports its sync time, requests/s, rows/s and peak RSS:
+    python -m tap_atinternet.tests.benchmark --max-results 1000 5000 10000 --rows-per-day 200
+
+Run it before and after a change (with the same options) to compare the performance of two versions, or compare
+the output modes of the tap (see the `output_mode` setting) with:
+    python -m tap_atinternet.tests.benchmark --streams pages_visits --output-modes records buffered batch
+and the size of the API responses when some metrics are not selected in the catalog (compared to a sync of all
+the metrics) with:
+    python -m tap_atinternet.tests.benchmark --deselect m_bounces m_time_spent_per_visits
+The Singer messages are counted, then discarded: the measures do not include the cost of a target.
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence
+
+from tap_atinternet.output import batch_file_path, read_batch_file
+from tap_atinternet.tests.helpers import make_catalog
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+
+STREAMS = [
+    "hourly_visits",
+    "geo_visits",
+    "pages_visits",
+    "sources_visits",
+    "devices_visits",
+]
+OUTPUT_MODES = ["records", "buffered", "batch"]
+
+
+class BenchmarkResult(NamedTuple):
+    """The measures of the sync of a stream, for a `max_results` value."""
+
+    stream: str
+    max_results: int
+    requests: int
+    records: int
+    sync_time: float
+    peak_rss_mb: float
+    payload_mb: float = 0.0
+
+    @property
+    def requests_per_second(self) -> float:
+        """Return the number of requests per second of the sync."""
+        return self.requests / self.sync_time
+
+    @property
+    def rows_per_second(self) -> float:
+        """Return the number of records per second of the sync."""
+        return self.records / self.sync_time
+
+
+class _CountingOutput:
+    """File-like sink counting the Singer RECORD messages written to stdout.
+
+    The batch files of the BATCH messages are collected as well.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.batch_files: List[str] = []
+
+    def write(self, text: str) -> int:
+        # messages written by the Singer SDK, or by the tap 'buffered' output (compact JSON)
+        self.records += text.count('{"type": "RECORD"') + text.count('{"type":"RECORD"')
+        if '{"type":"BATCH"' in text:
+            for line in text.splitlines():
+                if line.startswith('{"type":"BATCH"'):
+                    self.batch_files += json.loads(line)["manifest"]
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def sync_stream(config: dict, stream_name: str, deselected: Sequence[str] = ()) -> dict:
+    """Sync a single stream in the current process, and return its record count, sync time and peak RSS."""
+    import resource
+
+    from tap_atinternet.tap import TapATInternet
+
+    tap = TapATInternet(
+        config=config, catalog=make_catalog(config, [stream_name], deselected)
+    )
+
+    output = _CountingOutput()
+    stdout, sys.stdout = sys.stdout, output
+    start = time.perf_counter()
+    try:
+        tap.sync_all()
+    finally:
+        sys.stdout = stdout
+    sync_time = time.perf_counter() - start
+    # the records of the batch files are counted after the sync, as a target would read them
+    for uri in output.batch_files:
+        output.records += len(read_batch_file(uri))
+        os.remove(batch_file_path(uri))
+    # ru_maxrss is in kB on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "records": output.records,
+        "sync_time": sync_time,
+        "peak_rss_mb": peak_rss_mb,
+    }
+
+
+def run_benchmark(
+    api: MockATInternetAPI,
+    max_results: List[int],
+    start_date: str,
+    streams: Optional[List[str]] = None,
+    config: Optional[dict] = None,
+    deselected: Sequence[str] = (),
+) -> List[BenchmarkResult]:
+    """Sync each stream once per `max_results` value against the (started) mock `api`, each in a fresh interpreter.
+
+    `config` holds any other tap setting to benchmark (e.g. max_workers, stream_rows), and `deselected` the
+    properties not selected in the catalog.
+    """
+    results = []
+    for stream_name in streams or STREAMS:
+        for page_size in max_results:
+            tap_config = dict(
+                config or {},
+                api_key="mock",
+                secret_key="mock",
+                site_id=1,
+                start_date=start_date,
+                max_results=page_size,
+                api_url=api.url,
+            )
+            requests_before, bytes_before = api.requests, api.bytes_sent
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "tap_atinternet.tests.benchmark",
+                    "--sync-stream",
+                    stream_name,
+                    "--config",
+                    json.dumps(tap_config),
+                    "--deselect",
+                    *deselected,
+                ],
+                cwd=Path(__file__).parents[2],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            measures = json.loads(output.splitlines()[-1])
+            results.append(
+                BenchmarkResult(
+                    stream=stream_name,
+                    max_results=page_size,
+                    requests=api.requests - requests_before,
+                    payload_mb=(api.bytes_sent - bytes_before) / 1024 / 1024,
+                    **measures,
+                )
+            )
+    return results
+
+
+def format_results(results: List[BenchmarkResult]) -> str:
+    """Format the `results` as a table."""
+    lines = [
+        f"{'stream':<16}{'max_results':>12}{'requests':>10}{'records':>10}{'time (s)':>10}"
+        f"{'requests/s':>12}{'rows/s':>10}{'peak RSS (MB)':>15}{'payload (MB)':>14}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result.stream:<16}{result.max_results:>12}{result.requests:>10}{result.records:>10}"
+            f"{result.sync_time:>10.2f}{result.requests_per_second:>12.1f}{result.rows_per_second:>10.0f}"
+            f"{result.peak_rss_mb:>15.1f}{result.payload_mb:>14.1f}"
+        )
+    return "\n".join(lines)
+
+
+def format_comparison(
+    full: List[BenchmarkResult], deselected: List[BenchmarkResult]
+) -> str:
+    """Compare the syncs of all the properties (`full`) to the same syncs with deselected properties."""
+    lines = [
+        f"{'stream':<16}{'max_results':>12}{'full (MB)':>11}{'deselected (MB)':>17}{'saved':>8}"
+        f"{'full (s)':>10}{'deselected (s)':>16}"
+    ]
+    for full_result, result in zip(full, deselected):
+        saved = 1 - result.payload_mb / full_result.payload_mb
+        lines.append(
+            f"{result.stream:<16}{result.max_results:>12}{full_result.payload_mb:>11.2f}"
+            f"{result.payload_mb:>17.2f}{saved:>8.0%}{full_result.sync_time:>10.2f}{result.sync_time:>16.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    """Run the benchmark with the command line `args`, and print its results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--max-results", type=int, nargs="+", default=[1000, 5000, 10000]
+    )
+    parser.add_argument("--streams", nargs="+", default=STREAMS, choices=STREAMS)
+    parser.add_argument(
+        "--start-date",
+        default=(datetime.date.today() - datetime.timedelta(days=365)).isoformat(),
+    )
+    parser.add_argument("--rows-per-day", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="latency of the mock API, in seconds"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="fraction of requests failing once",
+    )
+    parser.add_argument(
+        "--tap-config",
+        default="{}",
+        help="other tap settings to benchmark, as a JSON object",
+    )
+    parser.add_argument(
+        "--output-modes",
+        nargs="+",
+        choices=OUTPUT_MODES,
+        help="benchmark each of these output modes (see the `output_mode` setting)",
+    )
+    parser.add_argument(
+        "--deselect",
+        nargs="*",
+        default=[],
+        help="properties (e.g. metrics) not to select in the catalog",
+    )
+    # internal: sync a single stream in this process, see `run_benchmark`
+    parser.add_argument("--sync-stream", help=argparse.SUPPRESS)
+    parser.add_argument("--config", help=argparse.SUPPRESS)
+    options = parser.parse_args(args)
+
+    if options.sync_stream:
+        print(
+            json.dumps(
+                sync_stream(
+                    json.loads(options.config), options.sync_stream, options.deselect
+                )
+            )
+        )
+        return
+
+    with MockATInternetAPI(
+        rows_per_day=options.rows_per_day,
+        latency=options.latency,
+        error_rate=options.error_rate,
+    ) as api:
+        for output_mode in options.output_modes or [None]:
+            config = json.loads(options.tap_config)
+            if output_mode is not None:
+                config["output_mode"] = output_mode
+                print(f"output_mode: {output_mode}")
+            results = run_benchmark(
+                api,
+                max_results=options.max_results,
+                streams=options.streams,
+                start_date=options.start_date,
+                config=config,
+                deselected=options.deselect,
+            )
+            print(format_results(results))
+            if options.deselect:
+                full_results = run_benchmark(
+                    api,
+                    max_results=options.max_results,
+                    streams=options.streams,
+                    start_date=options.start_date,
+                    config=config,
+                )
+                print("compared to a sync of all the properties:")
+                print(format_comparison(full_results, results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Helpers shared by the tests: catalogs, syncs against the mock API, and their messages."""
+import contextlib
+import datetime
+import io
+import json
+from typing import List, Optional, Sequence
+
+import pytest
+from singer_sdk.exceptions import FatalAPIError
+
+from tap_atinternet.output import read_batch_file
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+
+
+def make_catalog(
+    config: dict, stream_names: List[str], deselected: Sequence[str] = ()
+) -> dict:
+    """Return the tap catalog, with only the `stream_names` streams selected, without their `deselected` properties."""
+    from tap_atinternet.tap import TapATInternet
+
+    catalog = TapATInternet(config=config).catalog_dict
+    for stream in catalog["streams"]:
+        for metadata in stream["metadata"]:
+            if metadata["breadcrumb"] == []:
+                metadata["metadata"]["selected"] = (
+                    stream["tap_stream_id"] in stream_names
+                )
+            elif metadata["breadcrumb"][-1] in deselected:
+                metadata["metadata"]["selected"] = False
+    return catalog
+
+
+def sync(
+    api: MockATInternetAPI,
+    config: dict,
+    state: Optional[dict] = None,
+    streams: tuple = ("hourly_visits",),
+    deselected: Sequence[str] = (),
+    interrupted: bool = False,
+) -> List[dict]:
+    """Run a sync of some streams (default: 'hourly_visits'), return its messages.
+
+    With `interrupted`, the sync must fail with a fatal API error (see the `fail_after` option of the mock API),
+    and the messages written before the error are returned.
+    """
+    from tap_atinternet.tap import TapATInternet
+
+    config = {
+        "api_key": "mock",
+        "secret_key": "mock",
+        "site_id": 1,
+        "start_date": (
+            datetime.date.today() - datetime.timedelta(days=120)
+        ).isoformat(),
+        "max_results": 7,
+        **config,
+        "api_url": api.url,
+    }
+    tap = TapATInternet(
+        config=config,
+        catalog=make_catalog(config, list(streams), deselected),
+        state=state,
+    )
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        if interrupted:
+            with pytest.raises(FatalAPIError):
+                tap.sync_all()
+        else:
+            tap.sync_all()
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def records_of(messages: List[dict], stream: Optional[str] = None) -> List[dict]:
+    """Return the records of the RECORD messages and of the batch files, in order.
+
+    Only the records of `stream` are returned, if given.
+    """
+    records = []
+    for message in messages:
+        if stream is not None and message.get("stream") != stream:
+            continue
+        if message["type"] == "RECORD":
+            records.append(message["record"])
+        elif message["type"] == "BATCH":
+            for uri in message["manifest"]:
+                records += read_batch_file(uri)
+    return records
+
+
+def other_messages(messages: List[dict]) -> List[dict]:
+    """Return the messages other than records (SCHEMA and STATE messages)."""
+    return [m for m in messages if m["type"] not in ("RECORD", "BATCH")]
+
+
+def committed(messages: List[dict]):
+    """Return the records before the last STATE message (what a target has saved), and that state."""
+    last_state = max(i for i, m in enumerate(messages) if m["type"] == "STATE")
+    records = [m["record"] for m in messages[:last_state] if m["type"] == "RECORD"]
+    return records, messages[last_state]["value"]
+
+
+def row_keys(records: List[dict]) -> list:
+    """Return the primary keys of 'hourly_visits' records."""
+    return [(r["date"], r["visit_hour"], r["site_level2"]) for r in records]
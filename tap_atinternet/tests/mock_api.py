@@ -0,0 +1,224 @@
+"""Local stand-in for the AT Internet `getData` endpoint, serving deterministic synthetic data.
+
+Point the tap to it with the `api_url` setting, e.g.:
+    with MockATInternetAPI(rows_per_day=100) as api:
+        tap = TapATInternet(config={..., "api_url": api.url})
+"""
+import datetime
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from tap_atinternet.planner import API_MAX_ROWS
+from tap_atinternet.utils import get_page_size, get_start_end_days
+
+MONTHS = [
+    "January",
+    "February",
+    "March",
+    "April",
+    "May",
+    "June",
+    "July",
+    "August",
+    "September",
+    "October",
+    "November",
+    "December",
+]
+
+
+class MockATInternetAPI:
+    """HTTP server answering `getData` requests with synthetic `DataFeed.Rows`.
+
+    For each request, the server generates `rows_per_day` rows per day of the requested period (capped to the
+    API limit of 200000 rows, or `max_rows`), with a value for each requested column, sorted by decreasing 'm_visits' and
+    paginated with the 'max-results' and 'page-num' parameters. The same request always gets the same rows.
+    Rows come in pairs with the same 'm_visits': like the API, the order of these ties is only the same from one
+    request to the next if the requested sort order includes all the properties (the order of each pair is
+    swapped on every other request otherwise).
+        - `latency` (in seconds) is added to every response
+        - `error_rate` is the fraction of requests failing with a 500 error on their first attempt (the requests
+        failing are picked from a hash of their body, so they are the same from one run to the next)
+        - `fail_after`: if set, all the requests after the first `fail_after` ones fail with a (fatal) 400 error,
+        e.g. to interrupt a sync
+        - `sentinels`: values returned instead of the generated ones in every other row, e.g. {"m_visits": "N/A"}
+        (like the API, for undefined metrics or properties)
+
+    The server counts the requests it receives (`requests`, `errors`), the rows it sends (`rows`) and the size of
+    its successful responses (`bytes_sent`), and keeps the body of the last request (`last_payload`).
+    """
+
+    def __init__(
+        self,
+        rows_per_day: int = 100,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        fail_after: Optional[int] = None,
+        sentinels: Optional[Dict[str, str]] = None,
+        max_rows: int = API_MAX_ROWS,
+    ):
+        """Create the server (see the options above), started with `start` or as a context manager."""
+        self.rows_per_day = rows_per_day
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fail_after = fail_after
+        self.sentinels = sentinels or {}
+        self.max_rows = max_rows
+        self.requests = 0
+        self.errors = 0
+        self.rows = 0
+        self.bytes_sent = 0
+        self.last_payload: Optional[dict] = None
+        self._attempts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Return the URL of the `getData` endpoint of the started server."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v3/data/getData"
+
+    def start(self) -> "MockATInternetAPI":
+        """Start serving the requests in a background thread."""
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                status, content = api.handle(body)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the server."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "MockATInternetAPI":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def is_failing(self, body: bytes) -> bool:
+        """Return True if this attempt of the request must fail, with a probability of `error_rate`."""
+        with self._lock:
+            self.requests += 1
+            self._attempts[body] += 1
+            attempt = self._attempts[body]
+        if attempt > 1 or not self.error_rate:
+            return False
+        digest = hashlib.sha256(body).digest()
+        return int.from_bytes(digest[:4], "big") / 2**32 < self.error_rate
+
+    def handle(self, body: bytes):
+        """Return the status code and body of the response to a `getData` request body."""
+        if self.latency:
+            time.sleep(self.latency)
+        if self.is_failing(body):
+            with self._lock:
+                self.errors += 1
+            return 500, b'{"ErrorMessage": "Mock server error"}'
+        if self.fail_after is not None and self.requests > self.fail_after:
+            return 400, b'{"ErrorMessage": "Mock sync interruption"}'
+
+        payload = self.last_payload = json.loads(body)
+        period = payload["period"]["p1"][0]
+        start = datetime.date.fromisoformat(period["start"])
+        end = datetime.date.fromisoformat(period["end"])
+        total = self.total_rows(start, end)
+        # like the API, pages are capped to 10000 rows
+        page_size = get_page_size(payload["max-results"])
+        first = (payload["page-num"] - 1) * page_size
+        sort = {column.lstrip("-") for column in payload["sort"]}
+        properties = {
+            column for column in payload["columns"] if not column.startswith("m_")
+        }
+        swap_ties = not properties <= sort and self.requests % 2
+        rows = [
+            self.make_row(
+                # swap the rows of each pair of ties (2k, 2k+1)
+                i ^ 1 if swap_ties and i ^ 1 < total else i,
+                total,
+                start,
+                payload["columns"],
+                payload["space"]["s"],
+            )
+            for i in range(first, min(first + page_size, total))
+        ]
+        with self._lock:
+            self.rows += len(rows)
+        data_feed = {
+            "Columns": [{"Name": column} for column in payload["columns"]],
+            "Rows": rows,
+        }
+        content = json.dumps({"DataFeed": data_feed}).encode()
+        with self._lock:
+            self.bytes_sent += len(content)
+        return 200, content
+
+    def total_rows(self, start: datetime.date, end: datetime.date) -> int:
+        """Return the number of rows of a request on the period from `start` to `end` (all pages included)."""
+        return min(self.rows_per_day * ((end - start).days + 1), self.max_rows)
+
+    def expected_rows(self, start: datetime.date, end: datetime.date) -> int:
+        """Return the number of rows the tap should extract from `start` to `end`, when requesting calendar months."""
+        n_rows = 0
+        while start <= end:
+            _, month_end = get_start_end_days(
+                start.year, start.month, min_start_date=start
+            )
+            month_end = min(month_end, end)
+            n_rows += self.total_rows(start, month_end)
+            start = month_end + datetime.timedelta(days=1)
+        return n_rows
+
+    def make_row(
+        self,
+        i: int,
+        total: int,
+        start: datetime.date,
+        columns: List[str],
+        site_ids: List[int],
+    ) -> dict:
+        """Return the i-th row (out of `total`) of a request starting on `start`."""
+        day = start + datetime.timedelta(days=i // self.rows_per_day)
+        values = {
+            # ties: the rows 2k and 2k+1 have the same visits
+            "m_visits": total - i // 2,
+            "m_unique_visitors": total - i,
+            "m_bounces": i % 7,
+            "m_time_spent_per_visits": round(10 + i % 50 / 3, 2),
+            "date": day.isoformat(),
+            "date_year": day.year,
+            "date_month": MONTHS[day.month - 1],
+            "visit_hour": i % 24,
+            "site_id": site_ids[i % len(site_ids)],
+        }
+        if i % 2:
+            values.update(self.sentinels)
+        return {
+            column: values[column] if column in values else f"{column}_{i}"
+            for column in columns
+        }
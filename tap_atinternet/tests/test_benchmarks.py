@@ -0,0 +1,323 @@
+"""
+Benchmarks of the performance-sensitive code paths, on synthetic AT Internet pages.
+
+Each benchmark prints its measures (run `pytest -s` to see them) and checks that the optimized path
+is actually better than the default one. Full syncs are benchmarked against a local mock of the API
+(see `benchmark.py`).
+
+The timing and memory measures depend on the machine and its load: these benchmarks are skipped
+unless the `TAP_ATINTERNET_BENCHMARKS` environment variable is set.
+"""
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import requests
+from urllib3 import HTTPResponse
+
+from tap_atinternet.response import read_data_feed, stream_data_feed_rows
+from tap_atinternet.streams import PagesVisitsStream
+from tap_atinternet.tests.benchmark import (
+    format_comparison,
+    format_results,
+    run_benchmark,
+)
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+from tap_atinternet.transform import build_row_transformer
+from tap_atinternet.utils import month_str_to_int, property_list_to_str
+from tap_atinternet.validation import build_record_validator
+
+benchmark = pytest.mark.skipif(
+    not os.environ.get("TAP_ATINTERNET_BENCHMARKS"),
+    reason="set TAP_ATINTERNET_BENCHMARKS=1 to run the benchmarks",
+)
+
+
+def make_page_body(n_rows: int) -> bytes:
+    """Return a synthetic getData response body with `n_rows` rows of the 'pages_visits' stream."""
+    rows = [
+        {
+            "m_visits": n_rows - i,
+            "m_unique_visitors": n_rows - i,
+            "m_bounces": i % 7,
+            "m_time_spent_per_visits": 12.5,
+            "date_year": 2022,
+            "date_month": "May",
+            "page": f"page_{i}",
+            "page_full_name": f"section::subsection::page_{i}",
+            "site_level2": "Main site",
+        }
+        for i in range(n_rows)
+    ]
+    return json.dumps({"DataFeed": {"Columns": [], "Rows": rows}}).encode()
+
+
+def make_streamed_response(body_file: Path) -> requests.Response:
+    """Return a response whose body is read lazily, like with `requests.Session.send(..., stream=True)`."""
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = HTTPResponse(body=open(body_file, "rb"), preload_content=False)
+    return response
+
+
+def consume_page(mode: str, body_file: Path) -> int:
+    """Iterate over all the rows of a page (without keeping them), and return the peak RSS in kB."""
+    import resource
+
+    if mode != "baseline":
+        response = make_streamed_response(body_file)
+        if mode == "streaming":
+            rows = stream_data_feed_rows(response)
+        else:
+            rows = read_data_feed(response).rows
+        for _ in rows:
+            pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peak_rss_kb(mode: str, body_file: Path) -> int:
+    """Run `consume_page` in a fresh interpreter, so that peak RSS measures are independent."""
+    output = subprocess.run(
+        [sys.executable, "-m", "tap_atinternet.tests.test_benchmarks", mode, body_file],
+        cwd=Path(__file__).parents[2],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return int(output)
+
+
+@benchmark
+def test_streaming_peak_rss(tmp_path):
+    pytest.importorskip("ijson")
+    pytest.importorskip("resource")
+    # max_results is capped to 10000 by the API, but a bigger page gives a clearer signal
+    n_rows = 50000
+    body_file = tmp_path / "page.json"
+    body_file.write_bytes(make_page_body(n_rows))
+
+    baseline = peak_rss_kb("baseline", body_file)
+    buffered = peak_rss_kb("buffered", body_file) - baseline
+    streaming = peak_rss_kb("streaming", body_file) - baseline
+    print(
+        f"\nPeak RSS for a {n_rows} rows page: "
+        f"buffered +{buffered} kB, streaming +{streaming} kB"
+    )
+    # the page takes about 17 MB once decoded: streaming saves most of it, not just some noise
+    assert streaming < buffered / 2
+
+
+def generic_post_process(row: dict) -> dict:
+    """The per-row checks of ATInternetStream.post_process, before row transformers were compiled per stream."""
+    if "visit_hour" in row and row["visit_hour"] == "N/A":
+        row["visit_hour"] = -1
+    if "date" not in row:
+        year = row["date_year"]
+        month = month_str_to_int[row["date_month"]]
+        row["date"] = datetime.datetime.strftime(
+            datetime.date(year, month, 1), "%Y-%m-%d"
+        )
+    return row
+
+
+def rows_per_second(transform, pages) -> float:
+    start = time.perf_counter()
+    n_rows = 0
+    for rows in pages:
+        for row in rows:
+            transform(row)
+        n_rows += len(rows)
+    return n_rows / (time.perf_counter() - start)
+
+
+@benchmark
+def test_row_transformer_throughput():
+    # decode fresh rows for each run, since transformers modify the rows in place
+    body = make_page_body(10000)
+    transform = build_row_transformer(
+        PagesVisitsStream.schema,
+        property_list_to_str(PagesVisitsStream.metrics)
+        + property_list_to_str(PagesVisitsStream.properties),
+    )
+    generic = rows_per_second(
+        generic_post_process, [json.loads(body)["DataFeed"]["Rows"] for _ in range(5)]
+    )
+    compiled = rows_per_second(
+        transform, [json.loads(body)["DataFeed"]["Rows"] for _ in range(5)]
+    )
+    print(
+        f"\npost_process throughput: generic {generic:.0f} rows/s, "
+        f"compiled {compiled:.0f} rows/s (x{compiled / generic:.1f})"
+    )
+    assert compiled > generic
+
+
+@benchmark
+def test_record_validation_throughput():
+    jsonschema = pytest.importorskip("jsonschema")
+    stream = PagesVisitsStream
+    rows = json.loads(make_page_body(10000))["DataFeed"]["Rows"]
+    transform = build_row_transformer(
+        stream.schema,
+        property_list_to_str(stream.metrics) + property_list_to_str(stream.properties),
+    )
+    records = [dict(transform(row), site_id=1) for row in rows]
+    # compiled once, like our validators
+    generic_validator = jsonschema.validators.validator_for(stream.schema)(
+        stream.schema
+    )
+    generic = rows_per_second(generic_validator.validate, [records])
+    throughputs = {}
+    for mode in ("fast", "strict"):
+        validator = build_record_validator(
+            mode,
+            stream.name,
+            stream.schema,
+            list(stream.schema["properties"]),
+            metrics=property_list_to_str(stream.metrics),
+        )
+        throughputs[mode] = rows_per_second(validator.validate, [records])
+    print(
+        f"\nrecord validation throughput: jsonschema {generic:.0f} rows/s, "
+        + ", ".join(
+            f"{mode} {value:.0f} rows/s (x{value / generic:.1f})"
+            for mode, value in throughputs.items()
+        )
+    )
+    assert throughputs["strict"] > generic
+    assert throughputs["fast"] > throughputs["strict"]
+
+
+# optional dependencies (and their modules) only needed by some settings, not imported with the tap
+DEFERRED_MODULES = ["httpx", "ijson", "sqlite3", "tap_atinternet.transport"]
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import tap_atinternet.tap
+print(json.dumps({{
+    "import_ms": (time.perf_counter() - start) * 1000,
+    "loaded": [name for name in {DEFERRED_MODULES!r} if name in sys.modules],
+}}))
+"""
+# `--discover`, from the cached catalog (default) or building the catalog from the streams
+DISCOVER_SCRIPT = """
+import sys
+import tap_atinternet.tap
+if sys.argv.pop() == "built":
+    tap_atinternet.tap.load_cached_catalog = lambda *args: None
+tap_atinternet.tap.TapATInternet.cli()
+"""
+
+
+@benchmark
+def test_import_and_cold_start_time(tmp_path):
+    imports = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", IMPORT_SCRIPT],
+                check=True,
+                capture_output=True,
+            ).stdout
+        )
+        for _ in range(3)
+    ]
+    assert all(not measure["loaded"] for measure in imports)
+    config_path = tmp_path / "config.json"
+    config_path.write_text(
+        json.dumps({"api_key": "k", "secret_key": "s", "site_id": 1})
+    )
+    discover_times = {}
+    catalogs = {}
+    for mode in ("cached", "built"):
+        start = time.perf_counter()
+        for _ in range(3):
+            output = subprocess.run(
+                [sys.executable, "-c", DISCOVER_SCRIPT]
+                + ["--config", str(config_path), "--discover", mode],
+                check=True,
+                capture_output=True,
+            ).stdout
+        discover_times[mode] = (time.perf_counter() - start) / 3 * 1000
+        catalogs[mode] = json.loads(output)
+    print(
+        f"\nimport tap_atinternet.tap: {min(m['import_ms'] for m in imports):.0f} ms, "
+        + ", ".join(
+            f"cold --discover ({mode} catalog): {value:.0f} ms"
+            for mode, value in discover_times.items()
+        )
+    )
+    assert catalogs["cached"] == catalogs["built"]
+
+
+def test_mock_api():
+    api = MockATInternetAPI(rows_per_day=10, error_rate=1.0)
+    body = json.dumps(
+        {
+            "space": {"s": [1]},
+            "columns": ["m_visits", "date", "visit_hour", "site_level2"],
+            "period": {
+                "p1": [{"type": "D", "start": "2022-05-01", "end": "2022-05-31"}]
+            },
+            "sort": ["-m_visits", "date", "visit_hour", "site_level2"],
+            "max-results": 100,
+            "page-num": 4,
+        }
+    ).encode()
+    # the first attempt fails, the next ones succeed and always return the same rows
+    assert api.handle(body)[0] == 500
+    status, content = api.handle(body)
+    assert status == 200
+    assert api.handle(body)[1] == content
+    data_feed = json.loads(content)["DataFeed"]
+    assert len(data_feed["Rows"]) == 10
+    assert data_feed["Rows"][0] == {
+        "m_visits": 160,
+        "date": "2022-05-31",
+        "visit_hour": 12,
+        "site_level2": "site_level2_300",
+    }
+
+
+def test_offline_sync_benchmark():
+    today = datetime.date.today()
+    start_date = today - datetime.timedelta(days=40)
+    with MockATInternetAPI(rows_per_day=20) as api:
+        results = run_benchmark(
+            api,
+            max_results=[50, 500],
+            start_date=start_date.isoformat(),
+            streams=["hourly_visits"],
+        )
+        expected_rows = api.expected_rows(start_date, today)
+    print("\n" + format_results(results))
+    small_pages, big_pages = results
+    assert small_pages.records == big_pages.records == expected_rows
+    assert big_pages.requests < small_pages.requests
+
+
+def test_offline_deselected_metrics_benchmark():
+    start_date = datetime.date.today() - datetime.timedelta(days=40)
+    deselected = ["m_bounces", "m_time_spent_per_visits"]
+    with MockATInternetAPI(rows_per_day=20) as api:
+        options = dict(
+            max_results=[500],
+            start_date=start_date.isoformat(),
+            streams=["hourly_visits"],
+        )
+        (full,) = run_benchmark(api, **options)
+        (result,) = run_benchmark(api, deselected=deselected, **options)
+        columns = api.last_payload["columns"]
+    print("\n" + format_comparison([full], [result]))
+    assert not set(deselected) & set(columns)
+    assert "m_visits" in columns
+    assert result.records == full.records
+    assert result.payload_mb < full.payload_mb
+
+
+if __name__ == "__main__":
+    print(consume_page(sys.argv[1], Path(sys.argv[2])))
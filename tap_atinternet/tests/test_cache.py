@@ -0,0 +1,75 @@
+import datetime
+import time
+
+import requests
+
+from tap_atinternet.cache import ResponseCache
+from tap_atinternet.utils import is_closed_month
+
+API_URL = "https://api.atinternet.io/v3/data/getData"
+CONTENT = b'{"DataFeed": {"Rows": []}}'
+
+
+def make_request(payload: bytes, url: str = API_URL) -> requests.PreparedRequest:
+    return requests.Request("POST", url, data=payload).prepare()
+
+
+PAYLOAD = make_request(b'{"space": {"s": [1]}, "page-num": 1}')
+
+
+def test_cache_get_put(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get(PAYLOAD) is None
+    cache.put(PAYLOAD, CONTENT)
+    assert cache.get(PAYLOAD) == CONTENT
+    assert cache.get(make_request(b'{"space": {"s": [2]}, "page-num": 1}')) is None
+    # the same payload to another API (or API version) is another response
+    assert cache.get(make_request(PAYLOAD.body, API_URL.replace("v3", "v4"))) is None
+    assert (cache.hits, cache.misses) == (1, 3)
+    # entries are persisted on disk
+    assert ResponseCache(str(tmp_path)).get(PAYLOAD) == CONTENT
+
+
+def test_cache_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl_days=0)
+    cache.put(PAYLOAD, CONTENT)
+    time.sleep(0.01)
+    assert cache.get(PAYLOAD) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cache_eviction(tmp_path):
+    cache = ResponseCache(
+        str(tmp_path), max_size_mb=6e-5
+    )  # ~60 bytes: one compressed entry
+    cache.put(PAYLOAD, CONTENT)
+    time.sleep(0.01)
+    cache.put(make_request(b"other payload"), CONTENT)
+    assert cache.get(PAYLOAD) is None
+    assert cache.get(make_request(b"other payload")) == CONTENT
+
+
+def test_cache_size_on_overwrite(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put(PAYLOAD, CONTENT)
+    cache.put(PAYLOAD, CONTENT * 10)
+    assert cache._size == sum(path.stat().st_size for path in tmp_path.iterdir())
+
+
+def test_cache_eviction_of_removed_entries(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), max_size_mb=6e-5)
+    cache.put(PAYLOAD, CONTENT)
+    listed = list(cache._entries())
+    # the entries are removed by another thread after being listed
+    for path in listed:
+        path.unlink()
+    monkeypatch.setattr(cache, "_entries", lambda: iter(listed))
+    cache.put(make_request(b"other payload"), CONTENT)
+    assert cache._size == 0
+
+
+def test_is_closed_month():
+    today = datetime.date(2022, 5, 10)
+    assert is_closed_month(2022, 4, today=today)
+    assert is_closed_month(2021, 12, today=today)
+    assert not is_closed_month(2022, 5, today=today)
@@ -0,0 +1,84 @@
+import copy
+import json
+
+from singer_sdk import typing as th  # JSON schema typing helpers
+
+from tap_atinternet.catalog import (
+    catalog_version,
+    load_cached_catalog,
+    write_cached_catalog,
+)
+from tap_atinternet.streams import stream_schema
+from tap_atinternet.tap import STREAM_TYPES, TapATInternet
+from tap_atinternet.tests.helpers import make_catalog
+from tap_atinternet.utils import lazy_class_attribute
+
+CONFIG = {
+    "api_key": "mock",
+    "secret_key": "mock",
+    "site_id": 1,
+    "start_date": "2022-01-01",
+}
+
+
+STREAM_TYPES_KEY = tuple(STREAM_TYPES)
+
+
+def test_cached_catalog_is_up_to_date():
+    # if this fails, regenerate the catalog: `python -m tap_atinternet.catalog`
+    cached = load_cached_catalog(STREAM_TYPES_KEY)
+    assert cached is not None
+    assert TapATInternet(config=CONFIG).build_catalog().to_dict() == cached
+
+
+def test_discovery_from_cached_catalog():
+    cached = copy.deepcopy(load_cached_catalog(STREAM_TYPES_KEY))
+    tap = TapATInternet(config=CONFIG)
+    catalog = tap.catalog_dict
+    # no stream is instantiated
+    assert tap._streams is None
+    assert catalog == cached
+    # the catalogs returned are copies of the cached catalog
+    catalog["streams"][0]["metadata"][0]["metadata"]["selected"] = False
+    assert load_cached_catalog(STREAM_TYPES_KEY) == cached
+
+
+def test_outdated_cached_catalog(tmp_path):
+    path = tmp_path / "catalog.json"
+    write_cached_catalog({"streams": []}, STREAM_TYPES, path)
+    assert load_cached_catalog(STREAM_TYPES_KEY, path) == {"streams": []}
+    path.write_text(json.dumps({"version": "0", "catalog": {"streams": []}}))
+    load_cached_catalog.cache_clear()
+    assert load_cached_catalog(STREAM_TYPES_KEY, path) is None
+    assert load_cached_catalog(STREAM_TYPES_KEY, tmp_path / "missing.json") is None
+
+
+def test_catalog_version():
+    version = catalog_version(STREAM_TYPES)
+    assert catalog_version(STREAM_TYPES) == version
+    # only the stream definitions matter
+    assert catalog_version(STREAM_TYPES[:2]) != version
+
+    class ExtraPropertyStream(STREAM_TYPES[0]):
+        extra_properties = th.PropertiesList(th.Property("extra", th.StringType))
+        schema = stream_schema
+
+    assert catalog_version([ExtraPropertyStream, *STREAM_TYPES[1:]]) != version
+    # the lazy schema is not built
+    assert isinstance(ExtraPropertyStream.__dict__["schema"], lazy_class_attribute)
+    assert "extra" in ExtraPropertyStream.schema["properties"]
+
+
+def test_only_selected_streams_are_instantiated():
+    catalog = make_catalog(CONFIG, ["geo_visits", "pages_visits"])
+    tap = TapATInternet(config=CONFIG, catalog=catalog)
+    assert list(tap.streams) == ["geo_visits", "pages_visits"]
+    # streams missing from the catalog are selected by default
+    catalog["streams"] = [
+        entry for entry in catalog["streams"] if entry["tap_stream_id"] != "geo_visits"
+    ]
+    tap = TapATInternet(config=CONFIG, catalog=catalog)
+    assert list(tap.streams) == ["geo_visits", "pages_visits"]
+    # without a catalog, all the streams
+    tap = TapATInternet(config=CONFIG)
+    assert sorted(tap.streams) == sorted(stream.name for stream in STREAM_TYPES)
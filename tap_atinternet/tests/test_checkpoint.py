@@ -0,0 +1,85 @@
+import datetime
+
+import pytest
+
+from tap_atinternet.checkpoint import get_resume_position, make_cursor, make_sort
+from tap_atinternet.tests.helpers import committed, row_keys, sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+
+SORT = make_sort(["date", "visit_hour", "site_level2"])
+
+
+def test_resume_position():
+    assert SORT == ["-m_visits", "date", "visit_hour", "site_level2"]
+    cursor = make_cursor(("2022-05-01", "2022-05-31"), 3, max_results=100, sort=SORT)
+    cursor["offset"] = 42
+    assert get_resume_position(cursor, max_results=100, sort=SORT) == (
+        ("2022-05-01", "2022-05-31"),
+        3,
+        42,
+    )
+    # 242 rows already emitted, with pages of 50 rows
+    assert get_resume_position(cursor, max_results=50, sort=SORT)[1:] == (5, 42)
+    # pages are capped to 10000 rows by the API
+    cursor = make_cursor(("2022-05-01", "2022-05-31"), 2, max_results=20000, sort=SORT)
+    cursor["offset"] = 5
+    assert get_resume_position(cursor, max_results=15000, sort=SORT)[1:] == (2, 5)
+    assert get_resume_position(cursor, max_results=5000, sort=SORT)[1:] == (3, 5)
+    # the rows order changed (e.g. a cursor saved without tie-breakers), the cursor is not valid anymore
+    assert get_resume_position(dict(cursor, sort=["-m_visits"]), 100, SORT) is None
+    assert get_resume_position(None, max_results=100, sort=SORT) is None
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_resume_interrupted_sync(max_workers):
+    # closed months only: the windows of the open month are not resumed by offset
+    config = {
+        "checkpoint_interval": 1,
+        "max_workers": max_workers,
+        "start_date": "2022-01-01",
+        "stream_filters": {"hourly_visits": {"end_date": "2022-04-30"}},
+    }
+    with MockATInternetAPI(rows_per_day=3) as api:
+        full_records, _ = committed(sync(api, config))
+        full_requests = api.requests
+
+    with MockATInternetAPI(rows_per_day=3, fail_after=full_requests * 3 // 4) as api:
+        records, state = committed(sync(api, config, interrupted=True))
+    assert 0 < len(records) < len(full_records)
+    assert "cursor" in state["bookmarks"]["hourly_visits"]
+
+    with MockATInternetAPI(rows_per_day=3) as api:
+        messages = sync(api, config, state=state)
+        resumed_requests = api.requests
+    resumed_records = [m["record"] for m in messages if m["type"] == "RECORD"]
+    # no row is missing or emitted twice, and no page is requested twice
+    assert row_keys(records + resumed_records) == row_keys(full_records)
+    assert resumed_requests < full_requests
+    assert "cursor" not in messages[-1]["value"]["bookmarks"]["hourly_visits"]
+
+
+def test_resume_open_month():
+    # the interrupted sync stops in the open month: its window is requested again from its first page
+    today = datetime.date.today()
+    config = {
+        "checkpoint_interval": 1,
+        "start_date": (today.replace(day=1) - datetime.timedelta(days=1)).isoformat(),
+    }
+    with MockATInternetAPI(rows_per_day=30) as api:
+        full_records, _ = committed(sync(api, config))
+        full_requests = api.requests
+
+    with MockATInternetAPI(rows_per_day=30, fail_after=full_requests - 1) as api:
+        records, state = committed(sync(api, config, interrupted=True))
+    cursor = state["bookmarks"]["hourly_visits"]["cursor"]
+    assert cursor["window"][0] == today.replace(day=1).isoformat()
+    assert cursor["page_num"] > 1
+
+    with MockATInternetAPI(rows_per_day=30) as api:
+        messages = sync(api, config, state=state)
+    resumed_records = [m["record"] for m in messages if m["type"] == "RECORD"]
+    # no row is missing, the rows of the open month already emitted are emitted again
+    assert set(row_keys(records + resumed_records)) == set(row_keys(full_records))
+    assert len(resumed_records) == len(
+        [r for r in full_records if r["date"] >= cursor["window"][0]]
+    )
@@ -0,0 +1,220 @@
+import datetime
+import logging
+from collections import Counter
+
+import pytest
+import singer_sdk.streams.core
+
+from tap_atinternet.client import ATInternetStream
+from tap_atinternet.tap import TapATInternet
+from tap_atinternet.tests.helpers import records_of, sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+
+
+def test_sync_with_workers():
+    with MockATInternetAPI(rows_per_day=3) as api:
+        expected = sync(api, {"max_workers": 1})
+    with MockATInternetAPI(rows_per_day=3) as api:
+        messages = sync(api, {"max_workers": 3})
+    # the windows are smaller with several workers (the mock rows depend on the
+    # request), but every day is extracted once, in order
+    dates = [r["date"] for r in records_of(messages)]
+    assert dates == sorted(dates)
+    assert Counter(dates) == Counter(r["date"] for r in records_of(expected))
+    assert messages[-1]["value"] == expected[-1]["value"]
+
+
+def test_parallel_streams(monkeypatch):
+    # the state is only modified while holding the output lock
+    def locked(update):
+        def wrapper(*args, **kwargs):
+            assert TapATInternet.output_lock.locked()
+            return update(*args, **kwargs)
+
+        return wrapper
+
+    for name in ("increment_state", "write_starting_replication_value"):
+        monkeypatch.setattr(
+            f"singer_sdk.streams.core.{name}",
+            locked(getattr(singer_sdk.streams.core, name)),
+        )
+    streams = ("hourly_visits", "geo_visits", "pages_visits")
+    with MockATInternetAPI(rows_per_day=3) as api:
+        expected = sync(api, {}, streams=streams)
+    with MockATInternetAPI(rows_per_day=3) as api:
+        config = {"parallel_streams": True, "checkpoint_interval": 1}
+        messages = sync(api, config, streams=streams)
+    for stream in streams:
+        assert records_of(messages, stream) == records_of(expected, stream)
+    assert messages[-1]["value"] == expected[-1]["value"]
+
+
+def test_sync_with_pages_over_api_limit():
+    # max_results is capped to 10000 rows per page by the API
+    start_date = datetime.date.today() - datetime.timedelta(days=60)
+    config = {"max_results": 20000, "start_date": start_date.isoformat()}
+    with MockATInternetAPI(rows_per_day=500) as api:
+        records = records_of(sync(api, config))
+        expected_rows = api.expected_rows(start_date, datetime.date.today())
+    assert expected_rows > 10000
+    assert len(records) == expected_rows
+
+
+@pytest.mark.parametrize(
+    "config",
+    [{}, {"collect_metrics": True}, {"http_engine": "async"}],
+    ids=["requests", "instrumented", "async"],
+)
+def test_request_duration_metric_logs(caplog, config):
+    if config.get("http_engine") == "async":
+        pytest.importorskip("httpx")
+    with MockATInternetAPI(rows_per_day=3) as api:
+        with caplog.at_level(logging.INFO):
+            sync(api, config)
+    # the same metric logs as the requests of the Singer SDK (with `collect_metrics`,
+    # the histogram of the durations is logged too)
+    metric = "'type': 'timer', 'metric': 'http_request_duration'"
+    metric_logs = [r for r in caplog.records if metric in r.getMessage()]
+    assert len(metric_logs) == api.requests
+
+
+@pytest.mark.parametrize("collect_metrics", [False, True])
+def test_stream_rows_with_cache(tmp_path, collect_metrics):
+    pytest.importorskip("ijson")
+    config = {
+        "stream_rows": True,
+        "cache_dir": str(tmp_path),
+        "collect_metrics": collect_metrics,
+    }
+    with MockATInternetAPI(rows_per_day=3) as api:
+        expected = records_of(sync(api, {}))
+    # the closed months are downloaded to be cached, then served from the cache
+    for _ in range(2):
+        with MockATInternetAPI(rows_per_day=3) as api:
+            assert records_of(sync(api, config)) == expected
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_rows_per_day_with_pages_over_api_limit(max_workers):
+    # windows of several pages of 10000 rows (not max_results)
+    start_date = datetime.date.today() - datetime.timedelta(days=60)
+    config = {
+        "max_results": 20000,
+        "start_date": start_date.isoformat(),
+        "max_workers": max_workers,
+    }
+    with MockATInternetAPI(rows_per_day=500) as api:
+        state = sync(api, config)[-1]["value"]
+    assert state["bookmarks"]["hourly_visits"]["rows_per_day"] == 500
+
+
+def test_async_sync_with_pages_over_api_limit():
+    pytest.importorskip("httpx")
+    start_date = datetime.date.today() - datetime.timedelta(days=60)
+    config = {
+        "max_results": 20000,
+        "start_date": start_date.isoformat(),
+        "http_engine": "async",
+    }
+    with MockATInternetAPI(rows_per_day=500) as api:
+        records = records_of(sync(api, config))
+        expected_rows = api.expected_rows(start_date, datetime.date.today())
+    assert len(records) == expected_rows
+
+
+@pytest.mark.parametrize(
+    "config",
+    [{}, {"max_workers": 2}, {"http_engine": "async"}],
+    ids=["sequential", "concurrent", "async"],
+)
+def test_sync_with_windows_over_api_row_limit(monkeypatch, config):
+    if config.get("http_engine") == "async":
+        pytest.importorskip("httpx")
+    # a lower row limit: the calendar months (300 rows) are truncated by the API
+    monkeypatch.setattr(ATInternetStream, "api_max_rows", 100)
+    today = datetime.date.today()
+    start_date = today - datetime.timedelta(days=60)
+    config = {**config, "start_date": start_date.isoformat()}
+    with MockATInternetAPI(rows_per_day=10, max_rows=100) as api:
+        records = records_of(sync(api, config))
+    # the truncated windows are requested again in shorter windows: every day is
+    # extracted in full
+    days = Counter(record["date"] for record in records)
+    assert len(days) == (today - start_date).days + 1
+    if config.get("max_workers") or config.get("http_engine"):
+        # the rows of the truncated windows are not emitted
+        assert set(days.values()) == {10}
+    else:
+        # the rows already emitted are emitted again
+        assert min(days.values()) == 10
+
+
+@pytest.mark.parametrize(
+    "config",
+    [{}, {"max_workers": 2}],
+    ids=["sequential", "concurrent"],
+)
+def test_sync_with_merged_months_over_api_row_limit(monkeypatch, config):
+    # a stale density estimate: a whole year is merged in one window (730 rows),
+    # truncated by the API
+    monkeypatch.setattr(ATInternetStream, "api_max_rows", 100)
+    year = datetime.date.today().year - 1
+    config = {
+        **config,
+        "start_date": f"{year}-01-01",
+        "stream_filters": {"geo_visits": {"end_date": f"{year}-12-31"}},
+    }
+    state = {"bookmarks": {"geo_visits": {"rows_per_day": 0.1}}}
+    with MockATInternetAPI(rows_per_day=2, max_rows=100) as api:
+        records = records_of(sync(api, config, state, streams=("geo_visits",)))
+        expected_rows = api.expected_rows(
+            datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+        )
+    # the merged months are requested again one at a time: every month is
+    # extracted in full
+    months = Counter(record["date"] for record in records)
+    assert len(months) == 12
+    assert len(records) >= expected_rows
+    if config.get("max_workers"):
+        assert len(records) == expected_rows
+
+
+def test_single_site_records():
+    with MockATInternetAPI(rows_per_day=3) as api:
+        messages = sync(api, {})
+    schema = next(m for m in messages if m["type"] == "SCHEMA")
+    assert "site_id" not in schema["schema"]["properties"]
+    assert "site_id" not in schema["key_properties"]
+    assert all("site_id" not in record for record in records_of(messages))
+
+
+def test_site_partitions():
+    config = {"site_ids": [1, 2], "site_id": None}
+    with MockATInternetAPI(rows_per_day=3) as api:
+        messages = sync(api, config)
+    schema = next(m for m in messages if m["type"] == "SCHEMA")
+    assert schema["key_properties"][-1] == "site_id"
+    records = records_of(messages)
+    assert Counter(r["site_id"] for r in records) == {
+        1: len(records) // 2,
+        2: len(records) // 2,
+    }
+    # one bookmark per site
+    partitions = messages[-1]["value"]["bookmarks"]["hourly_visits"]["partitions"]
+    assert [p["context"] for p in partitions] == [{"site_id": 1}, {"site_id": 2}]
+    assert all(
+        p["replication_key_value"] == max(r["date"] for r in records)
+        for p in partitions
+    )
+
+
+def test_batch_sites():
+    config = {"site_ids": [1, 2], "site_id": None, "batch_sites": True}
+    with MockATInternetAPI(rows_per_day=4) as api:
+        messages = sync(api, config)
+        payload = api.last_payload
+    # both sites in each request, and the rows split per site with the site_id column
+    assert payload["space"] == {"s": [1, 2]}
+    assert "site_id" in payload["columns"]
+    assert {r["site_id"] for r in records_of(messages)} == {1, 2}
+    assert "partitions" not in messages[-1]["value"]["bookmarks"]["hourly_visits"]
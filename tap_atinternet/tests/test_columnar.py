@@ -0,0 +1,89 @@
+import pytest
+
+from tap_atinternet.columnar import (
+    ColumnarPage,
+    DictionaryColumn,
+    concat_rows,
+    make_column,
+)
+from tap_atinternet.tests.helpers import other_messages, records_of, sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+
+
+def make_page(rows):
+    kinds = {"page": "string", "m_visits": "integer", "m_time": "number"}
+    return ColumnarPage(
+        {
+            name: make_column([row[name] for row in rows], kind)
+            for name, kind in kinds.items()
+        },
+        len(rows),
+    )
+
+
+def test_columnar_page():
+    rows = [
+        {"page": "home", "m_visits": 3, "m_time": 1.5},
+        {"page": "news", "m_visits": 2, "m_time": 0.0},
+        {"page": "home", "m_visits": None, "m_time": 2.5},
+    ]
+    page = make_page(rows)
+    assert list(page) == rows
+    assert len(page) == 3
+    assert page[-1] == rows[-1]
+    assert page[1:] == rows[1:]
+    with pytest.raises(IndexError):
+        page[3]
+    assert page.columns["page"].values == ["home", "news"]
+    assert list(page.columns["page"].codes) == [0, 1, 0]
+    # null values: not a typed array
+    assert page.columns["m_visits"] == [3, 2, None]
+    assert page.columns["m_time"].typecode == "d"
+
+
+def test_concat_rows():
+    first = [{"page": "home", "m_visits": 3, "m_time": 1.5}]
+    second = [
+        {"page": "contact", "m_visits": 1, "m_time": 1.0},
+        {"page": "home", "m_visits": 4, "m_time": 2.0},
+    ]
+    rows = concat_rows([], make_page(first))
+    rows = concat_rows(rows, make_page(second))
+    assert isinstance(rows, ColumnarPage)
+    assert list(rows) == first + second
+    assert rows.columns["page"].values == ["home", "contact"]
+    assert rows.columns["m_visits"].typecode == "q"
+    # pages of dicts
+    assert concat_rows(list(first), second) == first + second
+    assert concat_rows(rows, []) is rows
+
+
+def test_dictionary_column():
+    column = DictionaryColumn(["a", "b", "a"])
+    other = DictionaryColumn(["c", "a"])
+    column.extend_column(other)
+    assert list(column) == ["a", "b", "a", "c", "a"]
+    assert column.values == ["a", "b", "c"]
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_columnar_sync(max_workers):
+    with MockATInternetAPI(rows_per_day=3) as api:
+        expected = sync(api, {"max_workers": max_workers})
+    with MockATInternetAPI(rows_per_day=3) as api:
+        messages = sync(api, {"max_workers": max_workers, "columnar_pages": True})
+    assert records_of(messages) == records_of(expected)
+    assert other_messages(messages) == other_messages(expected)
+
+
+def test_columnar_sync_after_single_site_sync():
+    # the page transformer of the batched sites keeps their 'site_id' column
+    batch_sites = {"site_ids": [1, 2], "site_id": None, "batch_sites": True}
+    with MockATInternetAPI(rows_per_day=3) as api:
+        expected = sync(api, batch_sites)
+    with MockATInternetAPI(rows_per_day=3) as api:
+        sync(api, {"columnar_pages": True})
+        messages = sync(api, {**batch_sites, "columnar_pages": True})
+    records = records_of(messages)
+    assert records == records_of(expected)
+    assert {record["site_id"] for record in records} == {1, 2}
@@ -9,9 +9,17 @@ from singer_sdk.testing import get_standard_tap_tests
 
 from tap_atinternet.tap import TapATInternet
 
-with open(Path(__file__).parents[2] / ".secrets/config.gn.json") as f:
+SECRETS_DIR = Path(__file__).parents[2] / ".secrets"
+if (
+    not (SECRETS_DIR / "config.gn.json").exists()
+    or not (SECRETS_DIR / "config.sp.json").exists()
+):
+    # these tests call the real AT Internet API, with the credentials of the .secrets directory
+    pytest.skip("the API credentials of .secrets/ are missing", allow_module_level=True)
+
+with open(SECRETS_DIR / "config.gn.json") as f:
     SAMPLE_CONFIG_GN = json.load(f)
-with open(Path(__file__).parents[2] / ".secrets/config.sp.json") as f:
+with open(SECRETS_DIR / "config.sp.json") as f:
     SAMPLE_CONFIG_SP = json.load(f)
 with open(Path(__file__).parent / "incremental_catalog.json") as f:
     # you can obtain this file by configuring the tap to incremental sync, and running
@@ -58,6 +66,6 @@ def test_record_schema(configs):
         for stream in streams:
             records_iterator = stream.get_records(context=None)
             first_record = next(records_iterator)
-            print('Record:\n', first_record)
-            print('Schema:\n', stream.schema)
+            print("Record:\n", first_record)
+            print("Schema:\n", stream.schema)
             jsonschema.validate(instance=first_record, schema=stream.schema)
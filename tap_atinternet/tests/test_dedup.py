@@ -0,0 +1,59 @@
+from tap_atinternet.dedup import DedupIndex
+from tap_atinternet.tests.helpers import committed, sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+
+PRIMARY_KEYS = ["date", "geo_city", "site_id"]
+
+
+def test_dedup_index(tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    record = {"date": "2022-05-01", "geo_city": "Paris", "site_id": 1, "m_visits": 5}
+    index = DedupIndex(path)
+    run = index.start_run("geo", None)
+    assert index.start_run("geo", run) == run
+    assert index.is_changed("geo_visits", "geo", run, record, PRIMARY_KEYS)
+    assert not index.is_changed("geo_visits", "geo", run, dict(record), PRIMARY_KEYS)
+    # same primary key in another stream
+    assert index.is_changed("pages_visits", "pages", run, record, PRIMARY_KEYS)
+    index.commit()
+    changed = dict(record, m_visits=6)
+    assert index.is_changed("geo_visits", "geo", run, changed, PRIMARY_KEYS)
+    assert index.report() == {
+        "geo_visits": {"emitted": 2, "suppressed": 1},
+        "pages_visits": {"emitted": 1, "suppressed": 0},
+    }
+    index.close()
+
+    # the last change was not committed
+    index = DedupIndex(path)
+    assert not index.is_changed("geo_visits", "geo", run, record, PRIMARY_KEYS)
+    assert index.is_changed(
+        "geo_visits", "geo", run, dict(record, site_id=2), PRIMARY_KEYS
+    )
+    # a new run (the state was reset): the records of the older runs are dropped
+    new_run = index.start_run("geo", None)
+    assert new_run != run
+    assert index.is_changed("geo_visits", "geo", new_run, record, PRIMARY_KEYS)
+    index.close()
+
+
+def test_dedup_sync(tmp_path):
+    config = {"dedup_index_path": str(tmp_path / "index.sqlite")}
+    with MockATInternetAPI(rows_per_day=3) as api:
+        records, state = committed(sync(api, config))
+        assert len(records) == api.rows
+    # a rerun from the start date (same dedup run, without the bookmark): nothing changed
+    run = state["bookmarks"]["hourly_visits"]["dedup_run"]
+    rerun_state = {"bookmarks": {"hourly_visits": {"dedup_run": run}}}
+    with MockATInternetAPI(rows_per_day=3) as api:
+        assert committed(sync(api, config, state=rerun_state))[0] == []
+    # the rows of each day change, and each month has new rows
+    with MockATInternetAPI(rows_per_day=4) as api:
+        records, _ = committed(sync(api, config, state=rerun_state))
+        assert 0 < len(records) <= api.rows
+    with MockATInternetAPI(rows_per_day=4) as api:
+        assert committed(sync(api, config, state=rerun_state))[0] == []
+    # the state was reset (e.g. with the target tables): all the records are emitted again
+    with MockATInternetAPI(rows_per_day=4) as api:
+        records, _ = committed(sync(api, config))
+        assert len(records) == api.rows
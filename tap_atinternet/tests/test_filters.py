@@ -0,0 +1,117 @@
+import contextlib
+import datetime
+import io
+import json
+
+import pytest
+from singer_sdk.exceptions import ConfigValidationError
+
+from tap_atinternet.filters import get_stream_filter, validate_stream_filters
+from tap_atinternet.tap import TapATInternet
+from tap_atinternet.tests.helpers import make_catalog
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+
+
+def test_stream_filter():
+    config = {
+        "filter_str": "news",
+        "stream_filters": {
+            "*": {
+                "property": {"site_level2": {"$neq": "Test"}},
+                "end_date": "2022-06-30",
+            },
+            "pages_visits": {
+                "metric": {
+                    "$OR": [{"m_visits": {"$gt": 10}}, {"m_bounces": {"$lt": 2}}]
+                },
+                "start_date": "2022-01-01",
+                "end_date": "2022-05-31",
+            },
+        },
+    }
+    stream_filter = get_stream_filter(config, "pages_visits")
+    assert stream_filter.api_filter == {
+        "property": {
+            "$AND": [
+                {"page_full_name": {"$lk": "news"}},
+                {"site_level2": {"$neq": "Test"}},
+            ]
+        },
+        "metric": {"$OR": [{"m_visits": {"$gt": 10}}, {"m_bounces": {"$lt": 2}}]},
+    }
+    assert stream_filter.metrics == ["m_visits", "m_bounces"]
+    assert stream_filter.start_date == datetime.date(2022, 1, 1)
+    assert stream_filter.end_date == datetime.date(2022, 5, 31)
+    # the filters of all the streams only
+    assert get_stream_filter(config, "geo_visits")[2:] == (
+        None,
+        datetime.date(2022, 6, 30),
+    )
+    assert get_stream_filter({}, "geo_visits").api_filter == {}
+
+
+@pytest.mark.parametrize(
+    "stream_filters",
+    [
+        {"unknown_stream": {}},
+        {"*": {"properties": {"page": {"$eq": "x"}}}},
+        {"geo_visits": {"metric": {}}},
+        {"geo_visits": {"end_date": "last month"}},
+    ],
+)
+def test_invalid_stream_filters(stream_filters):
+    with pytest.raises(ConfigValidationError):
+        validate_stream_filters(stream_filters, ["geo_visits", "pages_visits"])
+
+
+def test_projection_and_filters():
+    start_date = datetime.date.today() - datetime.timedelta(days=120)
+    end_date = datetime.date.today() - datetime.timedelta(days=60)
+    stream_filter = {
+        "property": {"site_level2": {"$lk": "site"}},
+        "metric": {"m_unique_visitors": {"$gte": 2}},
+        "end_date": end_date.isoformat(),
+    }
+    with MockATInternetAPI(rows_per_day=3) as api:
+        config = {
+            "api_key": "mock",
+            "secret_key": "mock",
+            "site_id": 1,
+            "start_date": start_date.isoformat(),
+            "api_url": api.url,
+            "stream_filters": {"hourly_visits": stream_filter},
+        }
+        catalog = make_catalog(
+            config,
+            ["hourly_visits"],
+            deselected=["m_visits", "m_unique_visitors", "m_bounces"],
+        )
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            TapATInternet(config=config, catalog=catalog).sync_all()
+        payload = api.last_payload
+    # the sort metric and the metrics of the filter are still requested
+    assert payload["columns"] == [
+        "m_visits",
+        "m_unique_visitors",
+        "m_time_spent_per_visits",
+        "date",
+        "visit_hour",
+        "site_level2",
+    ]
+    assert payload["filter"] == {
+        "property": stream_filter["property"],
+        "metric": stream_filter["metric"],
+    }
+    assert payload["period"]["p1"][0]["end"] == end_date.isoformat()
+    messages = [json.loads(line) for line in output.getvalue().splitlines()]
+    records = [m["record"] for m in messages if m["type"] == "RECORD"]
+    assert len(records) == api.expected_rows(start_date, end_date)
+    assert max(record["date"] for record in records) == end_date.isoformat()
+    # the metrics that are not selected are not emitted
+    assert set(records[0]) == {
+        "m_time_spent_per_visits",
+        "date",
+        "visit_hour",
+        "site_level2",
+    }
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from tap_atinternet.metrics import ROWS_BUCKETS, Histogram, SyncMetrics
+from tap_atinternet.tests.helpers import sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(1, 10))
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+    assert (histogram.count, histogram.sum) == (4, 56.5)
+    assert histogram.cumulative_counts() == [("1", 2), ("10", 3), ("+Inf", 4)]
+
+
+def test_sync_metrics():
+    metrics = SyncMetrics()
+    metrics.increment("bytes_received", 100, stream="geo_visits")
+    metrics.increment("bytes_received", 50, stream="geo_visits")
+    metrics.increment("pages", stream="geo_visits", month="2022-05")
+    metrics.observe("rows_per_page", 3, buckets=ROWS_BUCKETS, stream="geo_visits")
+    metrics.increment("pages", stream="pages_visits", month="2022-05")
+
+    assert metrics.stream_metrics("geo_visits")[:2] == [
+        {
+            "type": "counter",
+            "metric": "bytes_received",
+            "value": 150,
+            "tags": {"stream": "geo_visits"},
+        },
+        {
+            "type": "counter",
+            "metric": "pages",
+            "value": 1,
+            "tags": {"month": "2022-05", "stream": "geo_visits"},
+        },
+    ]
+    assert len(metrics.stream_metrics("geo_visits")) == 3
+    prometheus = metrics.to_prometheus().splitlines()
+    assert 'tap_atinternet_bytes_received{stream="geo_visits"} 150' in prometheus
+    assert (
+        'tap_atinternet_rows_per_page_bucket{stream="geo_visits",le="10"} 1'
+        in prometheus
+    )
+    assert 'tap_atinternet_rows_per_page_count{stream="geo_visits"} 1' in prometheus
+    assert json.loads(json.dumps(metrics.to_dict()))["histograms"][0]["count"] == 1
+
+
+def test_timed():
+    metrics = SyncMetrics()
+    assert list(metrics.timed(range(3), "decode_seconds", stream="geo_visits")) == [
+        0,
+        1,
+        2,
+    ]
+    ((name, tags),) = metrics.counters
+    assert (name, tags) == ("decode_seconds", (("stream", "geo_visits"),))
+
+
+def counter_total(metrics: dict, name: str) -> int:
+    return sum(c["value"] for c in metrics["counters"] if c["metric"] == name)
+
+
+def test_async_sync_metrics(monkeypatch, tmp_path):
+    pytest.importorskip("httpx")
+    monkeypatch.setattr("tap_atinternet.transport.retry_delay", lambda *args: 0)
+    config = {
+        "collect_metrics": True,
+        "metrics_file": str(tmp_path / "metrics.json"),
+        "http_engine": "async",
+    }
+    # every request fails once with a 500 error, and is retried
+    with MockATInternetAPI(rows_per_day=3, error_rate=1.0) as api:
+        sync(api, config)
+    metrics = json.loads((tmp_path / "metrics.json").read_text())
+    # like with the requests engine: one page per successful request
+    pages = api.requests - api.errors
+    assert counter_total(metrics, "pages") == pages
+    (rows_per_page,) = [
+        h for h in metrics["histograms"] if h["metric"] == "rows_per_page"
+    ]
+    assert (rows_per_page["count"], rows_per_page["sum"]) == (pages, api.rows)
+    assert counter_total(metrics, "retries") == api.errors > 0
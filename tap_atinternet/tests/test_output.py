@@ -0,0 +1,69 @@
+import contextlib
+import io
+import json
+
+import pytest
+from singer.messages import RecordMessage
+
+from tap_atinternet.output import BufferedOutput
+from tap_atinternet.tap import TapATInternet
+from tap_atinternet.tests.helpers import other_messages, records_of, row_keys, sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+
+
+def test_buffered_output():
+    output = io.StringIO()
+    buffered = BufferedOutput(buffer_size=100)
+    with contextlib.redirect_stdout(output):
+        buffered.write_record(RecordMessage("s", {"a": 1}), month="2022-05")
+        assert output.getvalue() == ""
+        buffered.write_record(RecordMessage("s", {"a": "x" * 100}), month="2022-05")
+        buffered.write_message({"type": "STATE", "value": {}})
+        buffered.flush()
+    messages = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert messages == [
+        {"type": "RECORD", "stream": "s", "record": {"a": 1}},
+        {"type": "RECORD", "stream": "s", "record": {"a": "x" * 100}},
+        {"type": "STATE", "value": {}},
+    ]
+
+
+@pytest.mark.parametrize("output_mode", ["buffered", "batch"])
+def test_output_modes(output_mode, tmp_path):
+    with MockATInternetAPI(rows_per_day=3) as api:
+        expected = sync(api, {"checkpoint_interval": 0})
+    config = {
+        "output_mode": output_mode,
+        "batch_dir": str(tmp_path),
+        "checkpoint_interval": 0,
+    }
+    with MockATInternetAPI(rows_per_day=3) as api:
+        messages = sync(api, config)
+    assert row_keys(records_of(messages)) == row_keys(records_of(expected))
+    assert other_messages(messages) == other_messages(expected)
+    if output_mode == "batch":
+        assert not any(m["type"] == "RECORD" for m in messages)
+        # files per month, closed before each STATE message
+        months = {path.name.rsplit("-", 1)[0] for path in tmp_path.iterdir()}
+        assert months == {
+            f"hourly_visits-{record['date'][:7]}" for record in records_of(messages)
+        }
+        for i, message in enumerate(messages):
+            if message["type"] == "BATCH":
+                assert messages[i + 1]["type"] in ("BATCH", "STATE")
+
+
+@pytest.mark.parametrize("output_mode", ["records", "buffered"])
+def test_record_output_resolved_once(monkeypatch, output_mode):
+    resolved = []
+    record_output = TapATInternet.record_output
+
+    def counted(tap):
+        resolved.append(output_mode)
+        return record_output.fget(tap)
+
+    monkeypatch.setattr(TapATInternet, "record_output", property(counted))
+    with MockATInternetAPI(rows_per_day=3) as api:
+        records = records_of(sync(api, {"output_mode": output_mode}))
+    # not once per record
+    assert 0 < len(resolved) < 5 < len(records)
@@ -0,0 +1,70 @@
+import datetime
+
+from tap_atinternet.planner import WindowPlanner
+
+TODAY = datetime.date(2022, 5, 10)
+
+
+def test_calendar_months_without_density():
+    planner = WindowPlanner(daily_grain=False)
+    assert planner.plan(datetime.date(2022, 2, 15), today=TODAY) == [
+        (datetime.date(2022, 2, 15), datetime.date(2022, 2, 28)),
+        (datetime.date(2022, 3, 1), datetime.date(2022, 3, 31)),
+        (datetime.date(2022, 4, 1), datetime.date(2022, 4, 30)),
+        (datetime.date(2022, 5, 1), datetime.date(2022, 5, 10)),
+    ]
+
+
+def test_merge_quiet_months():
+    # ~3000 rows per month: closed months are merged, but never with the current month
+    planner = WindowPlanner(daily_grain=False, rows_per_day=100)
+    assert planner.plan(datetime.date(2021, 1, 1), today=TODAY) == [
+        (datetime.date(2021, 1, 1), datetime.date(2021, 12, 31)),
+        (datetime.date(2022, 1, 1), datetime.date(2022, 4, 30)),
+        (datetime.date(2022, 5, 1), datetime.date(2022, 5, 10)),
+    ]
+
+
+def test_split_busy_months():
+    planner = WindowPlanner(daily_grain=True, rows_per_day=20000)
+    windows = planner.plan(datetime.date(2022, 4, 1), today=TODAY)
+    assert windows[0] == (datetime.date(2022, 4, 1), datetime.date(2022, 4, 5))
+    assert windows[-1] == (datetime.date(2022, 5, 6), datetime.date(2022, 5, 10))
+    # monthly streams can't be split
+    planner = WindowPlanner(daily_grain=False, rows_per_day=20000)
+    assert planner.plan(datetime.date(2022, 4, 1), today=TODAY)[0] == (
+        datetime.date(2022, 4, 1),
+        datetime.date(2022, 4, 30),
+    )
+
+
+def test_split_truncated_windows():
+    planner = WindowPlanner(daily_grain=False, rows_per_day=100)
+    # merged months are split back into calendar months, and not merged anymore
+    assert planner.split(datetime.date(2021, 1, 1), datetime.date(2021, 3, 31)) == [
+        (datetime.date(2021, 1, 1), datetime.date(2021, 1, 31)),
+        (datetime.date(2021, 2, 1), datetime.date(2021, 2, 28)),
+        (datetime.date(2021, 3, 1), datetime.date(2021, 3, 31)),
+    ]
+    assert planner.next_window(datetime.date(2021, 4, 1), today=TODAY) == (
+        datetime.date(2021, 4, 1),
+        datetime.date(2021, 4, 30),
+    )
+    # a single month of a monthly stream, or a single day, can't be split
+    assert planner.split(datetime.date(2021, 4, 1), datetime.date(2021, 4, 30)) == []
+    planner = WindowPlanner(daily_grain=True, rows_per_day=20000)
+    assert planner.split(datetime.date(2022, 4, 1), datetime.date(2022, 4, 1)) == []
+    assert (
+        len(planner.split(datetime.date(2022, 4, 1), datetime.date(2022, 4, 30))) == 6
+    )
+
+
+def test_observe():
+    planner = WindowPlanner(daily_grain=True)
+    planner.observe(datetime.date(2022, 4, 1), datetime.date(2022, 4, 10), 1000)
+    assert planner.rows_per_day == 100
+    # increases are taken into account right away, decreases progressively
+    planner.observe(datetime.date(2022, 4, 11), datetime.date(2022, 4, 20), 3000)
+    assert planner.rows_per_day == 300
+    planner.observe(datetime.date(2022, 4, 21), datetime.date(2022, 4, 30), 1000)
+    assert planner.rows_per_day == 200
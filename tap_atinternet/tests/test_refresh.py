@@ -0,0 +1,108 @@
+import datetime
+import json
+
+import pytest
+from singer_sdk.exceptions import ConfigValidationError
+
+from tap_atinternet.dedup import RefreshIndex
+from tap_atinternet.refresh import ChangeDetector
+from tap_atinternet.tests.helpers import committed, sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+
+PRIMARY_KEYS = ["date", "geo_city"]
+
+
+def test_change_detector(tmp_path):
+    index = RefreshIndex(str(tmp_path / "refresh.sqlite"))
+    today = datetime.date(2022, 5, 17)
+    april = {"date": "2022-04-01", "geo_city": "Paris", "m_visits": 10}
+    may = {"date": "2022-05-01", "geo_city": "Paris", "m_visits": 5}
+    detector = ChangeDetector(index, "geo_visits", PRIMARY_KEYS, today=today)
+    assert detector.is_changed(april) and detector.is_changed(may)
+    detector.finish()
+    index.commit()
+    # only the open month is kept
+    assert index.months(detector.run) == {"2022-05"}
+
+    run = detector.run
+    detector = ChangeDetector(index, "geo_visits", PRIMARY_KEYS, run, today=today)
+    assert not detector.is_changed(dict(may))
+    assert detector.is_changed(dict(may, m_visits=6))
+    assert detector.is_changed(dict(may, geo_city="Lyon"))
+    assert detector.unchanged == 1
+    # the last values of each primary key are compared
+    assert not detector.is_changed(dict(may, m_visits=6))
+    index.close()
+
+    # the changes after the last commit are dropped
+    index = RefreshIndex(str(tmp_path / "refresh.sqlite"))
+    # the first run of the next month: the last month is requested again, and compared
+    # with the last run
+    today = datetime.date(2022, 6, 1)
+    detector = ChangeDetector(index, "geo_visits", PRIMARY_KEYS, run, today=today)
+    assert not detector.is_changed(dict(may))
+    detector.finish()
+    assert index.months(run) == set()
+
+    # a new run (the state was reset): the digests of the stream are dropped
+    detector = ChangeDetector(index, "geo_visits", PRIMARY_KEYS, today=today)
+    assert detector.run != run
+    assert detector.is_changed(dict(may, date="2022-06-01"))
+    index.close()
+
+
+def test_incremental_refresh(tmp_path):
+    config = {
+        "incremental_refresh": True,
+        "refresh_index_path": str(tmp_path / "refresh.sqlite"),
+    }
+
+    def run(rows_per_day, state=None, config=config):
+        with MockATInternetAPI(rows_per_day=rows_per_day) as api:
+            return committed(sync(api, config, state=state))
+
+    _, state = run(3)
+    # the next runs request the last day synced again
+    _, state = run(3, state)
+    bookmark = state["bookmarks"]["hourly_visits"]
+    # only a reference to the digests is kept in the state
+    assert "row_digests" not in bookmark
+    assert len(json.dumps(bookmark["refresh_run"])) < 64
+    records, _ = run(3, state)
+    assert records == []
+    records, _ = run(3, state, config={})
+    assert len(records) == 3
+    # new and updated rows only
+    records, _ = run(4, state)
+    assert len(records) == 4
+    # without the reference, the digests are not trusted
+    del state["bookmarks"]["hourly_visits"]["refresh_run"]
+    records, _ = run(3, state)
+    assert len(records) == 3
+
+
+def test_incremental_refresh_after_interruption(tmp_path):
+    config = {
+        "incremental_refresh": True,
+        "refresh_index_path": str(tmp_path / "refresh.sqlite"),
+        "checkpoint_interval": 1,
+    }
+    streams = ("geo_visits",)
+    with MockATInternetAPI(rows_per_day=20) as api:
+        full_records, _ = committed(sync(api, {}, streams=streams))
+        full_requests = api.requests
+    # interrupted on the last page of the open month
+    with MockATInternetAPI(rows_per_day=20, fail_after=full_requests - 1) as api:
+        records, state = committed(sync(api, config, streams=streams, interrupted=True))
+    assert 0 < len(records) < len(full_records)
+    with MockATInternetAPI(rows_per_day=20) as api:
+        _, state = committed(sync(api, config, state=state, streams=streams))
+    # the records emitted before the interruption were digested too
+    with MockATInternetAPI(rows_per_day=20) as api:
+        assert committed(sync(api, config, state=state, streams=streams))[0] == []
+
+
+def test_incremental_refresh_requires_an_index():
+    with MockATInternetAPI(rows_per_day=3) as api:
+        with pytest.raises(ConfigValidationError):
+            sync(api, {"incremental_refresh": True})
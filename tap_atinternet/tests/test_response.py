@@ -0,0 +1,31 @@
+import json
+
+import requests
+
+from tap_atinternet.response import DataFeedPage, parse_data_feed, read_data_feed
+
+ROWS = [
+    {"m_visits": 10, "date_year": 2022, "date_month": "May"},
+    {"m_visits": 5, "date_year": 2022, "date_month": "May"},
+]
+
+
+def make_response(body: dict) -> requests.Response:
+    response = requests.Response()
+    response._content = json.dumps(body).encode()
+    response.status_code = 200
+    return response
+
+
+def test_parse_data_feed():
+    assert parse_data_feed(json.dumps({"DataFeed": {"Rows": ROWS}}).encode()) == (
+        DataFeedPage(rows=ROWS, row_count=2)
+    )
+
+
+def test_read_data_feed_decodes_once():
+    response = make_response({"DataFeed": {"Rows": ROWS}})
+    page = read_data_feed(response)
+    assert page.rows == ROWS
+    # the same decoded page is returned on the next calls
+    assert read_data_feed(response) is page
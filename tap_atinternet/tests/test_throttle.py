@@ -0,0 +1,124 @@
+import datetime
+import email.utils
+import threading
+
+import pytest
+import requests
+from singer_sdk.exceptions import RetriableAPIError
+
+from tap_atinternet.tap import TapATInternet
+from tap_atinternet.tests.helpers import committed, row_keys, sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+from tap_atinternet.throttle import (
+    RateLimiter,
+    RequestBudget,
+    RequestBudgetExhausted,
+    parse_retry_after,
+)
+
+
+def test_rate_limiter_burst():
+    limiter = RateLimiter(max_per_second=10, burst=3)
+    assert all(limiter.reserve() < 0.01 for _ in range(3))
+    # the bucket is empty: one request every 0.1s
+    assert 0.05 < limiter.reserve() <= 0.1
+    assert 0.15 < limiter.reserve() <= 0.2
+    assert RateLimiter().reserve() == 0
+
+
+def test_rate_limiter_penalize():
+    limiter = RateLimiter(max_per_second=8)
+    limiter.penalize(retry_after=2)
+    assert limiter.rate == 4
+    assert 1.9 < limiter.reserve() <= 2
+    for _ in range(3):
+        limiter.recover()
+    assert limiter.rate == 5.5
+    for _ in range(10):
+        limiter.recover()
+    assert limiter.rate == 8
+    # without any limit, requests are still paused after a 429 response
+    limiter = RateLimiter()
+    limiter.penalize()
+    assert 0.9 < limiter.reserve() <= 1
+    assert limiter.rate == 0
+
+
+def test_parse_retry_after():
+    response = requests.Response()
+    assert parse_retry_after(response) is None
+    response.headers["Retry-After"] = "30"
+    assert parse_retry_after(response) == 30
+    date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=60)
+    response.headers["Retry-After"] = email.utils.format_datetime(date, usegmt=True)
+    assert 55 < parse_retry_after(response) <= 60
+
+
+def test_validate_response_429():
+    tap = TapATInternet(
+        config={
+            "api_key": "mock",
+            "secret_key": "mock",
+            "site_id": 1,
+            "start_date": "2022-01-01",
+        }
+    )
+    stream = tap.streams["hourly_visits"]
+    response = requests.Response()
+    response.status_code = 429
+    response.headers["Retry-After"] = "5"
+    with pytest.raises(RetriableAPIError):
+        stream.validate_response(response)
+    assert 4.9 < tap.rate_limiter.reserve() <= 5
+
+
+def test_request_budget():
+    yesterday = datetime.datetime.utcnow().date() - datetime.timedelta(days=1)
+    usage = {"date": yesterday.isoformat(), "requests": 3}
+    budget = RequestBudget(2, usage)
+    # a new day, a new budget
+    assert usage["requests"] == 0
+    budget.take()
+    budget.take()
+    with pytest.raises(RequestBudgetExhausted):
+        budget.take()
+    assert budget.remaining == 0
+    assert usage["requests"] == 2
+    # the lock is held by another thread: the request is not counted
+    lock = threading.Lock()
+    budget = RequestBudget(2, usage={}, lock=lock)
+    with lock:
+        assert not budget.take(blocking=False)
+    assert budget.take(blocking=False)
+    assert budget.remaining == 1
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_daily_request_budget(max_workers):
+    config = {"checkpoint_interval": 1, "max_workers": max_workers}
+    with MockATInternetAPI(rows_per_day=3) as api:
+        full_records, _ = committed(sync(api, config))
+        full_requests = api.requests
+
+    # the sync stops cleanly once the budget is spent, and saves where it stopped
+    budget = full_requests // 2
+    with MockATInternetAPI(rows_per_day=3) as api:
+        records, state = committed(sync(api, dict(config, daily_request_budget=budget)))
+        assert api.requests == budget
+    assert state["request_budget"]["requests"] == budget
+    assert "cursor" in state["bookmarks"]["hourly_visits"]
+
+    # the next run of the day only has the rest of the budget
+    with MockATInternetAPI(rows_per_day=3) as api:
+        messages = sync(api, dict(config, daily_request_budget=budget), state=state)
+        assert api.requests == 0
+    assert committed(messages)[0] == []
+
+    # a bigger budget: the sync resumes where it stopped
+    with MockATInternetAPI(rows_per_day=3) as api:
+        messages = sync(
+            api, dict(config, daily_request_budget=2 * full_requests), state=state
+        )
+    resumed_records = [m["record"] for m in messages if m["type"] == "RECORD"]
+    assert row_keys(records + resumed_records) == row_keys(full_records)
+    assert "cursor" not in messages[-1]["value"]["bookmarks"]["hourly_visits"]
@@ -0,0 +1,129 @@
+import pytest
+
+from tap_atinternet.streams import GeoVisitsStream, HourlyVisitsStream
+from tap_atinternet.tests.helpers import records_of, sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+from tap_atinternet.transform import (
+    build_page_transformer,
+    build_row_transformer,
+    coerce,
+)
+from tap_atinternet.utils import property_list_to_str
+
+
+def get_transformer(stream_class, build=build_row_transformer):
+    return build(
+        stream_class.schema,
+        property_list_to_str(stream_class.metrics)
+        + property_list_to_str(stream_class.properties),
+    )
+
+
+def test_coerce():
+    assert coerce(int, "12") == 12
+    assert coerce(float, "1.5") == 1.5
+    # values that don't parse, and missing values, are kept as they are
+    assert coerce(int, "N/A") == "N/A"
+    assert coerce(int, None) is None
+
+
+def test_hourly_transformer():
+    transform = get_transformer(HourlyVisitsStream)
+    row = {"m_visits": 3, "date": "2022-05-02", "visit_hour": "N/A"}
+    assert transform(row) == {"m_visits": 3, "date": "2022-05-02", "visit_hour": -1}
+    # no derived date for a daily stream
+    assert "date" not in transform({"m_visits": 3, "visit_hour": 4})
+
+
+def test_monthly_transformer():
+    transform = get_transformer(GeoVisitsStream)
+    row = transform(
+        {
+            "m_visits": "12",
+            "m_time_spent_per_visits": "1.5",
+            "date_year": 2022,
+            "date_month": "May",
+        }
+    )
+    assert row["date"] == "2022-05-01"
+    assert row["m_visits"] == 12
+    assert row["m_time_spent_per_visits"] == 1.5
+    assert "visit_hour" not in row
+    assert transform({"date_year": 2021, "date_month": "December"})["date"] == (
+        "2021-12-01"
+    )
+    # values that don't parse are left to the record validator
+    row = transform(
+        {
+            "m_visits": "N/A",
+            "m_bounces": "-",
+            "m_time_spent_per_visits": "",
+            "date_year": 2022,
+            "date_month": "May",
+        }
+    )
+    assert (row["m_visits"], row["m_bounces"], row["m_time_spent_per_visits"]) == (
+        "N/A",
+        "-",
+        "",
+    )
+
+
+def test_page_transformer():
+    rows = [
+        {
+            "m_visits": "12",
+            "m_time_spent_per_visits": "1.5",
+            "date_year": 2022,
+            "date_month": "May",
+            "other_metric": 3,
+        },
+        {
+            "m_visits": 4,
+            "m_time_spent_per_visits": 0.5,
+            "date_year": "2021",
+            "date_month": "December",
+            "other_metric": 4,
+        },
+    ]
+    transform_rows = get_transformer(GeoVisitsStream, build_page_transformer)
+    transform = get_transformer(GeoVisitsStream)
+    page = transform_rows([dict(row) for row in rows])
+    expected = [transform(dict(row)) for row in rows]
+    for row in expected:
+        # not a column of the stream
+        del row["other_metric"]
+    assert list(page) == expected
+    assert page.columns["m_visits"].typecode == "q"
+    assert list(get_transformer(HourlyVisitsStream, build_page_transformer)([])) == []
+    hourly = get_transformer(HourlyVisitsStream, build_page_transformer)(
+        [{"m_visits": 3, "visit_hour": "N/A"}, {"m_visits": 1, "visit_hour": "7"}]
+    )
+    assert list(hourly.columns["visit_hour"]) == [-1, 7]
+    geo = transform_rows(
+        [
+            {"m_visits": "N/A", "date_year": 2022, "date_month": "May"},
+            {"m_visits": "3", "date_year": 2022, "date_month": "May"},
+        ]
+    )
+    assert list(geo.columns["m_visits"]) == ["N/A", 3]
+
+
+@pytest.mark.parametrize("columnar_pages", [False, True])
+def test_sync_with_sentinel_metrics(columnar_pages):
+    sentinels = {"m_visits": "N/A", "m_bounces": "-"}
+    config = {"columnar_pages": columnar_pages}
+    with MockATInternetAPI(rows_per_day=3, sentinels=sentinels) as api:
+        records = records_of(sync(api, config, streams=("geo_visits",)))
+        assert len(records) == api.rows
+    # without record validation, the sentinel values are emitted as they are
+    assert "N/A" in {record["m_visits"] for record in records}
+    assert "-" in {record["m_bounces"] for record in records}
+    assert all(
+        record["m_visits"] == "N/A" or isinstance(record["m_visits"], int)
+        for record in records
+    )
+    assert all(
+        record["m_bounces"] == "-" or isinstance(record["m_bounces"], int)
+        for record in records
+    )
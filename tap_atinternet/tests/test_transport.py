@@ -0,0 +1,91 @@
+import asyncio
+import json
+import threading
+
+import pytest
+import requests
+from singer_sdk.exceptions import RetriableAPIError
+
+from tap_atinternet.tests.helpers import row_keys, sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+from tap_atinternet.throttle import RateLimiter, RequestBudget
+from tap_atinternet.transport import retry_delay
+
+httpx = pytest.importorskip("httpx")
+from tap_atinternet.transport import AsyncTransport  # noqa: E402
+
+
+def test_retry_delay():
+    assert 0 <= retry_delay(1, None) <= 2
+    response = requests.Response()
+    response.headers["Retry-After"] = "30"
+    assert retry_delay(1, response) == 30
+
+
+def validate(response: requests.Response) -> None:
+    if response.status_code >= 500:
+        raise RetriableAPIError(response.reason)
+
+
+def test_async_transport_retries(monkeypatch):
+    monkeypatch.setattr("tap_atinternet.transport.retry_delay", lambda *args: 0)
+    body = {
+        "space": {"s": [1]},
+        "columns": ["m_visits", "date"],
+        "sort": ["-m_visits", "date"],
+        "period": {"p1": [{"type": "D", "start": "2022-05-01", "end": "2022-05-02"}]},
+        "max-results": 10,
+        "page-num": 1,
+    }
+    with MockATInternetAPI(rows_per_day=2, error_rate=1.0) as api:
+        transport = AsyncTransport(RateLimiter(), max_connections=2, max_tries=2)
+        prepared_request = requests.Request("POST", api.url, json=body).prepare()
+        try:
+            response = transport.run(transport.send(prepared_request, validate))
+        finally:
+            transport.close()
+    # the first attempt failed with a 500 error
+    assert (api.requests, api.errors, transport.retries) == (2, 1, 1)
+    assert len(json.loads(response.content)["DataFeed"]["Rows"]) == 4
+
+
+def test_async_budget_does_not_block_the_loop():
+    body = {
+        "space": {"s": [1]},
+        "columns": ["m_visits", "date"],
+        "sort": ["-m_visits", "date"],
+        "period": {"p1": [{"type": "D", "start": "2022-05-01", "end": "2022-05-02"}]},
+        "max-results": 10,
+        "page-num": 1,
+    }
+    lock = threading.Lock()
+    usage: dict = {}
+    with MockATInternetAPI(rows_per_day=2) as api:
+        transport = AsyncTransport(RateLimiter(), budget=RequestBudget(5, usage, lock))
+        prepared_request = requests.Request("POST", api.url, json=body).prepare()
+        try:
+            with lock:
+                # e.g. a STATE message being written: the request waits for the budget
+                future = transport.submit(transport.send(prepared_request, validate))
+                # ...without blocking the event loop
+                transport.run(asyncio.sleep(0.01))
+                assert not future.done()
+            assert future.result(timeout=10).status_code == 200
+        finally:
+            transport.close()
+    assert usage["requests"] == api.requests == 1
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_async_sync(max_workers):
+    with MockATInternetAPI(rows_per_day=3) as api:
+        # the same windows as the async engine: planned ahead of time
+        records = sync(api, {"max_workers": 3})
+        requests_engine = api.requests
+    with MockATInternetAPI(rows_per_day=3) as api:
+        async_records = sync(api, {"http_engine": "async", "max_workers": max_workers})
+        async_engine = api.requests
+    assert row_keys(m["record"] for m in async_records if m["type"] == "RECORD") == (
+        row_keys(m["record"] for m in records if m["type"] == "RECORD")
+    )
+    assert async_engine <= requests_engine
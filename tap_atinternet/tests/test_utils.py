@@ -1,6 +1,11 @@
 import datetime
 
-from tap_atinternet.utils import get_next_month, get_start_end_days
+from tap_atinternet.utils import (
+    get_next_month,
+    get_page_size,
+    get_start_end_days,
+    is_last_page,
+)
 
 
 def test_get_next_month():
@@ -22,3 +27,18 @@ def test_get_start_end_days():
         datetime.date(2021, 1, 1),
         datetime.date(2021, 1, 31),
     )
+
+
+def test_is_last_page():
+    # full page: there may be more rows
+    assert not is_last_page(row_count=5000, max_results=5000)
+    # short page: no need to request the next one
+    assert is_last_page(row_count=4999, max_results=5000)
+    # max_results above the API limit: pages are capped to 10000 rows
+    assert not is_last_page(row_count=10000, max_results=20000)
+    assert is_last_page(row_count=9999, max_results=20000)
+
+
+def test_get_page_size():
+    assert get_page_size(5000) == 5000
+    assert get_page_size(20000) == 10000
@@ -0,0 +1,180 @@
+import pytest
+from singer_sdk.exceptions import ConfigValidationError
+
+from tap_atinternet.columnar import ColumnarPage, make_column
+from tap_atinternet.streams import GeoVisitsStream, HourlyVisitsStream
+from tap_atinternet.tests.helpers import other_messages, records_of, sync
+from tap_atinternet.tests.mock_api import MockATInternetAPI
+from tap_atinternet.utils import make_nullable, property_list_to_str
+from tap_atinternet.validation import InvalidRecordError, RecordValidator
+
+
+def get_validator(stream_class, strict: bool) -> RecordValidator:
+    # the schema of the streams with record validation: nullable metrics
+    metrics = property_list_to_str(stream_class.metrics)
+    schema = make_nullable(stream_class.schema, metrics)
+    return RecordValidator(
+        stream_class.name,
+        schema,
+        list(schema["properties"]),
+        strict=strict,
+        computed=["site_id"],
+        metrics=metrics,
+    )
+
+
+def hourly_record(**values) -> dict:
+    record = {
+        "m_visits": 3,
+        "m_unique_visitors": 2,
+        "m_bounces": 0,
+        "m_time_spent_per_visits": 1.5,
+        "date": "2022-05-02",
+        "visit_hour": 4,
+        "site_level2": "Main site",
+        "site_id": 1,
+    }
+    record.update(values)
+    return record
+
+
+@pytest.mark.parametrize("strict", [False, True])
+def test_validate_record(strict):
+    validator = get_validator(HourlyVisitsStream, strict)
+    assert validator.validate(hourly_record()) == hourly_record()
+    # coercions
+    assert validator.validate(
+        hourly_record(m_visits="12", m_time_spent_per_visits=2, visit_hour="N/A")
+    ) == hourly_record(m_visits=12, m_time_spent_per_visits=2.0, visit_hour=-1)
+    assert validator.validate(hourly_record(m_bounces=4.0))["m_bounces"] == 4
+    # the metrics are nullable
+    assert validator.validate(
+        hourly_record(m_visits="-", m_time_spent_per_visits="N/A")
+    ) == hourly_record(m_visits=None, m_time_spent_per_visits=None)
+    for invalid in (
+        hourly_record(m_visits="many"),
+        hourly_record(m_bounces=0.5),
+        hourly_record(m_visits=True),
+        hourly_record(site_level2=None),
+    ):
+        with pytest.raises(InvalidRecordError):
+            validator.validate(invalid)
+    record = hourly_record()
+    del record["date"]
+    with pytest.raises(InvalidRecordError, match="'date'"):
+        validator.validate(record)
+
+
+def test_strict_mode():
+    fast = get_validator(HourlyVisitsStream, strict=False)
+    strict = get_validator(HourlyVisitsStream, strict=True)
+    for record in (
+        hourly_record(date="2022-13-01"),
+        hourly_record(site_level2=5),
+        hourly_record(m_time_spent_per_visits=float("nan")),
+    ):
+        # not checked in fast mode
+        fast.validate(dict(record))
+        with pytest.raises(InvalidRecordError):
+            strict.validate(record)
+
+
+@pytest.mark.parametrize("strict", [False, True])
+def test_validate_page(strict):
+    validator = get_validator(GeoVisitsStream, strict)
+    kinds = {
+        "m_visits": "integer",
+        "m_unique_visitors": "integer",
+        "m_bounces": "",
+        "m_time_spent_per_visits": "number",
+        "date_year": "integer",
+        "date_month": "string",
+        "geo_country": "string",
+        "geo_region": "string",
+        "geo_city": "string",
+        "date": "string",
+    }
+    values = {
+        "m_visits": [3, 2],
+        "m_unique_visitors": [3, 1],
+        "m_bounces": ["1", "N/A"],
+        "m_time_spent_per_visits": [1.5, 2.0],
+        "date_year": [2022, 2022],
+        "date_month": ["May", "May"],
+        "geo_country": ["France", "France"],
+        "geo_region": ["IDF", "IDF"],
+        "geo_city": ["Paris", "Paris"],
+        "date": ["2022-05-01", "2022-05-01"],
+    }
+    page = ColumnarPage(
+        {name: make_column(values[name], kind) for name, kind in kinds.items()}, 2
+    )
+    validator.validate_page(page)
+    assert [row["m_bounces"] for row in page] == [1, None]
+    # the values of dictionary-encoded columns are checked once per distinct value
+    page.columns["date"].values[0] = "2022-05"
+    if strict:
+        with pytest.raises(InvalidRecordError):
+            validator.validate_page(page)
+    else:
+        validator.validate_page(page)
+    del page.columns["geo_city"]
+    with pytest.raises(InvalidRecordError, match="'geo_city'"):
+        validator.validate_page(page)
+
+
+@pytest.mark.parametrize("columnar_pages", [False, True])
+def test_validated_sync(columnar_pages):
+    with MockATInternetAPI(rows_per_day=3) as api:
+        expected = sync(api, {})
+    config = {"record_validation": "strict", "columnar_pages": columnar_pages}
+    with MockATInternetAPI(rows_per_day=3) as api:
+        messages = sync(api, config)
+    assert records_of(messages) == records_of(expected)
+    # the metrics are only nullable with record validation
+    metrics = property_list_to_str(HourlyVisitsStream.metrics)
+    for message in expected:
+        if message["type"] == "SCHEMA":
+            assert "null" not in message["schema"]["properties"]["m_visits"]["type"]
+            message["schema"] = make_nullable(message["schema"], metrics)
+    assert other_messages(messages) == other_messages(expected)
+
+
+def test_strict_mode_non_nullable_metrics():
+    # without the nullable metrics of the streams with record validation, "N/A"
+    # metrics are invalid in strict mode (-1 is not a number of visits)
+    validator = RecordValidator(
+        HourlyVisitsStream.name,
+        HourlyVisitsStream.schema,
+        list(HourlyVisitsStream.schema["properties"]),
+        strict=True,
+        computed=["site_id"],
+        metrics=property_list_to_str(HourlyVisitsStream.metrics),
+    )
+    with pytest.raises(InvalidRecordError, match="'m_visits'"):
+        validator.validate(hourly_record(m_visits="N/A"))
+
+
+@pytest.mark.parametrize("columnar_pages", [False, True])
+@pytest.mark.parametrize("record_validation", ["fast", "strict"])
+def test_sentinel_metrics_sync(record_validation, columnar_pages):
+    config = {"record_validation": record_validation, "columnar_pages": columnar_pages}
+    sentinels = {"m_visits": "-", "m_time_spent_per_visits": "N/A"}
+    with MockATInternetAPI(rows_per_day=3, sentinels=sentinels) as api:
+        records = records_of(sync(api, config, streams=("geo_visits",)))
+    # the undefined metrics are emitted as null, the others are cast
+    undefined = [record for record in records if record["m_visits"] is None]
+    assert 0 < len(undefined) < len(records)
+    assert all(record["m_time_spent_per_visits"] is None for record in undefined)
+    assert all(
+        isinstance(record["m_visits"], int)
+        and isinstance(record["m_time_spent_per_visits"], float)
+        for record in records
+        if record["m_visits"] is not None
+    )
+
+
+def test_unknown_validation_mode():
+    with MockATInternetAPI(rows_per_day=3) as api:
+        with pytest.raises(ConfigValidationError):
+            sync(api, {"record_validation": "lenient"})
@@ -0,0 +1,170 @@
+"""Client-side request throttling for the AT Internet API: rate limiters and daily request budget."""
+import datetime
+import email.utils
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import requests
+
+# pause of all the requests after a 429 response without a Retry-After header, in seconds
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class RequestBudgetExhausted(Exception):
+    """Raised when the daily request budget is spent."""
+
+
+def parse_retry_after(response: Optional[requests.Response]) -> Optional[float]:
+    """
+    Return the delay (in seconds) of the `Retry-After` header of a response, either a number of seconds or an
+    HTTP date, or None if there is no such header.
+    """
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(
+        0.0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    )
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: at most `max_per_second` requests per second on average, in bursts of up to
+    `burst` requests.
+
+    A `max_per_second` of 0 (or less) disables the limit: `wait()` returns immediately, except after a 429
+    response. The limiter adapts to the API signals:
+        - `penalize` (429 response): no request is allowed before the Retry-After delay, and the rate is halved
+        - `recover` (successful response): the rate increases back to `max_per_second`, step by step
+    `waited` is the total delay imposed by the limiter, in seconds.
+    """
+
+    def __init__(self, max_per_second: float = 0, burst: int = 1):
+        self.max_per_second = max(max_per_second, 0)
+        self.rate = self.max_per_second
+        self.burst = max(burst, 1)
+        self.waited = 0.0
+        self._lock = threading.Lock()
+        # time of the next request if requests were evenly spaced ("theoretical arrival time")
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+
+    def reserve(self) -> float:
+        """
+        Reserve the next request slot, and return how long to wait for it (in seconds) without waiting.
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._paused_until)
+            if self.rate:
+                interval = 1 / self.rate
+                slot = max(self._next_slot, start)
+                self._next_slot = slot + interval
+                # a full bucket lets `burst` requests through without waiting
+                start = max(start, slot - (self.burst - 1) * interval)
+            delay = start - now
+            self.waited += delay
+        return delay
+
+    def wait(self) -> float:
+        """
+        Block until the next request is allowed, and return the time spent waiting (in seconds).
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def penalize(self, retry_after: Optional[float] = None) -> None:
+        """
+        Pause all the requests for `retry_after` seconds, and halve the rate (down to 1/16 of the maximum).
+        """
+        if retry_after is None:
+            retry_after = DEFAULT_RETRY_AFTER
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self.rate = max(self.rate / 2, self.max_per_second / 16)
+
+    def recover(self) -> None:
+        """
+        Increase the rate by 1/16 of the maximum, up to the maximum.
+        """
+        if self.rate < self.max_per_second:
+            with self._lock:
+                self.rate = min(
+                    self.max_per_second, self.rate + self.max_per_second / 16
+                )
+
+
+def reserve_all(limiters: Iterable[RateLimiter]) -> float:
+    """
+    Reserve the next request slot of every limiter, and return how long to wait for all of them (in seconds).
+    """
+    return max((limiter.reserve() for limiter in limiters), default=0.0)
+
+
+def wait_all(limiters: Iterable[RateLimiter]) -> float:
+    """
+    Block until all the limiters allow the next request, and return the time spent waiting (in seconds).
+    """
+    delay = reserve_all(limiters)
+    if delay > 0:
+        time.sleep(delay)
+    return delay
+
+
+class RequestBudget:
+    """
+    Thread-safe counter of the requests sent during the current (UTC) day, raising `RequestBudgetExhausted` once
+    `daily_limit` requests have been sent.
+
+    `usage` ({"date": ..., "requests": ...}) is kept in the tap state, so that all the runs of a day share the
+    same budget. `lock` is held while updating it: pass the lock of the state writer.
+    """
+
+    def __init__(
+        self, daily_limit: int, usage: Dict, lock: Optional[threading.Lock] = None
+    ):
+        self.daily_limit = daily_limit
+        self.usage = usage
+        self._lock = lock or threading.Lock()
+        self._roll_over()
+
+    def _roll_over(self) -> None:
+        today = datetime.datetime.utcnow().date().isoformat()
+        if self.usage.get("date") != today:
+            self.usage["date"] = today
+            self.usage["requests"] = 0
+
+    @property
+    def remaining(self) -> int:
+        with self._lock:
+            self._roll_over()
+            return max(0, self.daily_limit - self.usage["requests"])
+
+    def take(self, blocking: bool = True) -> bool:
+        """
+        Count one request, or raise `RequestBudgetExhausted` if the budget of the day is spent.
+
+        With `blocking=False`, return False without counting the request if the lock is held by another thread
+        (e.g. while a STATE message is written), instead of waiting for it.
+        """
+        if not self._lock.acquire(blocking):
+            return False
+        try:
+            self._roll_over()
+            if self.usage["requests"] >= self.daily_limit:
+                raise RequestBudgetExhausted(
+                    f"Daily request budget spent ({self.daily_limit} requests on {self.usage['date']})"
+                )
+            self.usage["requests"] += 1
+        finally:
+            self._lock.release()
+        return True
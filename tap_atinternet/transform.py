@@ -0,0 +1,154 @@
+"""Row transformers, applied to every row in ATInternetStream.post_process (or to whole pages, see `columnar_pages`)."""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from tap_atinternet.columnar import ColumnarPage, make_column
+from tap_atinternet.utils import month_str_to_int
+
+RowTransformer = Callable[[dict], dict]
+PageTransformer = Callable[[List[dict]], ColumnarPage]
+
+
+def get_coercions(properties: dict, columns: List[str]) -> List[Tuple[str, Callable]]:
+    """
+    Return the (column, cast function) pairs of the integer and number columns.
+    """
+    coercions: List[Tuple[str, Callable]] = []
+    for name in columns:
+        types = properties.get(name, {}).get("type", [])
+        if "integer" in types:
+            coercions.append((name, int))
+        elif "number" in types:
+            coercions.append((name, float))
+    return coercions
+
+
+def coerce(cast: Callable[[str], Any], value: Optional[str]) -> Any:
+    """
+    Return a string value cast to an integer or a number, or unchanged if it doesn't parse (e.g. "N/A", "-"):
+    such values are left to the record validator, if any (see `RecordValidator`). Missing values (None) are
+    returned as they are.
+    """
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        return value
+
+
+class MonthDates(Dict[Tuple[int, str], str]):
+    """
+    The first days of the months (e.g. "2022-05-01"), keyed by the (date_year, date_month) columns of the rows,
+    computed on the first lookup of each month.
+    """
+
+    def __missing__(self, key: Tuple[int, str]) -> str:
+        year, month = int(key[0]), month_str_to_int[key[1]]
+        date = self[key] = f"{year:04d}-{month:02d}-01"
+        return date
+
+
+def build_row_transformer(schema: dict, columns: List[str]) -> RowTransformer:
+    """
+    Compile a function transforming the rows of a stream, given its schema and the columns requested to the API.
+
+    All the checks that only depend on the stream (does it have a 'visit_hour'? does it need a derived 'date'?
+    which fields must be numbers?) are done once here, instead of once per row.
+    The transformer:
+        - replaces the "N/A" 'visit_hour' by -1 ("N/A" does not work when casting to integers, and we don't want
+        null values either since it will be used in the composite primary key)
+        - coerces the integer and number fields returned as strings, except the values that don't parse
+        (e.g. "N/A" or "-" metrics), kept as they are (see `coerce`)
+        - adds a 'date' column for the streams requesting monthly data from the API (first day of the month),
+        memoized per (date_year, date_month) since it is the same for all the rows of a month
+    """
+    properties = schema["properties"]
+    has_visit_hour = "visit_hour" in columns
+    derive_date = "date" in properties and "date" not in columns
+    coercions = get_coercions(
+        properties, [name for name in columns if name != "visit_hour"]
+    )
+    dates = MonthDates()
+
+    def transform(row: dict) -> dict:
+        if has_visit_hour:
+            visit_hour = row.get("visit_hour")
+            if visit_hour == "N/A":
+                row["visit_hour"] = -1
+            elif visit_hour.__class__ is str:
+                row["visit_hour"] = coerce(int, visit_hour)
+        for name, cast in coercions:
+            value = row.get(name)
+            if value.__class__ is str:
+                try:
+                    row[name] = cast(value)
+                except ValueError:
+                    # e.g. "N/A": see `coerce`
+                    pass
+        if derive_date:
+            row["date"] = dates[(row["date_year"], row["date_month"])]
+        return row
+
+    return transform
+
+
+def get_column_kind(properties: dict, name: str) -> str:
+    """
+    Return the kind of the column (see `make_column`): 'integer', 'number', 'string', or '' for the other types.
+    """
+    types = properties[name].get("type", [])
+    for kind in ("integer", "number", "string"):
+        if kind in types:
+            return kind
+    return ""
+
+
+def build_page_transformer(schema: dict, columns: List[str]) -> PageTransformer:
+    """
+    Compile a function transforming the decoded rows of a page into a `ColumnarPage`, given the schema of the stream
+    and the columns requested to the API.
+
+    The rows are transformed like with `build_row_transformer`, but one column at a time: "N/A" 'visit_hour'
+    replaced by -1, integer and number columns coerced (see `coerce`), and 'date' derived from the
+    (date_year, date_month) columns. The columns that are not in the schema are dropped.
+    """
+    properties = schema["properties"]
+    derive_date = "date" in properties and "date" not in columns
+    casts = dict(
+        get_coercions(properties, [name for name in columns if name != "visit_hour"])
+    )
+
+    def transform(rows: List[dict]) -> ColumnarPage:
+        if not rows:
+            return ColumnarPage({}, 0)
+        page_columns = {}
+        for name in rows[0]:
+            if name not in properties:
+                continue
+            values = [row.get(name) for row in rows]
+            if name == "visit_hour":
+                values = [
+                    -1
+                    if value == "N/A"
+                    else coerce(int, value)
+                    if value.__class__ is str
+                    else value
+                    for value in values
+                ]
+            elif name in casts:
+                cast = casts[name]
+                values = [
+                    coerce(cast, value) if value.__class__ is str else value
+                    for value in values
+                ]
+            page_columns[name] = make_column(values, get_column_kind(properties, name))
+        if derive_date:
+            dates = MonthDates()
+            values = [
+                dates[key]
+                for key in zip(page_columns["date_year"], page_columns["date_month"])
+            ]
+            page_columns["date"] = make_column(values, "string")
+        return ColumnarPage(page_columns, len(rows))
+
+    return transform
@@ -0,0 +1,181 @@
+"""Asynchronous HTTP transport: all the API requests of the tap on a single event loop."""
+import asyncio
+import concurrent.futures
+import random
+import threading
+from typing import Any, Callable, Coroutine, List, Optional, TypeVar
+
+import requests
+from singer_sdk.exceptions import RetriableAPIError
+
+from tap_atinternet.throttle import (
+    RateLimiter,
+    RequestBudget,
+    parse_retry_after,
+    reserve_all,
+)
+
+try:
+    # optional dependency (`pip install tap-atinternet[async]`), only needed with `http_engine: async`
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None  # type: ignore[assignment]
+
+try:
+    # HTTP/2 support of httpx (`pip install httpx[http2]`)
+    import h2  # noqa: F401
+
+    HTTP2 = True
+except ImportError:  # pragma: no cover
+    HTTP2 = False
+
+T = TypeVar("T")
+
+
+def to_requests_response(
+    prepared_request: requests.PreparedRequest, response: "httpx.Response"
+) -> requests.Response:
+    """
+    Convert an httpx response to a (fully read) `requests` response, so that the same code handles both engines.
+    """
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.reason = response.reason_phrase
+    converted.headers.update(response.headers)
+    converted._content = response.content
+    converted.request = prepared_request
+    converted.url = prepared_request.url or ""
+    converted.elapsed = response.elapsed
+    return converted
+
+
+def retry_delay(attempt: int, response: Optional[requests.Response]) -> float:
+    """
+    Return how long to wait before retrying a request: an exponential backoff with full jitter, or the
+    `Retry-After` delay of the response if it is longer.
+    """
+    delay = random.uniform(0, min(60, 2**attempt))
+    retry_after = parse_retry_after(response)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class AsyncTransport:
+    """
+    Event loop running in a background thread, sending the API requests of all the streams with a single
+    `httpx.AsyncClient` (a pool of keep-alive connections, using HTTP/2 if available).
+
+    Streams submit coroutines with `submit`, and get back a `concurrent.futures.Future`: they keep their
+    synchronous request loop, while any number of requests are in flight on the event loop. At most
+    `max_connections` requests are sent at the same time.
+
+    Each attempt of a request waits for the rate limiters, and counts in the daily request `budget` (if any).
+    Nothing blocks the event loop: the budget lock is waited for in a thread of the loop default executor, where
+    the streams also decode the pages and read or write the response cache (see `run_blocking`).
+    """
+
+    def __init__(
+        self,
+        rate_limiter: RateLimiter,
+        max_connections: int = 10,
+        timeout: float = 300,
+        max_tries: int = 5,
+        budget: Optional[RequestBudget] = None,
+    ):
+        if httpx is None:
+            raise ImportError(
+                "The 'async' HTTP engine requires the httpx package "
+                "(`pip install tap-atinternet[async]`)"
+            )
+        self.rate_limiter = rate_limiter
+        self.budget = budget
+        self.max_tries = max_tries
+        self.retries = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+        async def start():
+            self._semaphore = asyncio.Semaphore(max_connections)
+            self._client = httpx.AsyncClient(
+                http2=HTTP2,
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                ),
+            )
+
+        self.run(start())
+
+    def submit(
+        self, coroutine: Coroutine[Any, Any, T]
+    ) -> "concurrent.futures.Future[T]":
+        """Schedule a coroutine on the event loop, from any other thread."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine on the event loop, and wait for its result."""
+        return self.submit(coroutine).result()
+
+    async def run_blocking(self, function: Callable[..., T], *args: Any) -> T:
+        """
+        Call a blocking function (locks, file I/O, CPU-bound decoding) in the default executor of the event loop,
+        so that the other requests keep going in the meantime.
+        """
+        return await self._loop.run_in_executor(None, function, *args)
+
+    async def send(
+        self,
+        prepared_request: requests.PreparedRequest,
+        validate: Callable[[requests.Response], None],
+        limiters: Optional[List[RateLimiter]] = None,
+        on_wait: Optional[Callable[[float], None]] = None,
+        on_retry: Optional[Callable[[], None]] = None,
+    ) -> requests.Response:
+        """
+        Send a request after waiting for the rate `limiters` (by default, the shared rate limiter), and check the
+        response with `validate`. `on_wait` is called with the time spent waiting for the limiters, if any, and
+        `on_retry` before each retry.
+
+        Requests failing with a `RetriableAPIError` (5xx and 429 responses) or a timeout are retried, up to
+        `max_tries` attempts, with an exponential backoff with jitter (see `retry_delay`). Each retry waits
+        for the rate limiter again.
+        """
+        attempt = 1
+        while True:
+            if self.budget is not None and not self.budget.take(blocking=False):
+                # the lock of the budget is held by a thread writing the state
+                await self.run_blocking(self.budget.take)
+            delay = reserve_all(limiters or [self.rate_limiter])
+            if delay > 0:
+                if on_wait is not None:
+                    on_wait(delay)
+                await asyncio.sleep(delay)
+            response = None
+            try:
+                async with self._semaphore:
+                    httpx_response = await self._client.request(
+                        prepared_request.method,
+                        prepared_request.url,
+                        content=prepared_request.body,
+                        headers=dict(prepared_request.headers),
+                    )
+                response = to_requests_response(prepared_request, httpx_response)
+                validate(response)
+                return response
+            except (RetriableAPIError, httpx.TimeoutException):
+                if attempt == self.max_tries:
+                    raise
+            self.retries += 1
+            if on_retry is not None:
+                on_retry()
+            await asyncio.sleep(retry_delay(attempt, response))
+            attempt += 1
+
+    def close(self) -> None:
+        self.run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -1,7 +1,12 @@
 import datetime
+from typing import Any, Callable, Generic, List, Optional, Tuple, TypeVar
 
 from singer_sdk import typing as th  # JSON schema typing helpers
-from typing import List, Tuple, Optional
+
+# AT Internet API limit on the 'max-results' parameter: bigger values are capped to this page size
+API_MAX_PAGE_SIZE = 10000
+
+T = TypeVar("T")
 
 
 def property_list_to_str(properties: th.PropertiesList) -> List[str]:
@@ -29,12 +34,77 @@ def merge_properties_lists(*properties_lists: th.PropertiesList) -> th.Propertie
     return result
 
 
+def add_properties(schema: dict, properties: th.PropertiesList) -> dict:
+    """
+    Return a copy of the JSON schema of an object, with the properties of a list added
+    """
+    added = properties.to_dict()
+    return dict(
+        schema,
+        properties={**schema["properties"], **added["properties"]},
+        required=schema.get("required", []) + added.get("required", []),
+    )
+
+
+def make_nullable(schema: dict, names: List[str]) -> dict:
+    """
+    Return a copy of the JSON schema of an object, with some of its properties made nullable and not required
+    """
+    properties = dict(schema["properties"])
+    for name in names:
+        types = properties[name]["type"]
+        if "null" not in types:
+            properties[name] = dict(properties[name], type=types + ["null"])
+    nullable = dict(schema, properties=properties)
+    if "required" in schema:
+        nullable["required"] = [
+            name for name in schema["required"] if name not in names
+        ]
+    return nullable
+
+
+class lazy_class_attribute(Generic[T]):
+    """
+    Class attribute computed from the class on first access (e.g. a stream schema), then stored on the class.
+
+    `build` is called with the class the attribute is read from (typed Any, since it is usually a subclass with
+    more attributes than the class defining the attribute).
+
+    Example:
+        class Stream:
+            columns = lazy_class_attribute(lambda cls: sorted(cls.metrics))
+    """
+
+    def __init__(self, build: Callable[[Any], T]):
+        self.build = build
+        self.name = ""
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+
+    def __get__(self, instance: Any, owner: type) -> T:
+        value = self.build(owner)
+        # replace the descriptor: the next accesses are plain attribute reads
+        setattr(owner, self.name, value)
+        return value
+
+
 def get_next_month(year: int, month: int) -> Tuple[int, int]:
     # first day of next month
     next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
     return next_month.year, next_month.month
 
 
+def is_closed_month(
+    year: int, month: int, today: Optional[datetime.date] = None
+) -> bool:
+    """
+    Return True if the (year, month) is over, i.e. its data will not change anymore
+    """
+    today = today or datetime.date.today()
+    return (year, month) < (today.year, today.month)
+
+
 def get_start_end_days(
     year: int, month: int, min_start_date: Optional[datetime.date] = None
 ) -> Tuple[datetime.date, datetime.date]:
@@ -57,6 +127,26 @@ def get_start_end_days(
     return start_date, end_date
 
 
+def get_page_size(max_results: int) -> int:
+    """
+    Return the number of rows of a full page: `max_results`, capped to the API limit
+    """
+    return min(max_results, API_MAX_PAGE_SIZE)
+
+
+def is_last_page(row_count: int, max_results: int) -> bool:
+    """
+    Return True if there is no need to request the next page.
+
+    Without this check, we would only stop after receiving an empty page, which wastes
+    one request per period. Pages hold `max_results` rows, up to the API limit: a page
+    that is not full is the last one.
+    Note: getData doesn't return the total row count of a request (that is the
+    `getRowCount` endpoint), so the number of pages is not known in advance.
+    """
+    return row_count < get_page_size(max_results)
+
+
 # also possible with datetime.strptime, but requires changing the locale..
 month_str_to_int = {
     "January": 1,
@@ -0,0 +1,231 @@
+"""Record validators, compiled once per stream from its schema (see the `record_validation` setting)."""
+import datetime
+import math
+from array import array
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from tap_atinternet.columnar import ColumnarPage, DictionaryColumn
+
+VALIDATION_MODES = ("off", "fast", "strict")
+# values returned by the API for undefined properties or metrics
+NULL_SENTINELS = frozenset(["N/A", "-", ""])
+# typecodes of the typed arrays holding valid values of each kind (see `make_column`)
+ARRAY_TYPECODES = {"integer": "q", "number": "d"}
+
+
+class InvalidRecordError(Exception):
+    """A record does not match the schema of its stream."""
+
+
+class FieldSpec(NamedTuple):
+    name: str
+    # 'integer', 'number', 'date', 'string', or '' for the other types (not checked)
+    kind: str
+    required: bool
+    nullable: bool
+    metric: bool
+
+
+def get_field_specs(
+    schema: dict, fields: Sequence[str], metrics: Sequence[str] = ()
+) -> List[FieldSpec]:
+    """Return the specs of the `fields` of a JSON schema (`metrics` are measures)."""
+    specs = []
+    required = set(schema.get("required", []))
+    for name in fields:
+        definition = schema["properties"][name]
+        types = definition.get("type", [])
+        if isinstance(types, str):
+            types = [types]
+        kind = ""
+        for json_type in ("integer", "number", "string"):
+            if json_type in types:
+                kind = json_type
+                break
+        if kind == "string" and definition.get("format") == "date":
+            kind = "date"
+        specs.append(
+            FieldSpec(name, kind, name in required, "null" in types, name in metrics)
+        )
+    return specs
+
+
+def is_date(value: Any) -> bool:
+    if value.__class__ is not str or len(value) != 10:
+        return False
+    try:
+        datetime.date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+class RecordValidator:
+    """
+    Validator and coercer of the records of a stream, compiled once from its schema and selected fields.
+
+    For each field, values are checked against the type of the schema, and coerced when possible:
+        - integers and numbers returned as strings are cast
+        - the "N/A" (and similar) values of the API in integer and number fields are replaced by None if the field
+        is nullable (e.g. the metrics), and by -1 for required integers (e.g. 'visit_hour', part of the primary key)
+        - in strict mode, "N/A" `metrics` that are not nullable are invalid (-1 is not a number of visits)
+    A record that can't be fixed raises an `InvalidRecordError`.
+
+    Two modes are available:
+        - 'fast': only the required fields, integers and numbers are checked, with a class check per value
+        - 'strict': also checks that strings are strings, dates are valid ISO 8601 dates, and numbers are finite
+    Records can be validated one at a time (`validate`), or a whole `ColumnarPage` at once (`validate_page`):
+    typed arrays are valid as a whole, and the values of dictionary-encoded columns are checked once per distinct
+    value.
+    """
+
+    def __init__(
+        self,
+        stream_name: str,
+        schema: dict,
+        fields: Sequence[str],
+        strict: bool = False,
+        computed: Sequence[str] = (),
+        metrics: Sequence[str] = (),
+    ):
+        self.stream_name = stream_name
+        self.strict = strict
+        self.specs = get_field_specs(schema, fields, metrics)
+        # fields added to the records after their page is decoded, not checked by `validate_page`
+        self.computed = frozenset(computed)
+        self._checks: Dict[str, Callable[[Any], bool]] = {
+            "integer": (lambda value: value.__class__ is int),
+            "number": (
+                (lambda value: value.__class__ is float and math.isfinite(value))
+                if strict
+                else (lambda value: value.__class__ is float)
+            ),
+        }
+        if strict:
+            self._checks["string"] = lambda value: value.__class__ is str
+            self._checks["date"] = is_date
+        # fields checked by `validate`: the required fields, and the fields of a checked kind
+        self._row_specs = [
+            spec for spec in self.specs if spec.required or spec.kind in self._checks
+        ]
+
+    def _error(self, spec: FieldSpec, value: Any) -> InvalidRecordError:
+        expected = spec.kind or "a value"
+        return InvalidRecordError(
+            f"Stream '{self.stream_name}': invalid value {value!r} for the field '{spec.name}' "
+            f"(expected {expected}{'' if spec.nullable else ', not null'})"
+        )
+
+    def fix(self, spec: FieldSpec, value: Any) -> Any:
+        """Return the value of a field, coerced to the type of its spec, or raise an InvalidRecordError."""
+        if value is None or (
+            value.__class__ is str
+            and value in NULL_SENTINELS
+            and spec.kind in ARRAY_TYPECODES
+        ):
+            return self._fix_null(spec, value)
+        check = self._checks.get(spec.kind)
+        if check is None or check(value):
+            return value
+        fixed = self._coerce(spec.kind, value)
+        if fixed is None or not check(fixed):
+            raise self._error(spec, value)
+        return fixed
+
+    def _fix_null(self, spec: FieldSpec, value: Any) -> Any:
+        if spec.nullable:
+            return None
+        if (
+            value is not None
+            and spec.kind == "integer"
+            and not (self.strict and spec.metric)
+        ):
+            return -1
+        raise self._error(spec, value)
+
+    @staticmethod
+    def _coerce(kind: str, value: Any) -> Any:
+        """Return the value cast to an integer or a number, or None if it can't be."""
+        try:
+            if kind == "integer" and (
+                value.__class__ is str
+                or value.__class__ is float
+                and value.is_integer()
+            ):
+                return int(value)
+            if kind == "number" and (value.__class__ is str or value.__class__ is int):
+                return float(value)
+        except ValueError:
+            pass
+        return None
+
+    def validate(self, record: dict) -> dict:
+        """Validate and coerce a record in place, and return it."""
+        checks = self._checks
+        for spec in self._row_specs:
+            value = record.get(spec.name)
+            if value is None:
+                if spec.name not in record and not spec.required:
+                    continue
+            else:
+                check = checks.get(spec.kind)
+                if check is None or check(value):
+                    continue
+            record[spec.name] = self.fix(spec, value)
+        return record
+
+    def validate_page(self, page: ColumnarPage) -> ColumnarPage:
+        """Validate and coerce all the records of a page in place, one column at a time, and return the page."""
+        columns = page.columns
+        for spec in self.specs:
+            if spec.name not in columns:
+                if spec.required and page.length and spec.name not in self.computed:
+                    raise self._error(spec, None)
+                continue
+            column = columns[spec.name]
+            if isinstance(column, array):
+                if column.typecode == ARRAY_TYPECODES.get(spec.kind) and (
+                    spec.kind != "number"
+                    or not self.strict
+                    or all(map(math.isfinite, column))
+                ):
+                    continue
+                column = columns[spec.name] = list(column)
+            if isinstance(column, DictionaryColumn):
+                # only the distinct values
+                column.values = self._validate_values(spec, column.values)
+            else:
+                columns[spec.name] = self._validate_values(spec, column)
+        return page
+
+    def _validate_values(self, spec: FieldSpec, values: List[Any]) -> List[Any]:
+        check = self._checks.get(spec.kind)
+        if check is None and not spec.required:
+            return values
+        for i, value in enumerate(values):
+            if value is None or check is not None and not check(value):
+                values[i] = self.fix(spec, value)
+        return values
+
+
+def build_record_validator(
+    mode: str,
+    stream_name: str,
+    schema: dict,
+    fields: Sequence[str],
+    computed: Sequence[str] = (),
+    metrics: Sequence[str] = (),
+) -> Optional[RecordValidator]:
+    """
+    Return the record validator of a stream for a `record_validation` mode, or None if validation is 'off'.
+    """
+    if mode == "off":
+        return None
+    return RecordValidator(
+        stream_name,
+        schema,
+        fields,
+        strict=mode == "strict",
+        computed=computed,
+        metrics=metrics,
+    )